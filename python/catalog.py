@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Keep an indexed SQLite catalog of the documents jsonify.py writes.
+
+With --catalog, jsonify.py records one row per document: id, url,
+title, product, release, booktitle, date, stream_size, a content hash,
+the number of child documents, and the path of the JSON file relative
+to the output directory. facets.py, solrsync.py, and movesite.py accept
+a catalog wherever they accept a jsonify.py output directory, and then
+run indexed queries instead of walking the tree and parsing every file.
+
+A catalog can also be built from an existing output directory, and
+summarized:
+    $ python3 catalog.py --scan docs.hortonworks.com-json corehw.catalog
+    $ python3 catalog.py corehw.catalog
+
+For usage, run:
+    python3 catalog.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+
+# Fields that change without the document changing
+VOLATILE_FIELDS = ('date', 'x_parsed_by')
+
+# Columns of the documents table, in order
+FIELDS = ('id', 'url', 'title', 'product', 'release', 'booktitle', 'date',
+          'stream_size', 'hash', 'children', 'path')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    url TEXT,
+    title TEXT,
+    product TEXT,
+    release TEXT,
+    booktitle TEXT,
+    date TEXT,
+    stream_size INTEGER,
+    hash TEXT,
+    children INTEGER,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_product ON documents (product);
+CREATE INDEX IF NOT EXISTS documents_release ON documents (release);
+CREATE INDEX IF NOT EXISTS documents_booktitle ON documents (booktitle);
+CREATE INDEX IF NOT EXISTS documents_url ON documents (url);
+CREATE INDEX IF NOT EXISTS documents_hash ON documents (hash);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_catalog(path: str) -> bool:
+    """Return True if path is a SQLite file rather than a directory."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, mode='rb') as file_h:
+        return file_h.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def content_hash(meta: dict) -> str:
+    """Return a hash of the fields of a document that Solr indexes.
+
+    Args:
+        meta  A dict of document fields, as written by jsonify.py.
+
+    Returns:
+        A hex digest.
+    """
+    assert isinstance(meta, dict), (
+        'meta is not a dict: %r' % meta)
+    stable = {key: value for key, value in meta.items()
+              if key not in VOLATILE_FIELDS}
+    content = json.dumps(stable, ensure_ascii=False, sort_keys=True,
+                         separators=(',', ':'))
+    return hashlib.sha1(content.encode('UTF-8')).hexdigest()
+
+
+def make_record(meta: dict, rel_path: str) -> tuple:
+    """Return the catalog row for a document.
+
+    Args:
+        meta  A dict of document fields, as written by jsonify.py.
+        rel_path  Path of the JSON file relative to the output
+                  directory.
+
+    Returns:
+        A tuple of values in the order of FIELDS. Missing fields are
+        None.
+    """
+    assert isinstance(meta, dict), (
+        'meta is not a dict: %r' % meta)
+    record = dict(meta, path=rel_path,
+                  hash=content_hash(meta),
+                  children=len(meta.get('_childDocuments_', [])))
+    record.setdefault('id', meta.get('url'))
+    return tuple(record.get(field) for field in FIELDS)
+
+
+class Catalog(object):
+    """An open catalog database.
+
+    Rows are written in one transaction per commit() call. Recording a
+    document that is already in the catalog replaces it.
+    """
+
+    def __init__(self, catalog_file: str, root: str=None) -> None:
+        """Open or create a catalog.
+
+        Args:
+            catalog_file  Path of the SQLite database.
+            root  The jsonify.py output directory the catalog
+                  describes; stored when given.
+        """
+        assert isinstance(catalog_file, str), (
+            'catalog_file is not a string: %r' % catalog_file)
+        self.conn = sqlite3.connect(catalog_file)
+        self.conn.executescript(SCHEMA)
+        if root is not None:
+            self.conn.execute('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                              ('root', os.path.abspath(root)))
+            self.conn.commit()
+
+    @property
+    def root(self) -> str:
+        """The output directory the paths in the catalog are relative to,
+        or None.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM info WHERE key = 'root'").fetchone()
+        return row[0] if row else None
+
+    def record(self, record: tuple) -> None:
+        """Add or replace a row made by make_record()."""
+        self.conn.execute('INSERT OR REPLACE INTO documents VALUES ({0})'
+                          .format(', '.join('?' * len(FIELDS))), record)
+
+    def commit(self) -> None:
+        """Write recorded rows to disk."""
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Commit and close the database."""
+        self.conn.commit()
+        self.conn.close()
+
+    def documents(self, **filters) -> list:
+        """Return rows as dicts, optionally only those whose fields equal
+        the given values, e.g., documents(product='Ambari').
+        """
+        for field in filters:
+            if field not in FIELDS:
+                raise ValueError('Not a catalog field: ' + field)
+        sql = 'SELECT {0} FROM documents'.format(', '.join(FIELDS))
+        if filters:
+            sql += ' WHERE ' + ' AND '.join(
+                '{0} = ?'.format(field) for field in sorted(filters))
+        cursor = self.conn.execute(sql + ' ORDER BY id', [
+            filters[field] for field in sorted(filters)])
+        return [dict(zip(FIELDS, row)) for row in cursor]
+
+    def count(self, *fields) -> list:
+        """Return (value, ..., document count) tuples grouped by fields."""
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError('Not a catalog field: ' + field)
+        columns = ', '.join(fields)
+        return self.conn.execute(
+            'SELECT {0}, count(*) FROM documents GROUP BY {0}'
+            ' ORDER BY {0}'.format(columns)).fetchall()
+
+    def manifest(self) -> dict:
+        """Return the documents as a solrsync.py manifest."""
+        cursor = self.conn.execute(
+            'SELECT id, hash, path, children FROM documents')
+        return {row[0]: {'id': row[0], 'hash': row[1], 'path': row[2],
+                         'children': row[3]} for row in cursor}
+
+
+def _scan_task(task: tuple) -> tuple:
+    """Read one JSON file and return its catalog row."""
+    json_dir, json_path = task
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    return make_record(meta, os.path.relpath(json_path, json_dir))
+
+
+def scan(json_dir: str, catalog_file: str, jobs: int=None) -> int:
+    """Catalog an existing jsonify.py output directory, replacing any
+    rows already in catalog_file.
+
+    Returns:
+        The number of documents recorded.
+    """
+    assert isinstance(json_dir, str), (
+        'json_dir is not a string: %r' % json_dir)
+    tasks = []
+    for dirpath, _, filenames in os.walk(json_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                tasks.append((json_dir, os.path.join(dirpath, filename)))
+    doc_catalog = Catalog(catalog_file, json_dir)
+    doc_catalog.conn.execute('DELETE FROM documents')
+    with multiprocessing.Pool(jobs) as pool:
+        for record in pool.imap_unordered(_scan_task, tasks, chunksize=64):
+            doc_catalog.record(record)
+    doc_catalog.close()
+    logging.info('Cataloged %d documents in %s', len(tasks), catalog_file)
+    return len(tasks)
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('--scan',
+                           help='jsonify.py output directory to catalog')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes for --scan')
+    ARGPARSER.add_argument('catalog_file',
+                           help='the SQLite catalog')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    if ARGS.scan:
+        scan(ARGS.scan, ARGS.catalog_file, ARGS.jobs)
+
+    CATALOG = Catalog(ARGS.catalog_file)
+    print('Root: {0}'.format(CATALOG.root))
+    for PRODUCT, RELEASE, COUNT in CATALOG.count('product', 'release'):
+        print('{0:>8}  {1} {2}'.format(COUNT, PRODUCT, RELEASE))
+    CATALOG.close()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Group near-duplicate documents in a directory of Solr JSON.
+
+Many pages differ across releases only by a version string or a footer,
+so a search returns one hit per release for the same topic. This stage
+computes a MinHash signature over word shingles of each document's
+text, finds candidate pairs with locality-sensitive hashing (LSH), and
+groups documents whose estimated Jaccard similarity is at least
+--threshold. Only documents of the same product and booktitle are
+compared: the site navigation shared by every page makes landing pages
+of different products look like near-duplicates.
+
+Every document gets a dup_group field, the id of the group's canonical
+document, and a canonical flag. The canonical document is the one from
+the newest release. Solr can then collapse results with
+    fq={!collapse field=dup_group}
+or, with --drop, non-canonical copies are deleted from the output.
+
+Signatures are computed in parallel. Uses numpy when it is installed,
+otherwise pure Python, which is several times slower.
+
+For usage, run:
+    python3 dedupe.py --help
+
+Run it on the output of jsonify.py before loading Solr, or pass
+--dedupe to jsonify.py.
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import array
+import json
+import logging
+import multiprocessing
+import os
+import random
+import zlib
+
+import releases
+import serializers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of hash functions in a signature. BANDS * ROWS must equal this.
+NUM_PERM = 128
+BANDS = 16
+ROWS = 8
+
+# Parameters of the universal hash functions h(x) = (a * x + b) % PRIME.
+# PRIME is below 2**32, so a * x + b fits in 64 bits for 32-bit shingles.
+PRIME = 4294967291
+_RANDOM = random.Random(20160801)
+PERM_A = [_RANDOM.randrange(1, PRIME) for _ in range(NUM_PERM)]
+PERM_B = [_RANDOM.randrange(0, PRIME) for _ in range(NUM_PERM)]
+
+# Shingles hashed per numpy batch; bounds memory for very large pages
+CHUNK = 8192
+
+
+def get_shingles(text: str, size: int=5) -> set:
+    """Return the set of 32-bit hashes of the word shingles in text.
+
+    Args:
+        text  Document text.
+        size  Number of words in a shingle.
+
+    Returns:
+        A set of ints, empty for texts shorter than size words. Such
+        texts have no signature and are nobody's near-duplicate.
+    """
+    assert isinstance(text, str), (
+        'text is not a string: %r' % text)
+    words = text.lower().split()
+    return {zlib.crc32(' '.join(words[i:i + size]).encode('UTF-8'))
+            for i in range(len(words) - size + 1)}
+
+
+def get_signature(shingles: set) -> array.array:
+    """Return the MinHash signature of a set of shingle hashes.
+
+    Args:
+        shingles  A set of 32-bit ints, as from get_shingles().
+
+    Returns:
+        An array of NUM_PERM unsigned ints.
+    """
+    assert isinstance(shingles, set), (
+        'shingles is not a set: %r' % shingles)
+    values = sorted(shingles)
+    if numpy is not None:
+        perm_a = numpy.array(PERM_A, dtype=numpy.uint64)[:, None]
+        perm_b = numpy.array(PERM_B, dtype=numpy.uint64)[:, None]
+        mins = numpy.full(NUM_PERM, PRIME, dtype=numpy.uint64)
+        for start in range(0, len(values), CHUNK):
+            chunk = numpy.array(values[start:start + CHUNK],
+                                dtype=numpy.uint64)[None, :]
+            hashed = (perm_a * chunk + perm_b) % PRIME
+            mins = numpy.minimum(mins, hashed.min(axis=1))
+        return array.array('I', mins.astype(numpy.uint32).tobytes())
+    return array.array('I', (min((a * x + b) % PRIME for x in values)
+                             for a, b in zip(PERM_A, PERM_B)))
+
+
+def similarity(sig1: array.array, sig2: array.array) -> float:
+    """Estimate the Jaccard similarity of two documents from signatures."""
+    same = sum(1 for x, y in zip(sig1, sig2) if x == y)
+    return same / NUM_PERM
+
+
+def iter_jsons(src_dir: str):
+    """Yield paths of all JSON files under src_dir."""
+    assert isinstance(src_dir, str), (
+        'src_dir is not a string: %r' % src_dir)
+    for dirpath, _, filenames in os.walk(src_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                yield os.path.join(dirpath, filename)
+
+
+def _signature_task(json_path: str) -> tuple:
+    """Read one JSON file and return (path, id, release, scope,
+    signature). The scope is the (product, booktitle) tuple duplicates
+    must share. The signature is None if the text is too short to
+    shingle.
+    """
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    doc_id = meta.get('id', meta.get('url', json_path))
+    # With jsonify.py --passages, the text of a page is split over its
+    # passage documents
+    shingles = get_shingles(' '.join(
+        [meta.get('text', '')] + [child.get('text', '') for child in
+                                  meta.get('_childDocuments_', [])]))
+    signature = get_signature(shingles).tobytes() if shingles else None
+    scope = (meta.get('product', ''), meta.get('booktitle', ''))
+    return json_path, doc_id, meta.get('release', ''), scope, signature
+
+
+class _UnionFind(object):
+    """Disjoint sets over document positions."""
+
+    def __init__(self, size: int) -> None:
+        self.parent = array.array('l', range(size))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:  # Path compression
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, item1: int, item2: int) -> None:
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 != root2:
+            self.parent[max(root1, root2)] = min(root1, root2)
+
+
+def find_groups(signatures: array.array, scopes: list,
+                threshold: float) -> _UnionFind:
+    """Union documents of the same scope whose signatures collide in
+    an LSH band and whose estimated similarity reaches threshold.
+
+    Bands are processed one at a time, so memory stays proportional to
+    the corpus size rather than to the number of candidate pairs. A
+    bucket keeps all its documents, and each new one is compared with
+    those not already in its group.
+
+    Args:
+        signatures  Signatures of all documents, concatenated.
+        scopes  Scope of each document, such as (product, booktitle);
+            documents of different scopes are never grouped.
+        threshold  Minimum estimated Jaccard similarity.
+
+    Returns:
+        The union-find structure over document positions.
+    """
+    count = len(scopes)
+    groups = _UnionFind(count)
+    for band in range(BANDS):
+        buckets = {}
+        for position in range(count):
+            start = position * NUM_PERM + band * ROWS
+            key = (scopes[position], tuple(signatures[start:start + ROWS]))
+            members = buckets.setdefault(key, [])
+            sig2 = signatures[position * NUM_PERM:(position + 1) * NUM_PERM]
+            for other in members:
+                if groups.find(other) == groups.find(position):
+                    continue
+                sig1 = signatures[other * NUM_PERM:(other + 1) * NUM_PERM]
+                if similarity(sig1, sig2) >= threshold:
+                    groups.union(other, position)
+            members.append(position)
+    return groups
+
+
+def _rewrite_task(task: tuple) -> None:
+    """Add dup_group and canonical fields to one JSON file, or delete it."""
+    json_path, dup_group, canonical, drop, serializer = task
+    if drop and not canonical:
+        os.remove(json_path)
+        return
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    meta['dup_group'] = dup_group
+    meta['canonical'] = canonical
+    serializers.write_json(meta, json_path,
+                           serializers.get_serializer(serializer))
+
+
+def dedupe(src_dir: str, threshold: float=0.85, drop: bool=False,
+           jobs: int=None, serializer: str='json') -> dict:
+    """Mark or drop near-duplicate documents in a JSON tree in place.
+
+    Args:
+        src_dir  Directory of JSON files written by jsonify.py.
+        threshold  Minimum estimated Jaccard similarity of duplicates.
+        drop  Delete non-canonical documents instead of marking them.
+        jobs  Number of worker processes, defaults to the CPU count.
+        serializer  Name of the function the JSON files are rewritten
+                    with; see serializers.get_serializer().
+
+    Returns:
+        A dict of counts: documents, groups, and duplicates.
+    """
+    assert isinstance(src_dir, str), (
+        'src_dir is not a string: %r' % src_dir)
+
+    paths, ids, release_values = [], [], []
+    signed = []  # Positions of the documents with a signature
+    scopes = []  # Scopes of the documents with a signature
+    signatures = array.array('I')
+    with multiprocessing.Pool(jobs) as pool:
+        for path, doc_id, release, scope, signature in pool.imap(
+                _signature_task, iter_jsons(src_dir), chunksize=64):
+            if signature is not None:
+                signed.append(len(paths))
+                scopes.append(scope)
+                signatures.frombytes(signature)
+            paths.append(path)
+            ids.append(doc_id)
+            release_values.append(release)
+        logging.info('Computed %d signatures; %d documents have too little'
+                     ' text', len(signed), len(paths) - len(signed))
+
+        # Documents without a signature form groups of their own
+        groups = find_groups(signatures, scopes, threshold)
+        roots = list(range(len(paths)))
+        for number, position in enumerate(signed):
+            roots[position] = signed[groups.find(number)]
+
+        # The canonical document of a group, all of one scope, is from the
+        # newest release, then the shortest id
+        best = {}
+        for position in range(len(paths)):
+            root = roots[position]
+            rank = (releases.parse_release(release_values[position]),
+                    -len(ids[position]))
+            if root not in best or rank > best[root][0]:
+                best[root] = (rank, position)
+
+        tasks = []
+        for position, path in enumerate(paths):
+            canonical_position = best[roots[position]][1]
+            tasks.append((path, ids[canonical_position],
+                          position == canonical_position, drop, serializer))
+        for _ in pool.imap_unordered(_rewrite_task, tasks, chunksize=64):
+            pass
+
+    stats = {'documents': len(paths), 'groups': len(best),
+             'duplicates': len(paths) - len(best)}
+    logging.info('Near-duplicates: %r', stats)
+    return stats
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-t', '--threshold', type=float, default=0.85,
+                           help='minimum estimated similarity of'
+                           ' near-duplicates, defaults to 0.85')
+    ARGPARSER.add_argument('-d', '--drop', action='store_true',
+                           help='delete non-canonical documents instead of'
+                           ' marking them')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes')
+    ARGPARSER.add_argument('--serializer', default='json',
+                           choices=sorted(serializers.SERIALIZERS) +
+                           ['auto'],
+                           help='JSON encoder, defaults to json, the standard'
+                           ' library; auto picks the fastest installed')
+    ARGPARSER.add_argument('in_dir',
+                           help='directory containing JSON files written'
+                           ' by jsonify.py; modified in place')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    dedupe(ARGS.in_dir, ARGS.threshold, ARGS.drop, ARGS.jobs,
+           ARGS.serializer)
@@ -12,21 +12,48 @@ Questions: Robert Crews <rcrews@hortonworks.com>
 When complete, the resulting file can be pretty-printed by running this
 command:
     python -m json.tool facets.json facets-pretty.json
+
+With --bundle, also writes a compact, versioned autocomplete bundle for
+the search webapp (see make_bundle()). Copy it next to index3.html so
+solr-search.js can fill the product/release/booktitle boxes without a
+*:* facet query on every page view.
+
+in_dir can also be a catalog written by jsonify.py --catalog, which is
+read with one indexed query instead of parsing every JSON file.
+
+Releases are listed in release_key order (see
+releases.parse_release()), so 2.1.10.0 follows 2.1.9.0 rather than
+2.1.1.0.
 """
 
-__version__ = '0.0.1'
+__version__ = '0.0.2'
 
 import argparse
 import codecs
 import collections
+import hashlib
 import json
 import logging
 import os
 
+import catalog
+import releases
+
+# Bump when the layout of the autocomplete bundle changes
+BUNDLE_VERSION = 1
+
+# Longest prefix, in characters, recorded in the bundle prefix index
+BUNDLE_PREFIX_LENGTH = 3
 
-def get_jsons(src_dir, facet):
+
+def get_jsons(src_dir, facet, counts=None):
     """Recurse src_dir to parse JSON files for product, release, and
     title data.
+
+    If counts is a dict, it is filled with a collections.Counter of
+    document counts for each of the product, release, and booktitle
+    fields, keyed by the values as indexed, without product_lookup()
+    or booktitle_lookup(), so they can be used in filter queries.
     """
     assert isinstance(src_dir, str), (
         'src_dir is not a string: %r' % src_dir)
@@ -37,7 +64,7 @@ def get_jsons(src_dir, facet):
         src_path = os.path.join(src_dir, item)
 
         if os.path.isdir(src_path):
-            get_jsons(src_path, facet) # Recurse
+            get_jsons(src_path, facet, counts) # Recurse
         else:
             _, extension = os.path.splitext(item)
             if extension != '.json':
@@ -47,6 +74,14 @@ def get_jsons(src_dir, facet):
                     jinn = json.load(infile)
                 except json.JSONDecodeError:
                     print('Error!')
+                    continue
+
+            # Count the values as indexed, which filter queries match
+            if counts is not None:
+                for field in ('product', 'release', 'booktitle'):
+                    if field in jinn:
+                        counts.setdefault(field, collections.Counter())
+                        counts[field][jinn[field]] += 1
 
             if 'product' in jinn:
                 jinn['product'] = product_lookup(jinn['product'])
@@ -58,6 +93,36 @@ def get_jsons(src_dir, facet):
     return facet
 
 
+def get_catalog(catalog_file, facet, counts=None):
+    """Fill facet, and counts if it is a dict, like get_jsons(), from a
+    catalog written by jsonify.py --catalog.
+    """
+    assert isinstance(catalog_file, str), (
+        'catalog_file is not a string: %r' % catalog_file)
+    assert isinstance(facet, dict), (
+        'facet is not a dict: %r' % facet)
+
+    doc_catalog = catalog.Catalog(catalog_file)
+    rows = doc_catalog.count('product', 'release', 'booktitle')
+    doc_catalog.close()
+    for product, release, booktitle, number in rows:
+        if counts is not None:
+            for field, value in (('product', product), ('release', release),
+                                 ('booktitle', booktitle)):
+                if value is not None:
+                    counts.setdefault(field, collections.Counter())
+                    counts[field][value] += number
+
+        if product is not None:
+            product = product_lookup(product)
+            if booktitle is not None:
+                booktitle = booktitle_lookup(booktitle)
+                if release is not None:
+                    facet[product][release][booktitle] = '.'
+
+    return facet
+
+
 def product_lookup(abbr):
     """Convert product abbreviations to fuller product names."""
     assert isinstance(abbr, str), (
@@ -225,9 +290,75 @@ def make_dict():
     return collections.defaultdict(make_dict)
 
 
-def process(src_dir, dest_file):
+def make_prefix_index(values):
+    """Map lowercase word prefixes to the positions of values containing
+    a word that starts with that prefix.
+    """
+    assert isinstance(values, list), (
+        'values is not a list: %r' % values)
+    index = collections.defaultdict(set)
+    for position, value in enumerate(values):
+        for word in value.lower().split():
+            for length in range(1, min(len(word), BUNDLE_PREFIX_LENGTH) + 1):
+                index[word[:length]].add(position)
+    return {prefix: sorted(positions)
+            for prefix, positions in index.items()}
+
+
+def make_bundle(facet, counts):
+    """Build the autocomplete bundle read by solr-search.js.
+
+    Each field lists [value, document count] pairs sorted by value,
+    plus a prefix index into that list. Releases are instead sorted by
+    release_key, and their entries add the release_key and release_tag:
+    [value, document count, release_key, release_tag]. The etag is a
+    hash of the bundle content, so an unchanged corpus yields a
+    byte-identical file that HTTP caches and localStorage can keep.
+    """
+    assert isinstance(facet, dict), (
+        'facet is not a dict: %r' % facet)
+    assert isinstance(counts, dict), (
+        'counts is not a dict: %r' % counts)
+
+    fields = {}
+    for field in ('product', 'release', 'booktitle'):
+        counter = counts.get(field, collections.Counter())
+        if field == 'release':
+            values = sorted(counter, key=releases.parse_release)
+            entries = [[value, counter[value]] +
+                       list(releases.parse_release(value))
+                       for value in values]
+        else:
+            values = sorted(counter)
+            entries = [[value, counter[value]] for value in values]
+        fields[field] = {
+            'values': entries,
+            'prefixes': make_prefix_index(values),
+        }
+
+    bundle = {'version': BUNDLE_VERSION, 'fields': fields, 'tree': facet}
+    content = json.dumps(bundle, ensure_ascii=False, sort_keys=True,
+                         separators=(',', ':'))
+    bundle['etag'] = hashlib.sha256(content.encode('UTF-8')).hexdigest()[:16]
+    return bundle
+
+
+def write_bundle(bundle, dest_file):
+    """Write the autocomplete bundle compactly, with stable key order."""
+    assert isinstance(bundle, dict), (
+        'bundle is not a dict: %r' % bundle)
+    assert isinstance(dest_file, str), (
+        'dest_file is not a string: %r' % dest_file)
+    with codecs.open(dest_file, mode='w', encoding='UTF-8') as file_handle:
+        json.dump(bundle, file_handle, ensure_ascii=False, sort_keys=True,
+                  separators=(',', ':'))
+    logging.info('Wrote bundle %s (etag %s)', dest_file, bundle['etag'])
+
+
+def process(src_dir, dest_file, bundle_file=None):
     """Set up JSON struct, delegate its creation, then write the JSON
-    file to disk.
+    file to disk. If bundle_file is given, also write the autocomplete
+    bundle there.
     """
     assert isinstance(src_dir, str), (
         'src_dir is not a string: %r' % src_dir)
@@ -235,17 +366,26 @@ def process(src_dir, dest_file):
         'dest_file is not a string: %r' % dest_file)
 
     facet = collections.defaultdict(make_dict)
-    facet = get_jsons(src_dir, facet)
+    counts = {}
+    if catalog.is_catalog(src_dir):
+        facet = get_catalog(src_dir, facet, counts)
+    else:
+        facet = get_jsons(src_dir, facet, counts)
 
-    # Convert the booktitle dictionary to a list
+    # Convert the booktitle dictionary to a list, and order releases by
+    # release_key
     for product in facet:
-        for release in facet[product]:
-            booktitles = sorted(facet[product][release].keys())
-            facet[product][release] = booktitles
+        facet[product] = {
+            release: sorted(facet[product][release].keys())
+            for release in sorted(facet[product],
+                                  key=releases.parse_release)}
 
     with codecs.open(dest_file, mode='w', encoding='UTF-8') as file_handle:
         json.dump(facet, file_handle, ensure_ascii=False)
 
+    if bundle_file:
+        write_bundle(make_bundle(facet, counts), bundle_file)
+
 
 # Command-line interface
 if __name__ == '__main__':
@@ -258,9 +398,13 @@ if __name__ == '__main__':
     ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
                            help='message level for log', choices=[1, 2, 3, 4, 5])
     ARGPARSER.add_argument('in_dir',
-                           help='directory containing text and HTML files')
+                           help='directory containing JSON files written by'
+                           ' jsonify.py, or its catalog')
     ARGPARSER.add_argument('-o', '--out', nargs='?', default=BASENAME + '.json',
                            help='filename where JSON facet data will be written')
+    ARGPARSER.add_argument('-b', '--bundle',
+                           help='filename where the webapp autocomplete bundle'
+                           ' will be written, e.g., facets-bundle.json')
     ARGS = ARGPARSER.parse_args()
 
     # https://docs.python.org/3/library/logging.html#levels
@@ -273,4 +417,4 @@ if __name__ == '__main__':
         filename=ARGS.logfile)
     logging.getLogger().setLevel(ARGS.verbosity)
 
-    process(ARGS.in_dir, ARGS.out)
+    process(ARGS.in_dir, ARGS.out, ARGS.bundle)
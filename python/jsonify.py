@@ -8,45 +8,155 @@ For usage, run:
 
 Questions: Robert Crews <rcrews@hortonworks.com>
 
+To convert documents in-process, for example from a long-lived
+publishing service, use the Converter class instead of the command line.
+
+Each document is converted in a worker process under a time and memory
+budget (--timeout, --memory). Documents that fail, time out, or crash
+their worker are skipped and appended to the quarantine file. Convert
+just those again, into the existing output directory, with:
+    $ python3 jsonify.py --retry jsonify-quarantine.jsonl in_dir out_dir
+
+To mark or drop near-duplicate pages across releases after conversion,
+add --dedupe (see dedupe.py).
+
+To predict the time, memory, and output size of a run before starting
+it, convert only a sample with:
+    $ python3 jsonify.py --estimate --jobs 8 in_dir
+
 Use tar.bz2 to compress the resulting JSON:
     $ tar cfy docs.hortonworks.com-json.tar.bz2 docs.hortonworks.com-json
 """
 
 import argparse
+import bisect
+import codecs
+import importlib
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import posixpath
+import random
 import re
+import resource
 import sys
+import tempfile
 import time
+import traceback
 import yaml
+import zlib
 import urllib.parse
 import lxml.html
 
+import catalog
+import dedupe
+import releases
+import serializers
+import staticrank
+
 try:
     from yaml import CLoader as Loader
 except ImportError:
     from yaml import Loader
 
-__version__ = '0.0.7'
+__version__ = '0.0.8'
 
+# Consider only files with these extensions for conversion to JSON
+EXTENSIONS = ('.html', '.htm', '.txt')
 
-def jsonify(src_dir: str, dest_dir: str) -> None:
-    """Transform HTML and text to JSON and copy to mirrored directory.
+# Default book titles for standardize_booktitle(); see load_titles()
+TITLES = {}
+
+# Combination of 'caption', 'tbody', and 'thead' plus
+# https://www.w3.org/TR/CSS21/sample.html#q22.0 and
+# https://developer.mozilla.org/en-US/docs/Web/HTML/Block-level_elements
+HTML_BLOCKS = ('address', 'article', 'aside', 'blockquote', 'body',
+               'canvas', 'center', 'dd', 'dir', 'div', 'dl', 'dt',
+               'fieldset', 'figcaption', 'figure', 'footer', 'form',
+               'frame', 'frameset', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+               'header', 'hgroup', 'hr', 'html', 'li', 'main', 'menu',
+               'nav', 'noframes', 'noscript', 'ol', 'output', 'p',
+               'pre', 'section', 'table', 'tfoot', 'ul', 'video',
+               'caption', 'tbody', 'thead')
+
+# Default maximum length, in characters, of the summary field
+SUMMARY_LENGTH = 300
+
+# Headings that start a new passage document in --passages mode
+PASSAGE_HEADINGS = ('h2', 'h3')
+
+# Books with fewer HTML pages are not checked for boilerplate
+BOILERPLATE_MIN_PAGES = 5
+
+# Blocks that are never boilerplate
+BOILERPLATE_KEEP_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Byte order marks and the libxml2 names of the encodings they mark
+BOMS = ((codecs.BOM_UTF8, 'UTF-8'), (codecs.BOM_UTF16_LE, 'UTF-16LE'),
+        (codecs.BOM_UTF16_BE, 'UTF-16BE'))
+
+# Bytes searched for a meta charset, as in the HTML5 prescan
+CHARSET_PRESCAN = 1024
+META_CHARSET_REGEX = re.compile(
+    br'<meta[^>]*?charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+
+# Elements removed right after parsing; their content is never indexed
+PRUNED_TAGS = ('script', 'style')
+
+# HTML parsers of this process by encoding; see get_parser()
+_PARSERS = {}
+
+# Absolute links to these hosts are links within the site
+SITE_HOSTS = ('docs.hortonworks.com',)
+
+# Web path of the directory jsonify.py reads; url fields are relative to it
+SITE_ROOT = '/HDPDocuments'
+
+# Files converted by --estimate, and the upper bounds, in bytes, of the
+# size classes it samples from separately
+ESTIMATE_SAMPLE = 200
+ESTIMATE_SIZE_CLASSES = (16384, 65536, 262144, 1048576)
+
+# The largest files are always in the --estimate sample
+ESTIMATE_LARGEST = 5
+
+
+def dest_path_for(src_path: str, src_dir: str, dest_dir: str) -> str:
+    """Return the JSON path mirroring src_path under dest_dir.
 
     Args:
+        src_path  Path to a text or HTML file under src_dir.
         src_dir  Directory containing text and HTML files.
-        dest_dir  Nonexistant directory where JSON files will be written.
+        dest_dir  Directory where JSON files are written.
+
+    Returns:
+        The path of the JSON file for src_path.
+    """
+    assert isinstance(src_path, str), (
+        'src_path is not a string: %r' % src_path)
+    relative = os.path.relpath(src_path, src_dir)
+    directory, item = os.path.split(relative)
+    new_item = item.replace('.', '_') + '.json'
+    return os.path.join(dest_dir, directory, new_item)
+
+
+def iter_sources(src_dir: str, dest_dir: str):
+    """Create the mirrored subdirectories and yield files to convert.
+
+    Args:
+        src_dir  Directory containing text and HTML files.
+        dest_dir  Existing directory where JSON files will be written.
+
+    Yields:
+        (src_path, dest_path) tuples for files with a supported
+        extension.
     """
     assert isinstance(src_dir, str), (
         'src_dir is not a string: %r' % src_dir)
     assert isinstance(dest_dir, str), (
-        'path_prefix is not a string: %r' % dest_dir)
-
-    # Fatal error if dest_dir exists. User is forced to either move or
-    # delete the existing output directory before continuing.
-    os.mkdir(dest_dir)
-    logging.info(dest_dir)
+        'dest_dir is not a string: %r' % dest_dir)
 
     for item in os.listdir(src_dir):
         src_path = os.path.join(src_dir, item)
@@ -55,46 +165,622 @@ def jsonify(src_dir: str, dest_dir: str) -> None:
 
             # Recurse into different directoires
             dest_path = os.path.join(dest_dir, item)
-            jsonify(src_path, dest_path)
+            os.mkdir(dest_path)
+            logging.info(dest_path)
+            yield from iter_sources(src_path, dest_path)
         else:
 
             # Consider only files with these extensions for conversion to JSON
-            extensions = ('.html', '.htm', '.txt')
-
-            # If this is a file we want to process, set up JSON file path
             _, extension = os.path.splitext(item)
-            if extension in extensions:
-                new_item = item.replace('.', '_') + '.json'
-                dest_path = os.path.join(dest_dir, new_item)
-            else:
+            if extension in EXTENSIONS:
+                yield src_path, dest_path_for(src_path, src_dir, dest_dir)
+
+
+class Converter(object):
+    """Convert HTML and text files to dicts of Solr fields.
+
+    Configure once and reuse for any number of documents. Nothing is
+    read from module globals, so a long-lived process can convert
+    batches without per-call setup:
+
+        converter = jsonify.Converter('/srv/docs', jsonify.load_titles(
+            'titles.yaml'))
+        for path, meta in converter.convert_many(paths):
+            ...
+
+    Args:
+        path_prefix  Text to be removed from the beginning of URLs.
+        titles  A dict associating directory names with book titles.
+        passages  Split HTML pages into passage child documents at h2
+                  and h3 headings; see get_html_passages().
+        summary_length  Maximum length of the summary field.
+        serializer  Name of the function the JSON files are written
+                    with; see serializers.get_serializer().
+        boilerplate  Blocks to remove from HTML pages before getting
+                     text, as from learn_boilerplate().
+        links  Also list the site pages each HTML page links to, under
+               a _links key that is not a Solr field; see
+               get_html_links().
+    """
+
+    def __init__(self, path_prefix: str='', titles: dict=None,
+                 passages: bool=False,
+                 summary_length: int=SUMMARY_LENGTH,
+                 serializer: str='json',
+                 boilerplate: dict=None, links: bool=False) -> None:
+        assert isinstance(path_prefix, str), (
+            'path_prefix is not a string: %r' % path_prefix)
+        self.path_prefix = path_prefix
+        self.titles = titles if titles is not None else {}
+        self.passages = passages
+        self.summary_length = summary_length
+        self.dumps = serializers.get_serializer(serializer)
+        self.boilerplate = boilerplate
+        self.links = links
+        self.parsed_by = ''.join(['com.hortonworks.docs.',
+                                  os.path.splitext(
+                                      os.path.basename(__file__))[0],
+                                  ', v', __version__])
+
+    def _convert(self, path: str, data: bytes) -> dict:
+        # Use different parsers for files with different extensions
+        _, extension = os.path.splitext(path)
+        if extension == '.txt':
+            meta = text_to_json(path, self.path_prefix, self.titles, data,
+                                self.summary_length)
+        else:
+            meta = html_to_json(path, self.path_prefix, self.titles, data,
+                                self.passages, self.summary_length,
+                                self.boilerplate, self.links)
+        meta['x_parsed_by'] = self.parsed_by
+        return meta
+
+    def convert(self, path: str) -> dict:
+        """Read and convert one text or HTML file.
+
+        Args:
+            path  Path to a text or HTML file.
+
+        Returns:
+            A dict of metadata suitable for conversion to a JSON file.
+        """
+        meta = self._convert(path, None)
+        meta['stream_size'] = os.path.getsize(path)
+        meta['date'] = get_datetime(path)
+        return meta
+
+    def convert_bytes(self, path: str, data: bytes) -> dict:
+        """Convert the content of a file that need not exist on disk.
+
+        Args:
+            path  Path of the file; determines the parser, URL, and
+                product, release, and booktitle values.
+            data  Content of the file.
+
+        Returns:
+            A dict of metadata suitable for conversion to a JSON file.
+        """
+        assert isinstance(data, bytes), (
+            'data is not bytes: %r' % type(data))
+        meta = self._convert(path, data)
+        meta['stream_size'] = len(data)
+        if os.path.exists(path):
+            meta['date'] = get_datetime(path)
+        else:
+            meta['date'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        return meta
+
+    def convert_many(self, paths, skip_errors: bool=False):
+        """Convert files one at a time.
+
+        Args:
+            paths  Iterable of paths to text or HTML files.
+            skip_errors  Log and skip files that fail to convert instead
+                of raising.
+
+        Yields:
+            (path, meta) tuples.
+        """
+        for path in paths:
+            try:
+                meta = self.convert(path)
+            except Exception:
+                if not skip_errors:
+                    raise
+                logging.exception('Cannot convert ' + path)
                 continue
+            yield path, meta
 
-            # Use different parsers for files with different extensions
-            if extension == '.txt':
-                meta = text_to_json(src_path, ARGS.in_dir)
-            else:
-                meta = html_to_json(src_path, ARGS.in_dir)
 
-            meta['stream_size'] = os.path.getsize(src_path)
-            meta['date'] = get_datetime(src_path)
-            meta['x_parsed_by'] = ''.join(['com.hortonworks.docs.',
-                                           os.path.splitext(
-                                               os.path.basename(__file__))[0],
-                                           ', v', __version__])
+def _worker_main(conn: 'multiprocessing.connection.Connection',
+                 converter: Converter, memory_limit: int,
+                 catalog_root: str=None) -> None:
+    """Convert documents sent over conn until it is closed.
 
-            # Write JSON as UTF-8
-            with open(dest_path, mode='w', encoding='UTF-8') as file_handle:
-                json.dump(meta, file_handle, ensure_ascii=False)
+    Sends back (status, src_path, detail) for each document, where
+    status is 'ok', 'memory', or 'error'. The detail of an 'ok' is a
+    tuple of the document's catalog row, if catalog_root is set, its
+    staticrank.py links entry, if the converter lists links, and its
+    measurements: CPU seconds, output bytes, and the peak resident
+    memory of the worker so far.
+    """
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        src_path, dest_path = task
+        cpu = time.process_time()
+        try:
+            meta = converter.convert(src_path)
+            links = None
+            if converter.links:
+                links = [meta.get('url', ''), dest_path,
+                         meta.pop('_links', [])]
+            serializers.write_json(meta, dest_path, converter.dumps)
+            record = None
+            if catalog_root:
+                record = catalog.make_record(
+                    meta, os.path.relpath(dest_path, catalog_root))
+            # ru_maxrss is in kilobytes on Linux
+            stats = {'cpu': time.process_time() - cpu,
+                     'output': os.path.getsize(dest_path),
+                     'peak': resource.getrusage(
+                         resource.RUSAGE_SELF).ru_maxrss * 1024}
+            detail = (record, links, stats)
+        except MemoryError:
+            conn.send(('memory', src_path, 'exceeded memory budget'))
+        except Exception:  # Any failure quarantines only this document
+            conn.send(('error', src_path, traceback.format_exc(limit=-3)))
+        else:
+            conn.send(('ok', src_path, detail))
+
+
+class _Worker(object):
+    """A child process converting one document at a time."""
+
+    def __init__(self, converter: Converter, memory_limit: int,
+                 catalog_root: str=None) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_conn, converter, memory_limit, catalog_root),
+            daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.deadline = None
+
+    def send(self, task: tuple, timeout: float) -> None:
+        """Start converting task, a (src_path, dest_path) tuple."""
+        self.task = task
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.conn.send(task)
+
+    def stop(self) -> None:
+        """Ask the process to exit after its current document."""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+    def kill(self) -> None:
+        """Cut off the process, whatever it is doing."""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def convert_guarded(tasks, converter: Converter, jobs: int=1,
+                    timeout: float=None, memory_limit: int=None,
+                    quarantine: str=None,
+                    doc_catalog: 'catalog.Catalog'=None,
+                    links_file: str=None, measured: dict=None) -> list:
+    """Convert documents in worker processes under a time and memory
+    budget, isolating failures.
+
+    A document that raises, exceeds memory_limit, crashes its worker,
+    or takes longer than timeout seconds is skipped. Its worker is
+    replaced and the run continues.
 
-    return None
+    Args:
+        tasks  Iterable of (src_path, dest_path) tuples.
+        converter  The Converter used by all workers.
+        jobs  Number of worker processes.
+        timeout  Seconds allowed per document, or None for no limit.
+        memory_limit  Bytes of address space per worker, or None.
+        quarantine  Path of a JSON lines file where skipped documents
+            are appended as they happen.
+        doc_catalog  A catalog.Catalog where converted documents are
+            recorded; their paths are relative to its root.
+        links_file  Path of a JSON lines file where the links of
+            converted documents are appended, if the converter lists
+            links; see staticrank.py.
+        measured  A dict where the measurements of each document are
+            stored by source path: wall and CPU seconds, output bytes,
+            peak worker memory, and failed, 1 if it was skipped. The
+            CPU time of a skipped document is its wall time.
 
+    Returns:
+        A list of dicts describing skipped documents, with path,
+        reason, and detail keys.
+    """
+    catalog_root = doc_catalog.root if doc_catalog else None
+    workers = [_Worker(converter, memory_limit, catalog_root)
+               for _ in range(jobs)]
+    tasks = iter(tasks)
+    pending = True
+    failures = []
+    links_h = None
+    if links_file and converter.links:
+        links_h = open(links_file, mode='a', encoding='UTF-8')
+
+    def skip(worker, reason, detail):
+        record = {'path': worker.task[0], 'reason': reason,
+                  'detail': detail}
+        logging.error('Skipped %s (%s)', record['path'], reason)
+        failures.append(record)
+        if measured is not None:
+            wall = time.monotonic() - worker.started
+            measured[worker.task[0]] = {
+                'wall': wall, 'cpu': wall, 'output': 0, 'failed': 1,
+                'peak': (memory_limit or 0) if reason == 'memory' else 0}
+        if quarantine:
+            with open(quarantine, mode='a', encoding='UTF-8') as file_h:
+                file_h.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def replace(worker):
+        worker.kill()
+        workers[workers.index(worker)] = _Worker(converter, memory_limit,
+                                                 catalog_root)
+
+    while True:
+        for worker in workers:
+            if worker.task is None and pending:
+                task = next(tasks, None)
+                if task is None:
+                    pending = False
+                else:
+                    worker.send(task, timeout)
+        busy = [worker for worker in workers if worker.task is not None]
+        if not busy:
+            break
+
+        deadlines = [w.deadline for w in busy if w.deadline is not None]
+        wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        ready = multiprocessing.connection.wait([w.conn for w in busy], wait)
+
+        for worker in busy:
+            if worker.conn in ready:
+                try:
+                    status, _, detail = worker.conn.recv()
+                except EOFError:
+                    skip(worker, 'crash', 'worker exited with code %s' %
+                         worker.process.exitcode)
+                    replace(worker)
+                    continue
+                if status != 'ok':
+                    skip(worker, status, detail)
+                else:
+                    record, links, stats = detail
+                    if measured is not None:
+                        measured[worker.task[0]] = dict(
+                            stats, wall=time.monotonic() - worker.started,
+                            failed=0)
+                    if doc_catalog:
+                        doc_catalog.record(record)
+                    if links_h:
+                        links_h.write(json.dumps(links, ensure_ascii=False)
+                                      + '\n')
+                if status == 'memory':
+                    replace(worker)  # The heap may be in a bad state
+                else:
+                    worker.task = None
+            elif (worker.deadline is not None and
+                  worker.deadline <= time.monotonic()):
+                skip(worker, 'timeout', 'exceeded %s seconds' % timeout)
+                replace(worker)
+
+    for worker in workers:
+        worker.stop()
+    if doc_catalog:
+        doc_catalog.commit()
+    if links_h:
+        links_h.close()
+    return failures
+
+
+def jsonify(src_dir: str, dest_dir: str, converter: Converter=None,
+            jobs: int=1, timeout: float=None, memory_limit: int=None,
+            quarantine: str=None, retry: list=None,
+            catalog_file: str=None, priority: 'function'=None,
+            links_file: str=None) -> list:
+    """Transform HTML and text to JSON and copy to mirrored directory.
 
-def text_to_json(text_file: str, path_prefix: str='') -> dict:
+    Args:
+        src_dir  Directory containing text and HTML files.
+        dest_dir  Nonexistant directory where JSON files will be written.
+        converter  The Converter to use; by default one that removes
+            src_dir from URLs.
+        jobs  Number of worker processes.
+        timeout  Seconds allowed per document, or None for no limit.
+        memory_limit  Bytes of address space per worker, or None.
+        quarantine  Path of a JSON lines file listing skipped documents.
+        retry  Convert only these files, into the existing dest_dir.
+        catalog_file  Path of a SQLite catalog where converted
+            documents are recorded.
+        priority  A function of the source path returning a sort key;
+            if given, files are converted in ascending key order, as
+            from default_priority(), instead of directory order.
+        links_file  Path of a JSON lines file where links are appended
+            if the converter lists links; see staticrank.py.
+
+    Returns:
+        A list of dicts describing skipped documents.
+    """
+    assert isinstance(src_dir, str), (
+        'src_dir is not a string: %r' % src_dir)
+    assert isinstance(dest_dir, str), (
+        'path_prefix is not a string: %r' % dest_dir)
+
+    if retry is None:
+
+        # Fatal error if dest_dir exists. User is forced to either move or
+        # delete the existing output directory before continuing.
+        os.mkdir(dest_dir)
+        logging.info(dest_dir)
+        tasks = iter_sources(src_dir, dest_dir)
+    else:
+        tasks = [(path, dest_path_for(path, src_dir, dest_dir))
+                 for path in retry]
+    if priority is not None:
+        tasks = sorted(tasks, key=lambda task: priority(task[0]))
+
+    if converter is None:
+        converter = Converter(src_dir, TITLES)
+    doc_catalog = catalog.Catalog(catalog_file, dest_dir) if catalog_file \
+        else None
+    failures = convert_guarded(tasks, converter, jobs, timeout, memory_limit,
+                               quarantine, doc_catalog, links_file)
+    if doc_catalog:
+        doc_catalog.close()
+
+    if failures:
+        logging.warning('Skipped %d files:', len(failures))
+        for record in failures:
+            logging.warning('  %s (%s)', record['path'], record['reason'])
+    return failures
+
+
+def _estimate_order(item: tuple) -> tuple:
+    """Sort key of a (path, size) tuple by product, release, and path."""
+    meta, _ = _match_path(item[0])
+    return meta.get('product', ''), meta.get('release', ''), item[0]
+
+
+def _allocate_sample(strata: dict, sample: int) -> dict:
+    """Return the number of files to sample from each stratum.
+
+    The sample is split in proportion to the bytes of each stratum,
+    since conversion cost grows with size, with at least two files per
+    stratum so its variance can be estimated. Strata keyed 'largest'
+    are sampled completely.
+    """
+    sizes = {key: sum(size for _, size in files)
+             for key, files in strata.items() if key != 'largest'}
+    budget = max(sample - len(strata.get('largest', ())), 0)
+    total = sum(sizes.values()) or 1
+    counts = {}
+    for key, files in strata.items():
+        if key == 'largest':
+            counts[key] = len(files)
+        else:
+            counts[key] = min(len(files), max(
+                2, int(round(budget * sizes[key] / total))))
+    return counts
+
+
+def _stratified_total(strata: dict, results: dict, field: str) -> tuple:
+    """Return the estimated total of a measured field over all files and
+    the half-width of its 95% confidence interval.
+    """
+    total = variance = 0.0
+    for key, files in strata.items():
+        values = [result[field] for result in results[key]]
+        count, number = len(values), len(files)
+        mean = sum(values) / count
+        total += number * mean
+        if count > 1:
+            spread = sum((value - mean) ** 2 for value in values) / (count - 1)
+            variance += number ** 2 * (1 - count / number) * spread / count
+    return total, 1.96 * variance ** 0.5
+
+
+def estimate(src_dir: str, converter: Converter=None, jobs: int=1,
+             timeout: float=None, memory_limit: int=None,
+             sample: int=ESTIMATE_SAMPLE, seed: int=None) -> dict:
+    """Predict the cost of converting src_dir without converting it all.
+
+    Only file sizes are read from the whole tree. Files are stratified
+    by extension and size class (ESTIMATE_SIZE_CLASSES); the
+    ESTIMATE_LARGEST largest files form a stratum of their own and are
+    always converted, so peak memory is measured on the documents most
+    likely to need it. Within a stratum, files are ordered by product,
+    release, and path and sampled at even intervals, which spreads the
+    sample over products and releases. The sample is converted and
+    written, to a temporary directory, by jobs concurrent workers under
+    the budget of a real run (see convert_guarded()), so timings include
+    its contention, and documents that time out, run out of memory, or
+    crash their worker count as failed. The boilerplate
+    learning and the dedupe.py and staticrank.py passes are not
+    included.
+
+    Args:
+        src_dir  Directory containing text and HTML files.
+        converter  The Converter to use; by default one that removes
+            src_dir from URLs.
+        jobs  Number of worker processes of the planned run.
+        timeout  Seconds allowed per document, or None for no limit.
+        memory_limit  Bytes of address space per worker, or None.
+        sample  Approximate number of files to convert.
+        seed  Seed of the random sampling offsets, for repeatable
+            estimates.
+
+    Returns:
+        A dict with the files and bytes of the tree, the number of
+        strata and sampled files, and (estimate, half-width of its 95%
+        confidence interval) tuples: wall seconds at jobs workers, CPU
+        seconds, output bytes, and failed files. peak is the largest
+        resident memory of a worker, in bytes, or memory_limit if a
+        document ran out of memory.
+    """
+    assert isinstance(src_dir, str), (
+        'src_dir is not a string: %r' % src_dir)
+    if converter is None:
+        converter = Converter(src_dir, TITLES)
+
+    files = []
+    for dirpath, _, filenames in os.walk(src_dir):
+        for filename in filenames:
+            _, extension = os.path.splitext(filename)
+            if extension in EXTENSIONS:
+                path = os.path.join(dirpath, filename)
+                files.append((path, os.path.getsize(path)))
+    if not files:
+        raise ValueError('No files to convert in ' + src_dir)
+
+    strata = {}
+    largest = sorted(files, key=lambda item: item[1])[-ESTIMATE_LARGEST:]
+    strata['largest'] = largest
+    largest = {path for path, _ in largest}
+    for path, size in files:
+        if path not in largest:
+            _, extension = os.path.splitext(path)
+            key = (extension, bisect.bisect(ESTIMATE_SIZE_CLASSES, size))
+            strata.setdefault(key, []).append((path, size))
+
+    rng = random.Random(seed)
+    chosen = {}
+    for key, count in _allocate_sample(strata, sample).items():
+        members = sorted(strata[key], key=_estimate_order)
+        step = len(members) / count
+        offset = rng.random() * step
+        chosen[key] = [members[int(offset + number * step)][0]
+                       for number in range(count)]
+    paths = [path for key in chosen for path in chosen[key]]
+    logging.info('Estimating from %d of %d files in %d strata', len(paths),
+                 len(files), len(strata))
+
+    measured = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tasks = [(path, os.path.join(tmp_dir, '{0}.json'.format(number)))
+                 for number, path in enumerate(paths)]
+        convert_guarded(tasks, converter, jobs, timeout, memory_limit,
+                        measured=measured)
+    results = {key: [measured[path] for path in chosen[key]]
+               for key in chosen}
+
+    # A run takes at least its total CPU time spread over the CPUs it can
+    # use, and no less than its slowest document
+    work, work_error = _stratified_total(strata, results, 'wall')
+    cpu, cpu_error = _stratified_total(strata, results, 'cpu')
+    cpus = min(jobs, os.cpu_count() or 1)
+    wall, wall_error = work / jobs, work_error / jobs
+    if cpu / cpus > wall:
+        wall, wall_error = cpu / cpus, cpu_error / cpus
+    wall = max(wall, max(result['wall'] for result in measured.values()))
+    return {
+        'files': len(files),
+        'bytes': sum(size for _, size in files),
+        'strata': len(strata),
+        'sampled': len(paths),
+        'wall': (wall, wall_error),
+        'cpu': (cpu, cpu_error),
+        'output': _stratified_total(strata, results, 'output'),
+        'failed': _stratified_total(strata, results, 'failed'),
+        'peak': max(result['peak'] for result in measured.values()),
+    }
+
+
+def format_estimate(result: dict, jobs: int=1) -> str:
+    """Return the result of estimate() as a short report."""
+    def interval(value, error, scale=1):
+        return '{0:.2f} (95% CI {1:.2f} to {2:.2f})'.format(
+            value / scale, max(value - error, 0) / scale,
+            (value + error) / scale)
+
+    return '\n'.join([
+        '{files} files, {0:.1f} MB, in {strata} strata; converted a sample'
+        ' of {sampled}'.format(result['bytes'] / 2**20, **result),
+        'Wall time at {0} jobs, minutes: {1}'.format(
+            jobs, interval(*result['wall'], scale=60)),
+        'CPU time, minutes: ' + interval(*result['cpu'], scale=60),
+        'Output size, MB: ' + interval(*result['output'], scale=2**20),
+        'Failed files: ' + interval(*result['failed']),
+        'Peak memory per worker, MB: {0:.1f}'.format(
+            result['peak'] / 2**20)])
+
+
+def load_titles(titles_file: str) -> dict:
+    """Read the YAML file associating directory names with book titles.
+
+    Args:
+        titles_file  Path to a YAML file such as titles.yaml.
+
+    Returns:
+        A dict for Converter or standardize_booktitle().
+    """
+    assert isinstance(titles_file, str), (
+        'titles_file is not a string: %r' % titles_file)
+    with open(titles_file, encoding='UTF-8') as titles_fh:
+        return yaml.load(titles_fh, Loader=Loader) or {}
+
+
+def load_priority(spec: str) -> 'function':
+    """Import a priority function named like module:function.
+
+    The function takes a source path and returns a sort key; files with
+    smaller keys are converted first. The module is imported from
+    sys.path, which includes the directory of this script.
+    """
+    assert isinstance(spec, str), (
+        'spec is not a string: %r' % spec)
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise ValueError('Priority must look like module:function: ' + spec)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def read_quarantine(quarantine: str) -> list:
+    """Return the paths listed in a quarantine file, for --retry."""
+    assert isinstance(quarantine, str), (
+        'quarantine is not a string: %r' % quarantine)
+    paths = []
+    with open(quarantine, encoding='UTF-8') as file_h:
+        for line in file_h:
+            if line.strip():
+                paths.append(json.loads(line)['path'])
+    return paths
+
+
+def text_to_json(text_file: str, path_prefix: str='', titles: dict=None,
+                 data: bytes=None, summary_length: int=SUMMARY_LENGTH) -> dict:
     """Parse text and return a dict that can be converted to JSON.
 
     Args:
         text_file  Path to a text file.
         path_prefix  String to remove from front of URL written to JSON.
+        titles  A dict associating directory names with book titles.
+        data  Content of the file; read from text_file if None.
+        summary_length  Maximum length of the summary field.
 
     Returns:
         A dict of metadata gathered from the file path.
@@ -105,8 +791,11 @@ def text_to_json(text_file: str, path_prefix: str='') -> dict:
         'path_prefix is not a string: %r' % path_prefix)
 
     # Read text files as cp1252, ignoring errors
-    with open(text_file, encoding='cp1252', errors='ignore') as file_h:
-        content = file_h.read()
+    if data is None:
+        with open(text_file, encoding='cp1252', errors='ignore') as file_h:
+            content = file_h.read()
+    else:
+        content = data.decode('cp1252', errors='ignore')
 
     # Convert file system path to URL syntax
     trimed_path = trim_prefix(text_file, path_prefix)
@@ -120,10 +809,11 @@ def text_to_json(text_file: str, path_prefix: str='') -> dict:
     # indexing
     text = collapse_whitespace(content)
 
-    meta = {'url': url, 'title': title, 'text': text}
+    meta = {'url': url, 'title': title, 'text': text,
+            'summary': shorten(text, summary_length)}
 
     # Update dict with metadata from the file path
-    meta.update(parse_path(text_file))
+    meta.update(parse_path(text_file, titles))
 
     return meta
 
@@ -227,13 +917,14 @@ def standardize_product(abbrev: str) -> str:
     return abbrev
 
 
-def standardize_booktitle(abbrev: str) -> str:
+def standardize_booktitle(abbrev: str, titles: dict=None) -> str:
     """Convert book title abbreviations to fuller book titles.
 
-    Uses the global constant TITLES, which is set in jsonify().
-
     Args:
         abbrev  A common abbreviation for a book title.
+        titles  A dict associating abbreviations with titles. Defaults
+                to the module constant TITLES, which is set from the
+                --titles file on the command line.
 
     Returns:
         The best full title for display.
@@ -241,8 +932,10 @@ def standardize_booktitle(abbrev: str) -> str:
     assert isinstance(abbrev, str), (
         'abbrev is not a string: %r' % abbrev)
 
-    if abbrev in TITLES:
-        abbrev = TITLES[abbrev]
+    if titles is None:
+        titles = TITLES
+    if abbrev in titles:
+        abbrev = titles[abbrev]
 
     return abbrev
 
@@ -421,106 +1114,268 @@ def _product_index(match: 're.match') -> dict:
     return meta
 
 
-def parse_path(path: str) -> dict:
+# Regular expressions for the kinds of paths parse_path() understands.
+# Compiled once, when the module is imported.
+_PATH_REGEX = {}
+
+# Paths like HDPDocuments/SS1/SmartSense-1.2.2/bk_smartsense_admin/
+_PATH_REGEX['std_path'] = re.compile(r"""
+    HDPDocuments/[^/]+/ (?P<p>\w+) - (?P<r>[.\w]+) /
+    (?:ds_|bk_)? (?P<b>[^/]+) /
+    """, flags=re.X)
+
+# Paths like HDPDocuments/HDP2/HDP-2.3-yj/bk_hadoop-ha/
+_PATH_REGEX['hdp_23_yj_path'] = re.compile(r"""
+    HDPDocuments/HDP2/HDP-2.3-yj/(?:ds_|bk_)? (?P<b>[^/]+) /
+    """, flags=re.X)
+
+# Paths like HDPDocuments/HDP2/HDP-2.2.4-Win/bk_Clust_Plan_Gd_Win/
+_PATH_REGEX['win_new_path'] = re.compile(r"""
+    HDPDocuments/[^/]+/HDP- (?P<r>[.\w]+) -Win /(?:ds_|bk_)? (?P<b>[^/]+) /
+    """, flags=re.X)
+
+# Paths like HDPDocuments/HDP1/HDP-Win-1.1/bk_cluster-planning-guide/
+_PATH_REGEX['win_old_path'] = re.compile(r"""
+    HDPDocuments/[^/]+/HDP-Win- (?P<r>[.\w]+) / (?:ds_|bk_)? (?P<b>[^/]+) /
+    """, flags=re.X)
+
+# Paths like HDPDocuments/Ambari-1.5.0.0/bk_ambari_security/
+_PATH_REGEX['ambari_path'] = re.compile(r"""
+    HDPDocuments/Ambari- (?P<r>[.\w]+) / (?:ds_|bk_)? (?P<b>[^/]+) /
+    """, flags=re.X)
+
+# Paths like HDPDocuments/Ambari/Ambari-2.2.2.0/index.html
+_PATH_REGEX['std_path_index'] = re.compile(r"""
+    HDPDocuments/[^/]+/ (?P<p>\w+) - (?P<r>[.\w]+) /
+    [^/]+(?:[.]html?|[.]txt)\Z
+    """, flags=re.X)
+
+# Paths like HDPDocuments/HDP2/HDP-2.1.15-Win/index.html
+_PATH_REGEX['win_new_index'] = re.compile(r"""
+    HDPDocuments/[^/]+/HDP- (?P<r>[.\w]+) -Win/[^/]+(?:[.]html?|[.]txt)\Z
+    """, flags=re.X)
+
+# Paths like HDPDocuments/HDP1/HDP-Win-1.3.0/index.html
+_PATH_REGEX['win_old_index'] = re.compile(r"""
+    HDPDocuments/[^/]+/HDP-Win - (?P<r>[.\w]+) /[^/]+(?:[.]html?|[.]txt)\Z
+    """, flags=re.X)
+
+# Paths like HDPDocuments/Ambari-1.7.0.0/index.html
+_PATH_REGEX['ambari_path_index'] = re.compile(r"""
+    HDPDocuments/Ambari- (?P<r>[.\w]+) /[^/]+(?:[.]html?|[.]txt)\Z
+    """, flags=re.X)
+
+# Paths like HDPDocuments/SS1/index.html
+_PATH_REGEX['product_index'] = re.compile(r"""
+    HDPDocuments/(?P<p>[a-zA-Z]+) [^/]*/[^/]+(?:[.]html?|[.]txt)\Z
+    """, flags=re.X)
+
+# Associate the complied regex keys with function names
+_PATH_PROCESS = {
+    'std_path': _std_path,
+    'hdp_23_yj_path': _hdp_23_yj_path,
+    'win_new_path': _win_new_path,
+    'win_old_path': _win_old_path,
+    'ambari_path': _ambari_path,
+    'std_path_index': _std_path_index,
+    'win_new_index': _win_new_index,
+    'win_old_index': _win_old_index,
+    'ambari_path_index': _ambari_path_index,
+    'product_index': _product_index,
+}
+
+
+def parse_path(path: str, titles: dict=None) -> dict:
     """Get product, release, and booktitle from path.
 
     Args:
         path  A URL path.
+        titles  A dict associating directory names with book titles.
 
     Returns:
-        A dict containing product, release, and booktitle values.
+        A dict containing product, release, release_key, release_tag
+        (only if the release has a tag), and booktitle values.
     """
     assert isinstance(path, str), (
         'path is not a string: %r' % path)
 
-    regex = {}
-
-    # Paths like HDPDocuments/SS1/SmartSense-1.2.2/bk_smartsense_admin/
-    regex['std_path'] = re.compile(r"""
-        HDPDocuments/[^/]+/ (?P<p>\w+) - (?P<r>[.\w]+) /
-        (?:ds_|bk_)? (?P<b>[^/]+) /
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/HDP2/HDP-2.3-yj/bk_hadoop-ha/
-    regex['hdp_23_yj_path'] = re.compile(r"""
-        HDPDocuments/HDP2/HDP-2.3-yj/(?:ds_|bk_)? (?P<b>[^/]+) /
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/HDP2/HDP-2.2.4-Win/bk_Clust_Plan_Gd_Win/
-    regex['win_new_path'] = re.compile(r"""
-        HDPDocuments/[^/]+/HDP- (?P<r>[.\w]+) -Win /(?:ds_|bk_)? (?P<b>[^/]+) /
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/HDP1/HDP-Win-1.1/bk_cluster-planning-guide/
-    regex['win_old_path'] = re.compile(r"""
-        HDPDocuments/[^/]+/HDP-Win- (?P<r>[.\w]+) / (?:ds_|bk_)? (?P<b>[^/]+) /
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/Ambari-1.5.0.0/bk_ambari_security/
-    regex['ambari_path'] = re.compile(r"""
-        HDPDocuments/Ambari- (?P<r>[.\w]+) / (?:ds_|bk_)? (?P<b>[^/]+) /
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/Ambari/Ambari-2.2.2.0/index.html
-    regex['std_path_index'] = re.compile(r"""
-        HDPDocuments/[^/]+/ (?P<p>\w+) - (?P<r>[.\w]+) /
-        [^/]+(?:[.]html?|[.]txt)\Z
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/HDP2/HDP-2.1.15-Win/index.html
-    regex['win_new_index'] = re.compile(r"""
-        HDPDocuments/[^/]+/HDP- (?P<r>[.\w]+) -Win/[^/]+(?:[.]html?|[.]txt)\Z
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/HDP1/HDP-Win-1.3.0/index.html
-    regex['win_old_index'] = re.compile(r"""
-        HDPDocuments/[^/]+/HDP-Win - (?P<r>[.\w]+) /[^/]+(?:[.]html?|[.]txt)\Z
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/Ambari-1.7.0.0/index.html
-    regex['ambari_path_index'] = re.compile(r"""
-        HDPDocuments/Ambari- (?P<r>[.\w]+) /[^/]+(?:[.]html?|[.]txt)\Z
-        """, flags=re.X)
-
-    # Paths like HDPDocuments/SS1/index.html
-    regex['product_index'] = re.compile(r"""
-        HDPDocuments/(?P<p>[a-zA-Z]+) [^/]*/[^/]+(?:[.]html?|[.]txt)\Z
-        """, flags=re.X)
-
-    # Associate the complied regex keys with function names
-    process = {
-        'std_path': _std_path,
-        'hdp_23_yj_path': _hdp_23_yj_path,
-        'win_new_path': _win_new_path,
-        'win_old_path': _win_old_path,
-        'ambari_path': _ambari_path,
-        'std_path_index': _std_path_index,
-        'win_new_index': _win_new_index,
-        'win_old_index': _win_old_index,
-        'ambari_path_index': _ambari_path_index,
-        'product_index': _product_index,
-    }
-
     meta = {}
 
     # Call the appropriate subroutine using the "process" lookup table, above
-    for key in regex:
-        match = regex[key].search(path)
+    for key in _PATH_REGEX:
+        match = _PATH_REGEX[key].search(path)
         if match:
-            meta = process[key](match)
+            meta = _PATH_PROCESS[key](match)
 
     if 'product' in meta:
         meta['product'] = standardize_product(meta['product'])
     if 'release' in meta:
         meta['release'] = standardize_release(meta['release'])
+        meta['release_key'], release_tag = releases.parse_release(
+            meta['release'])
+        if release_tag:
+            meta['release_tag'] = release_tag
     if 'booktitle' in meta:
-        meta['booktitle'] = standardize_booktitle(meta['booktitle'])
+        meta['booktitle'] = standardize_booktitle(meta['booktitle'], titles)
 
     if not meta:
         logging.warning('No path metadata from ' + path)
     return meta
 
 
+def _match_path(path: str) -> tuple:
+    """Return the raw path metadata and the _PATH_REGEX key that
+    matched path, like parse_path() but without standardizing values or
+    logging unmatched paths.
+    """
+    meta, kind = {}, ''
+    for key in _PATH_REGEX:
+        match = _PATH_REGEX[key].search(path)
+        if match:
+            meta, kind = _PATH_PROCESS[key](match), key
+    return meta, kind
+
+
+def default_priority(path: str) -> tuple:
+    """Return a sort key that schedules newer releases first.
+
+    Within a release, index and landing pages come before the rest.
+    Files without a release in their path come last.
+
+    Args:
+        path  A path to a text or HTML file.
+
+    Returns:
+        A tuple; files with smaller keys are converted first.
+    """
+    assert isinstance(path, str), (
+        'path is not a string: %r' % path)
+    meta, kind = _match_path(path)
+    landing = kind.endswith('_index') or os.path.basename(
+        path).startswith('index.')
+    release = meta.get('release')
+    if not release:
+        return (1, (), not landing, path)
+    key, tag = releases.parse_release(standardize_release(release))
+    return (0, -key, tag, not landing, path)
+
+
+def boilerplate_group(path: str) -> tuple:
+    """Return the key of the pages path is compared with to find
+    boilerplate: its product, release, and book, or its directory.
+    """
+    meta, _ = _match_path(path)
+    if 'booktitle' not in meta:
+        return ('', '', os.path.dirname(path))
+    return (meta.get('product', ''), meta.get('release', ''),
+            meta.get('booktitle', ''))
+
+
+def _iter_leaf_blocks(element: 'lxml.html.HtmlElement'):
+    """Yield (block, hash) for each block element under element that
+    contains no other block element and has text. The hash covers the
+    tag and the collapsed text of the block, not its tail.
+
+    Headings are never boilerplate: a heading repeated on most pages,
+    such as "Prerequisites", still starts a section and a passage.
+    """
+    for block in element.iter(*HTML_BLOCKS):
+        if block.tag in BOILERPLATE_KEEP_TAGS:
+            continue
+        if next(block.iterdescendants(*HTML_BLOCKS), None) is not None:
+            continue
+        text = collapse_whitespace(''.join(
+            [block.text or ''] + [get_text(child) for child in block]))
+        if text:
+            yield block, zlib.crc32('{0}\0{1}'.format(
+                block.tag, text).encode('UTF-8'))
+
+
+def _block_hash_task(path: str) -> tuple:
+    """Return the boilerplate group of an HTML page and the hashes of
+    its leaf blocks.
+    """
+    try:
+        with open(path, mode='rb') as file_h:
+            etree = parse_html(file_h.read())
+    except (OSError, ValueError, lxml.etree.LxmlError):
+        return boilerplate_group(path), set()
+    if etree.getroot() is None:
+        return boilerplate_group(path), set()
+    return boilerplate_group(path), {
+        block_hash for _, block_hash in
+        _iter_leaf_blocks(get_content_root(etree))}
+
+
+def learn_boilerplate(src_dir: str, threshold: float=0.5,
+                      jobs: int=None) -> dict:
+    """Find text blocks repeated on most HTML pages of each book.
+
+    Navigation menus, tables of contents, and footers appear on every
+    page of a book. A leaf block whose tag and text appear on at least
+    threshold of the pages of a book with BOILERPLATE_MIN_PAGES or more
+    pages is boilerplate.
+
+    Args:
+        src_dir  Directory containing text and HTML files.
+        threshold  Fraction of pages a block must appear on.
+        jobs  Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        A dict of sets of block hashes keyed by boilerplate_group(),
+        for the Converter boilerplate argument.
+    """
+    assert isinstance(src_dir, str), (
+        'src_dir is not a string: %r' % src_dir)
+    paths = []
+    for dirpath, _, filenames in os.walk(src_dir):
+        for filename in filenames:
+            _, extension = os.path.splitext(filename)
+            if extension in EXTENSIONS and extension != '.txt':
+                paths.append(os.path.join(dirpath, filename))
+
+    pages, counts = {}, {}
+    with multiprocessing.Pool(jobs) as pool:
+        for group, hashes in pool.imap_unordered(_block_hash_task, paths,
+                                                 chunksize=16):
+            pages[group] = pages.get(group, 0) + 1
+            counts.setdefault(group, {})
+            for block_hash in hashes:
+                counts[group][block_hash] = counts[group].get(
+                    block_hash, 0) + 1
+
+    boilerplate = {}
+    for group, number in pages.items():
+        if number < BOILERPLATE_MIN_PAGES:
+            continue
+        repeated = {block_hash for block_hash, count in counts[group].items()
+                    if count >= threshold * number}
+        if repeated:
+            boilerplate[group] = repeated
+            logging.info('%d boilerplate blocks in %d pages of %s',
+                         len(repeated), number, '/'.join(group))
+    return boilerplate
+
+
+def strip_boilerplate(etree: 'lxml.html.parse', html_path: str,
+                      boilerplate: dict) -> int:
+    """Remove the boilerplate blocks of html_path's book from etree,
+    under the content root the blocks were learned from.
+
+    Returns:
+        The number of blocks removed.
+    """
+    hashes = boilerplate.get(boilerplate_group(html_path))
+    if not hashes:
+        return 0
+    removed = [block for block, block_hash in
+               _iter_leaf_blocks(get_content_root(etree))
+               if block_hash in hashes]
+    for block in removed:
+        block.drop_tree()  # Keeps the tail, which belongs to the parent
+    return len(removed)
+
+
 def get_datetime(path: str) -> str:
     """Return UTC file modification date in datetime format.
 
@@ -540,6 +1395,63 @@ def get_datetime(path: str) -> str:
     return datetime
 
 
+def sniff_encoding(data: bytes) -> tuple:
+    """Find the encoding of an HTML document from its byte order mark
+    or a meta charset in its first CHARSET_PRESCAN bytes.
+
+    Returns:
+        A tuple of the encoding name, or None if not found, and the
+        length of the byte order mark.
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding, len(bom)
+    match = META_CHARSET_REGEX.search(data, 0, CHARSET_PRESCAN)
+    if match:
+        return match.group(1).decode('ascii'), 0
+    return None, 0
+
+
+def get_parser(encoding: str=None) -> 'lxml.html.HTMLParser':
+    """Return the HTML parser of this process for an encoding, creating
+    it on first use. Parsers drop comments and processing instructions.
+
+    Raises:
+        LookupError  libxml2 does not know the encoding.
+    """
+    key = encoding.lower() if encoding else None
+    if key not in _PARSERS:
+        _PARSERS[key] = lxml.html.HTMLParser(
+            encoding=encoding, remove_comments=True, remove_pis=True)
+    return _PARSERS[key]
+
+
+def parse_html(data: bytes) -> 'lxml.etree._ElementTree':
+    """Parse HTML bytes into an element tree without comments,
+    processing instructions, or PRUNED_TAGS elements.
+
+    The encoding is given to the parser when sniff_encoding() finds one,
+    so libxml2 does not start over when it reaches a meta charset.
+    Otherwise libxml2 detects it as lxml.html.parse() does.
+
+    Returns:
+        An element tree, whose getroot() is None for empty documents.
+    """
+    assert isinstance(data, bytes), (
+        'data is not bytes: %r' % type(data))
+    encoding, bom_length = sniff_encoding(data)
+    try:
+        parser = get_parser(encoding)
+    except LookupError:
+        parser = get_parser()
+    root = lxml.etree.fromstring(data[bom_length:] if bom_length else data,
+                                 parser)
+    if root is None:
+        return lxml.etree.ElementTree()
+    lxml.etree.strip_elements(root, *PRUNED_TAGS, with_tail=False)
+    return root.getroottree()
+
+
 def get_text(element: 'lxml.html.HtmlElement') -> str:
     """Get text from HTML elements, even text after child elements (tails).
 
@@ -559,18 +1471,6 @@ def get_text(element: 'lxml.html.HtmlElement') -> str:
         return ''
     text = []
 
-    # Combination of 'caption', 'tbody', and 'thead' plus
-    # https://www.w3.org/TR/CSS21/sample.html#q22.0 and
-    # https://developer.mozilla.org/en-US/docs/Web/HTML/Block-level_elements
-    html_blocks = ('address', 'article', 'aside', 'blockquote', 'body',
-                   'canvas', 'center', 'dd', 'dir', 'div', 'dl', 'dt',
-                   'fieldset', 'figcaption', 'figure', 'footer', 'form',
-                   'frame', 'frameset', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-                   'header', 'hgroup', 'hr', 'html', 'li', 'main', 'menu',
-                   'nav', 'noframes', 'noscript', 'ol', 'output', 'p',
-                   'pre', 'section', 'table', 'tfoot', 'ul', 'video',
-                   'caption', 'tbody', 'thead')
-
     if element.text:
         text.append(element.text)
 
@@ -580,7 +1480,7 @@ def get_text(element: 'lxml.html.HtmlElement') -> str:
     if element.tail:
         text.append(element.tail)
 
-    if element.tag in html_blocks:
+    if element.tag in HTML_BLOCKS:
         return ' {0} '.format(''.join(text))
     else:
         return ''.join(text)
@@ -741,6 +1641,77 @@ def get_html_priority_text(etree: 'lxml.html.parse', meta: dict,
     return meta
 
 
+def get_content_root(etree: 'lxml.html.parse') -> 'lxml.html.HtmlElement':
+    """Return div#content if the page has one, otherwise the root."""
+    content = etree.xpath("/html/body/div[@id='content']")
+    if content:
+        return content[0]
+    return etree.getroot()
+
+
+def shorten(text: str, max_length: int) -> str:
+    """Cut text at a word boundary so it is at most max_length long.
+
+    Args:
+        text  Text with collapsed whitespace.
+        max_length  Maximum length of the result, including the
+                    ellipsis added when text is cut.
+
+    Returns:
+        The text, shortened if necessary.
+    """
+    assert isinstance(text, str), (
+        'text is not a string: %r' % text)
+    if len(text) <= max_length:
+        return text
+    cut = text[:max_length - 1]
+    if ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    return cut.rstrip(' ,.;:') + '\N{HORIZONTAL ELLIPSIS}'
+
+
+def get_html_summary(etree: 'lxml.html.parse', meta: dict,
+                     max_length: int=SUMMARY_LENGTH) -> dict:
+    """Add a short summary for search result lists to passed dict.
+
+    Uses the description meta element if there is one, otherwise the
+    first paragraphs of div#content, otherwise the leading text. Call
+    after get_html_metas() and get_html_text().
+
+    Args:
+        etree  An element tree representing a parsed HTML document.
+        meta  A dict of metadata relating to the same HTML document.
+        max_length  Maximum length of the summary.
+
+    Returns:
+        The dict of metadata.
+    """
+    assert isinstance(meta, dict), (
+        'meta is not a dict: %r' % meta)
+
+    if etree.getroot() is None:
+        logging.error('No root in etree passed to get_html_summary()')
+        return {}
+
+    summary = meta.get('description', '')
+    if not summary:
+        paragraphs = []
+        length = 0
+        for para in etree.xpath("/html/body/div[@id='content']//p"):
+            para_text = collapse_whitespace(get_text(para))
+            if para_text:
+                paragraphs.append(para_text)
+                length += len(para_text) + 1
+            if length >= max_length:
+                break
+        summary = ' '.join(paragraphs)
+    if not summary:
+        summary = meta.get('text', '')
+    meta['summary'] = shorten(summary, max_length)
+
+    return meta
+
+
 def get_html_text(etree: 'lxml.html.parse', meta: dict) -> dict:
     """Add text from HTML document to text key in passed dict.
 
@@ -758,23 +1729,219 @@ def get_html_text(etree: 'lxml.html.parse', meta: dict) -> dict:
         logging.error('No root in etree passed to get_html_text()')
         return {}
 
-    content = etree.xpath("/html/body/div[@id='content']")
-    if content:
-        meta['text'] = get_text(content[0])
-    else:
-        meta['text'] = get_text(etree.getroot())
+    meta['text'] = get_text(get_content_root(etree))
     meta['text'] = collapse_whitespace(meta['text'])
     meta['text'] = trim_suffix(meta['text'], ' Legal notices')
 
     return meta
 
 
-def html_to_json(html_path: str, path_prefix: str='') -> dict:
+def _split_sections(element: 'lxml.html.HtmlElement',
+                    sections: list) -> None:
+    """Append text to sections like get_text(), starting a new section at
+    each passage heading.
+
+    Args:
+        element  An lxml.html.HtmlElement object.
+        sections  A list of [heading, text list] pairs; text is added to
+                  the last pair.
+    """
+    if (not isinstance(element, lxml.html.HtmlElement) and
+            not isinstance(element, lxml.html.FormElement) and
+            not isinstance(element, lxml.html.InputElement)):
+        return
+    if element.tag == 'script' or element.tag == 'style':
+        return
+    if element.tag in PASSAGE_HEADINGS:
+        sections.append([element, [get_text(element)]])
+        return
+
+    is_block = element.tag in HTML_BLOCKS
+    if is_block:
+        sections[-1][1].append(' ')
+    if element.text:
+        sections[-1][1].append(element.text)
+    for child in element.iterchildren():
+        _split_sections(child, sections)  # recurse
+    if element.tail:
+        sections[-1][1].append(element.tail)
+    if is_block:
+        sections[-1][1].append(' ')
+
+
+def _get_anchor(heading: 'lxml.html.HtmlElement',
+                content: 'lxml.html.HtmlElement') -> str:
+    """Return the fragment identifier that links to a heading.
+
+    Looks at the heading, then at named anchors inside it (DocBook puts
+    <a name="..."> there), then at ancestors below the content root.
+    """
+    if heading.get('id'):
+        return heading.get('id')
+    for elem in heading.iterdescendants():
+        if not isinstance(elem, lxml.html.HtmlElement):
+            continue
+        anchor = elem.get('id') or elem.get('name')
+        if anchor:
+            return anchor
+    for elem in heading.iterancestors():
+        if elem is content:
+            break
+        if elem.get('id'):
+            return elem.get('id')
+    return ''
+
+
+def get_html_passages(etree: 'lxml.html.parse', meta: dict,
+                      section_numbering_characters: str) -> dict:
+    """Add passage documents, one per h2 or h3 section, to passed dict.
+
+    Passages are Solr child documents in the _childDocuments_ key. Each
+    has its own id, the parent id, the anchor and title of its section,
+    the section text, and the parent's product, release, booktitle,
+    title, and lang. The text of the parent is cut to the text before
+    the first heading, so each part of the page is searched and
+    highlighted in one small document only. The full text is the
+    parent text followed by the text of each passage.
+
+    Args:
+        etree  An element tree representing a parsed HTML document.
+        meta  A dict of metadata relating to the same HTML document,
+              including id and url.
+        section_numbering_characters  Characters to strip from the
+            beginning of titles to remove section numbering.
+
+    Returns:
+        The dict of metadata.
+    """
+    assert isinstance(meta, dict), (
+        'meta is not a dict: %r' % meta)
+
+    if etree.getroot() is None:
+        logging.error('No root in etree passed to get_html_passages()')
+        return {}
+
+    content = get_content_root(etree)
+    sections = [[None, []]]
+    _split_sections(content, sections)
+
+    passages = []
+    ids = set()
+    lead = ''
+    for position, (heading, text) in enumerate(sections):
+        text = collapse_whitespace(''.join(text))
+        text = trim_suffix(text, ' Legal notices')
+        if heading is None:
+            lead = text
+            continue
+        if not text:
+            continue
+        anchor = _get_anchor(heading, content)
+        passage_id = '{0}#{1}'.format(meta['id'],
+                                      anchor or 'section-%d' % position)
+        while passage_id in ids:
+            passage_id += '-%d' % position
+        ids.add(passage_id)
+        passage = {
+            'id': passage_id,
+            'parent_id': meta['id'],
+            'url': meta['url'] + ('#' + anchor if anchor else ''),
+            'anchor': anchor,
+            'section_title': _process_title(get_text(heading),
+                                            section_numbering_characters),
+            'text': text,
+        }
+        for field in ('title', 'lang', 'product', 'release', 'booktitle'):
+            if field in meta:
+                passage[field] = meta[field]
+        passages.append(passage)
+
+    if passages:
+        meta['_childDocuments_'] = passages
+        meta['text'] = lead
+
+    return meta
+
+
+def resolve_link(page_url: str, href: str) -> str:
+    """Return the url field value of the page an href points to.
+
+    Args:
+        page_url  The url field value of the page containing the link.
+        href  The href attribute of the link.
+
+    Absolute and root-relative hrefs are site paths, which are made
+    relative to SITE_ROOT like url fields. '..' stops at SITE_ROOT.
+
+    Returns:
+        A URL path, or '' for links to other sites, other schemes,
+        paths outside SITE_ROOT, or a fragment of the same page.
+        Directory paths get index.html.
+    """
+    parts = urllib.parse.urlsplit(href.strip())
+    if parts.scheme not in ('', 'http', 'https'):
+        return ''
+    path = urllib.parse.unquote(parts.path)
+    directory = path.endswith('/')
+    if parts.netloc or path.startswith('/'):
+        if parts.netloc and parts.netloc.lower() not in SITE_HOSTS:
+            return ''
+        path = posixpath.normpath('/' + path.lstrip('/'))
+        if path != SITE_ROOT and not path.startswith(SITE_ROOT + '/'):
+            return ''
+        path = path[len(SITE_ROOT):]
+    elif path:
+        path = posixpath.join(posixpath.dirname(
+            urllib.parse.unquote(page_url)), path)
+    else:
+        return ''
+    path = posixpath.normpath('/' + path.lstrip('/'))
+    if directory or path == '/':
+        path = path.rstrip('/') + '/index.html'
+    return urllib.parse.quote(path)
+
+
+def get_html_links(etree: 'lxml.html.parse', meta: dict) -> dict:
+    """Add the distinct site pages linked from the document, other than
+    itself, to the _links key in passed dict.
+
+    Args:
+        etree  An element tree representing a parsed HTML document.
+        meta  A dict of metadata with the url of the same document.
+
+    Returns:
+        The dict of metadata.
+    """
+    assert isinstance(meta, dict), (
+        'meta is not a dict: %r' % meta)
+    targets = set()
+    for anchor in etree.iter('a'):
+        href = anchor.get('href')
+        if href:
+            targets.add(resolve_link(meta['url'], href))
+    targets.discard('')
+    targets.discard(meta['url'])
+    meta['_links'] = sorted(targets)
+    return meta
+
+
+def html_to_json(html_path: str, path_prefix: str='', titles: dict=None,
+                 data: bytes=None, passages: bool=False,
+                 summary_length: int=SUMMARY_LENGTH,
+                 boilerplate: dict=None, links: bool=False) -> dict:
     """Parse HTML and return a dict that can be converted to JSON.
 
     Args:
         html_path  Path to a directory containing HTML and text files.
         path_prefix  Text to be removed from the beginning of URLs.
+        titles  A dict associating directory names with book titles.
+        data  Content of the file; read from html_path if None.
+        passages  Also split the page into passage child documents.
+        summary_length  Maximum length of the summary field.
+        boilerplate  Blocks repeated across the book, removed before
+            getting text; see learn_boilerplate().
+        links  Also list linked site pages under _links; see
+            get_html_links().
 
     Returns:
         A dict of metadata suitable for conversion to a JSON file.
@@ -788,7 +1955,10 @@ def html_to_json(html_path: str, path_prefix: str='') -> dict:
     section_numbering_characters = ('-.0123456789'
                                     "\N{SPACE}\N{NO-BREAK SPACE}\N{EN DASH}")
     # Parse page
-    etree = lxml.html.parse(html_path)
+    if data is None:
+        with open(html_path, mode='rb') as file_h:
+            data = file_h.read()
+    etree = parse_html(data)
     if etree.getroot() is None:
         logging.error('No root: ' + html_path)
         return {}
@@ -804,6 +1974,11 @@ def html_to_json(html_path: str, path_prefix: str='') -> dict:
     if 'title' not in meta:
         logging.error('No title: ' + html_path)
 
+    # Remove navigation, tables of contents, and footers repeated on
+    # the other pages of the book
+    if boilerplate:
+        strip_boilerplate(etree, html_path, boilerplate)
+
     # Get text from areas representing priority content
     # Matches in this content should cause the document to rank higher
     get_html_priority_text(etree, meta, section_numbering_characters)
@@ -811,13 +1986,26 @@ def html_to_json(html_path: str, path_prefix: str='') -> dict:
     # Get page content
     get_html_text(etree, meta)
 
+    # Get a short summary to show in result lists without the full text
+    get_html_summary(etree, meta, summary_length)
+
     # Convert file system path to URL syntax
     meta['url'] = trim_prefix(html_path, path_prefix)
     meta['url'] = urllib.parse.quote(meta['url'])
     meta['id'] = meta['url']
 
     # Update dict with metadata from the file path
-    meta.update(parse_path(html_path))
+    meta.update(parse_path(html_path, titles))
+
+    # Links to other pages, outside any stripped boilerplate, for
+    # staticrank.py
+    if links:
+        get_html_links(etree, meta)
+
+    # Split large pages into small documents that can be highlighted
+    # quickly and linked to by section
+    if passages:
+        get_html_passages(etree, meta, section_numbering_characters)
 
     return meta
 
@@ -828,6 +2016,8 @@ if __name__ == '__main__':
     # Get command-line arguments
     ARGPARSER = argparse.ArgumentParser()
     LOGFILE, _ = os.path.splitext(os.path.basename(__file__))
+    QUARANTINE = LOGFILE + '-quarantine.jsonl'
+    LINKS = LOGFILE + '-links.jsonl'
     LOGFILE += '.log'
     ARGPARSER.add_argument('-l', '--logfile', default=LOGFILE,
                            help='the log file, defaults to ./' + LOGFILE)
@@ -837,12 +2027,87 @@ if __name__ == '__main__':
     ARGPARSER.add_argument('-t', '--titles',
                            help='path to YAML file associating directory'
                            ' names with titles.')
+    ARGPARSER.add_argument('-j', '--jobs', type=int, default=1,
+                           help='number of worker processes, defaults to 1')
+    ARGPARSER.add_argument('--timeout', type=float, default=300,
+                           help='seconds allowed per document, defaults to'
+                           ' 300; 0 for no limit')
+    ARGPARSER.add_argument('--memory', type=int, default=2048,
+                           help='megabytes of address space per worker,'
+                           ' defaults to 2048; 0 for no limit')
+    ARGPARSER.add_argument('-q', '--quarantine',
+                           default=QUARANTINE,
+                           help='JSON lines file listing skipped documents,'
+                           ' defaults to ./' + QUARANTINE)
+    ARGPARSER.add_argument('--retry',
+                           help='quarantine file from an earlier run; convert'
+                           ' only the files it lists into existing out_dir')
+    ARGPARSER.add_argument('-p', '--passages', action='store_true',
+                           help='also split HTML pages into passage child'
+                           ' documents at h2 and h3 headings')
+    ARGPARSER.add_argument('--summary-length', type=int,
+                           default=SUMMARY_LENGTH,
+                           help='maximum length of the summary field,'
+                           ' defaults to %d' % SUMMARY_LENGTH)
+    ARGPARSER.add_argument('--dedupe', action='store_true',
+                           help='mark near-duplicate documents with dup_group'
+                           ' and canonical fields')
+    ARGPARSER.add_argument('--dedupe-threshold', type=float, default=0.85,
+                           help='with --dedupe, the minimum similarity of'
+                           ' near-duplicates, defaults to 0.85')
+    ARGPARSER.add_argument('--dedupe-drop', action='store_true',
+                           help='with --dedupe, delete non-canonical'
+                           ' documents instead of marking them')
+    ARGPARSER.add_argument('--progressive', action='store_true',
+                           help='convert the newest releases first, then'
+                           ' their index pages, then the rest')
+    ARGPARSER.add_argument('--priority',
+                           help='a module:function that takes a source path'
+                           ' and returns a sort key, for --progressive;'
+                           ' defaults to jsonify:default_priority')
+    ARGPARSER.add_argument('-b', '--boilerplate', action='store_true',
+                           help='first find text blocks repeated on most'
+                           ' pages of each book, then leave them out of'
+                           ' the text')
+    ARGPARSER.add_argument('--boilerplate-threshold', type=float,
+                           default=0.5,
+                           help='with --boilerplate, the fraction of pages'
+                           ' a block must appear on, defaults to 0.5')
+    ARGPARSER.add_argument('--serializer', default='json',
+                           choices=sorted(serializers.SERIALIZERS) +
+                           ['auto'],
+                           help='JSON encoder, defaults to json, the standard'
+                           ' library; auto picks the fastest installed')
+    ARGPARSER.add_argument('-c', '--catalog',
+                           help='SQLite file where converted documents are'
+                           ' cataloged; see catalog.py')
+    ARGPARSER.add_argument('--static-rank', action='store_true',
+                           help='record links between pages and add a'
+                           ' static_rank field computed from them; see'
+                           ' staticrank.py')
+    ARGPARSER.add_argument('--links', default=LINKS,
+                           help='with --static-rank, JSON lines file of the'
+                           ' links of each page, defaults to ./' + LINKS +
+                           '; appended to by --retry')
+    ARGPARSER.add_argument('--estimate', action='store_true',
+                           help='convert only a sample and print the'
+                           ' predicted time, memory, and output size of'
+                           ' a run at --jobs; out_dir is not needed')
+    ARGPARSER.add_argument('--estimate-sample', type=int,
+                           default=ESTIMATE_SAMPLE,
+                           help='with --estimate, the number of files to'
+                           ' convert, defaults to %d' % ESTIMATE_SAMPLE)
+    ARGPARSER.add_argument('--seed', type=int,
+                           help='with --estimate, the random seed, for'
+                           ' repeatable estimates')
     ARGPARSER.add_argument('in_dir',
                            help='directory containing text and HTML files')
-    ARGPARSER.add_argument('out_dir',
+    ARGPARSER.add_argument('out_dir', nargs='?',
                            help='nonexisting directory where JSON files'
                            ' will be written')
     ARGS = ARGPARSER.parse_args()
+    if not ARGS.out_dir and not ARGS.estimate:
+        ARGPARSER.error('the following arguments are required: out_dir')
 
     # In JSON, include the URL only from the web root. We can add the
     # authority (e.g., the domain, i.e., docs.hortonworks.com) in
@@ -863,10 +2128,68 @@ if __name__ == '__main__':
     TITLES = {}
     if ARGS.titles:
         try:
-            with open(ARGS.titles, encoding='UTF-8') as titles_fh:
-                TITLES = yaml.load(titles_fh, Loader=Loader)
+            TITLES = load_titles(ARGS.titles)
         except yaml.YAMLError:
             logging.critical("Can't decode YAML from " + ARGS.titles)
             sys.exit()
-
-    jsonify(ARGS.in_dir, ARGS.out_dir)
+    BOILERPLATE = None
+    if ARGS.estimate:
+        CONVERTER = Converter(ARGS.in_dir, TITLES, ARGS.passages,
+                              ARGS.summary_length, ARGS.serializer, None,
+                              ARGS.static_rank)
+        try:
+            RESULT = estimate(ARGS.in_dir, CONVERTER, ARGS.jobs,
+                              ARGS.timeout or None,
+                              ARGS.memory * 2**20 or None,
+                              ARGS.estimate_sample, ARGS.seed)
+        except ValueError as error:
+            sys.exit(str(error))
+        print(format_estimate(RESULT, ARGS.jobs))
+        PASSES = [name for name, enabled in (
+            ('--boilerplate', ARGS.boilerplate), ('--dedupe', ARGS.dedupe),
+            ('--static-rank', ARGS.static_rank)) if enabled]
+        if PASSES:
+            print('Not included: the passes of ' + ', '.join(PASSES))
+        sys.exit()
+    if ARGS.boilerplate:
+        BOILERPLATE = learn_boilerplate(ARGS.in_dir,
+                                        ARGS.boilerplate_threshold,
+                                        ARGS.jobs)
+    CONVERTER = Converter(ARGS.in_dir, TITLES, ARGS.passages,
+                          ARGS.summary_length, ARGS.serializer, BOILERPLATE,
+                          ARGS.static_rank)
+
+    RETRY = read_quarantine(ARGS.retry) if ARGS.retry else None
+    PRIORITY = None
+    if ARGS.priority:
+        PRIORITY = load_priority(ARGS.priority)
+    elif ARGS.progressive:
+        PRIORITY = default_priority
+    if ARGS.quarantine and os.path.exists(ARGS.quarantine):
+        os.remove(ARGS.quarantine)
+    if ARGS.catalog and not RETRY and os.path.exists(ARGS.catalog):
+        os.remove(ARGS.catalog)
+    if ARGS.static_rank and not RETRY and os.path.exists(ARGS.links):
+        os.remove(ARGS.links)
+
+    # dedupe.py and staticrank.py rewrite the files, so catalog them
+    # after they run
+    REWRITE = ARGS.dedupe or ARGS.static_rank
+    FAILURES = jsonify(ARGS.in_dir, ARGS.out_dir, CONVERTER, ARGS.jobs,
+                       ARGS.timeout or None, ARGS.memory * 2**20 or None,
+                       ARGS.quarantine, RETRY,
+                       None if REWRITE else ARGS.catalog, PRIORITY,
+                       ARGS.links if ARGS.static_rank else None)
+    if FAILURES:
+        print('Skipped {0} files, listed in {1}. To retry them, use'
+              ' --retry {1}'.format(len(FAILURES), ARGS.quarantine),
+              file=sys.stderr)
+
+    if ARGS.dedupe:
+        dedupe.dedupe(ARGS.out_dir, ARGS.dedupe_threshold, ARGS.dedupe_drop,
+                      serializer=ARGS.serializer)
+    if ARGS.static_rank:
+        staticrank.static_rank(ARGS.links, ARGS.jobs,
+                               serializer=ARGS.serializer)
+    if REWRITE and ARGS.catalog:
+        catalog.scan(ARGS.out_dir, ARGS.catalog)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Load-test Solr with the requests the search page sends.
+
+Replays the request shapes of webapps/solr-search.js:
+    facet      the *:* facet query sent when the page loads
+    search     q with cursorMark=* and facet=false, as on SUBMIT
+    filtered   the same plus fq=product:, release:, booktitle:, as on
+               FILTER
+    paginate   a search followed by NEXT, following nextCursorMark
+
+Query words come from a file of recorded queries, one per line, or are
+drawn from the ptext and title fields of a jsonify.py output, weighted
+by frequency. Filter values are combinations that exist in that output,
+or values from the facet query.
+
+Runs --concurrency clients for --duration seconds, or until --requests
+requests, against Solr or a stand-in such as
+    python3 sqlitesearch.py --serve 8985 corehw.db
+and reports p50/p95/p99 latency, throughput, and error rate for each
+shape.
+
+For usage, run:
+    python3 loadgen.py --help
+
+Typical use:
+    $ python3 loadgen.py --corpus docs.hortonworks.com-json -c 16 -d 60
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import collections
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import catalog
+import searchbundles
+import solrproxy
+
+SHAPES = ('facet', 'search', 'filtered', 'paginate')
+
+# Relative frequency of each shape unless --mix is given
+DEFAULT_MIX = 'facet:1,search:4,filtered:3,paginate:2'
+
+# Most frequent corpus terms that queries are drawn from
+TERM_POOL = 500
+
+
+def parse_mix(mix: str) -> dict:
+    """Parse shape:weight pairs such as 'search:4,facet:1'."""
+    assert isinstance(mix, str), (
+        'mix is not a string: %r' % mix)
+    weights = {}
+    for pair in mix.split(','):
+        shape, _, weight = pair.partition(':')
+        if shape.strip() not in SHAPES:
+            raise ValueError('Unknown query shape: ' + shape)
+        weights[shape.strip()] = float(weight or 1)
+    return weights
+
+
+def read_corpus(src: str, sample: int=5000, seed: int=None) -> tuple:
+    """Return query terms with weights, and the product, release, and
+    booktitle combinations of a sample of documents.
+
+    Args:
+        src  A jsonify.py output directory or its catalog.
+        sample  Maximum number of documents read.
+        seed  Seed for choosing the sample.
+    """
+    assert isinstance(src, str), (
+        'src is not a string: %r' % src)
+    if catalog.is_catalog(src):
+        doc_catalog = catalog.Catalog(src)
+        paths = [os.path.join(doc_catalog.root, row['path'])
+                 for row in doc_catalog.documents()]
+        doc_catalog.close()
+    else:
+        paths = [os.path.join(dirpath, filename)
+                 for dirpath, _, filenames in os.walk(src)
+                 for filename in filenames if filename.endswith('.json')]
+    paths.sort()
+    if len(paths) > sample:
+        paths = random.Random(seed).sample(paths, sample)
+
+    counts = collections.Counter()
+    combos = set()
+    for path in paths:
+        with open(path, encoding='UTF-8') as file_h:
+            meta = json.load(file_h)
+        counts.update(searchbundles.tokenize(
+            meta.get('title', '') + ' ' + meta.get('ptext', '')))
+        combo = tuple(meta.get(field, '') for field in
+                      ('product', 'release', 'booktitle'))
+        if any(combo):  # An all-empty combination has nothing to filter
+            combos.add(combo)
+    terms = [(term, count) for term, count in counts.most_common(TERM_POOL)
+             if not term.isdigit()]
+    return terms, sorted(combos)
+
+
+def read_queries(queries_file: str) -> list:
+    """Read recorded queries, one per line, as equally weighted terms."""
+    with open(queries_file, encoding='UTF-8') as file_h:
+        return [(line.strip(), 1) for line in file_h if line.strip()]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return float('nan')
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class LoadGenerator(object):
+    """Clients sending the search page's requests to one Solr core.
+
+    Args:
+        solr_url  Core URL, such as http://localhost:8983/solr/corehw
+        terms  (query, weight) pairs; recorded queries are used whole,
+               corpus terms are combined one to three at a time.
+        combos  (product, release, booktitle) tuples for filters.
+        mix  Shape weights, from parse_mix().
+        pages  Pages requested by each paginate session.
+        recorded  True if terms are whole recorded queries.
+        timeout  Seconds to wait for a response.
+        seed  Seed for the clients' random choices.
+    """
+
+    def __init__(self, solr_url: str, terms: list, combos: list, mix: dict,
+                 pages: int=3, recorded: bool=False, timeout: float=10.0,
+                 seed: int=None) -> None:
+        assert isinstance(solr_url, str), (
+            'solr_url is not a string: %r' % solr_url)
+        parts = urllib.parse.urlsplit(solr_url)
+        self.query_path = parts.path.rstrip('/') + '/query'
+        # Each client holds at most one connection, so the pool bound
+        # only needs to exceed any sensible --concurrency
+        self.pool = solrproxy.ConnectionPool(parts.hostname, parts.port or 80,
+                                             1024, timeout)
+        self.terms = [term for term, _ in terms]
+        self.term_weights = [weight for _, weight in terms]
+        self.combos = combos
+        self.shapes = list(mix)
+        self.shape_weights = [mix[shape] for shape in self.shapes]
+        self.pages = pages
+        self.recorded = recorded
+        self.seed = seed
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._deadline = None
+
+    def _request(self, shape: str, params: list) -> dict:
+        """Send one request and record its latency or error.
+
+        Returns:
+            The parsed response, or None on error.
+        """
+        path = self.query_path
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        start = time.perf_counter()
+        try:
+            status, _, body = self.pool.get(path)
+            data = json.loads(body.decode('UTF-8')) if status == 200 else None
+        except (http.client.HTTPException, OSError, ValueError) as error:
+            logging.warning('%s %s: %s', shape, path, error)
+            status, data = None, None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if data is None:
+                self.errors[shape] += 1
+                if status is not None:
+                    logging.warning('%s %s: HTTP %s', shape, path, status)
+            else:
+                self.latencies[shape].append(elapsed)
+        return data
+
+    def _query(self, rng: random.Random) -> str:
+        if self.recorded:
+            return rng.choices(self.terms, self.term_weights)[0]
+        return ' '.join(rng.choices(self.terms, self.term_weights,
+                                    k=rng.randint(1, 3)))
+
+    def _filters(self, rng: random.Random) -> list:
+        """Return one to three fq parameters from one combination, in
+        the product, release, booktitle order the page uses.
+        """
+        combo = rng.choice(self.combos)
+        fields = [(name, value) for name, value in
+                  zip(('product', 'release', 'booktitle'), combo) if value]
+        chosen = sorted(rng.sample(range(len(fields)),
+                                   rng.randint(1, len(fields))))
+        return [('fq', '{0}:{1}'.format(*fields[i])) for i in chosen]
+
+    def _session(self, shape: str, rng: random.Random) -> int:
+        """Run one instance of a shape; return the requests it sent."""
+        if shape == 'facet':
+            self._request(shape, [])
+            return 1
+        params = [('q', self._query(rng)), ('cursorMark', '*'),
+                  ('facet', 'false')]
+        if shape == 'filtered' and self.combos:
+            params += self._filters(rng)
+        if shape != 'paginate':
+            self._request(shape, params)
+            return 1
+        sent = 0
+        cursor = '*'
+        for _ in range(self.pages):
+            params[1] = ('cursorMark', cursor)
+            data = self._request(shape, params)
+            sent += 1
+            if data is None or data.get('nextCursorMark') in (None, cursor):
+                break
+            cursor = data['nextCursorMark']
+        return sent
+
+    def _client(self, number: int) -> None:
+        rng = random.Random(None if self.seed is None else self.seed + number)
+        while time.monotonic() < self._deadline:
+            shape = rng.choices(self.shapes, self.shape_weights)[0]
+            with self._lock:
+                if self._remaining is not None:
+                    if self._remaining <= 0:
+                        return
+                    self._remaining -= 1
+            self._session(shape, rng)
+
+    def run(self, concurrency: int=8, duration: float=30.0,
+            requests: int=None) -> float:
+        """Run the clients; return the elapsed seconds.
+
+        Args:
+            concurrency  Number of clients sending requests at once.
+            duration  Seconds to run.
+            requests  Stop after this many sessions instead, if given.
+        """
+        self._remaining = requests
+        self._deadline = time.monotonic() + duration
+        start = time.perf_counter()
+        clients = [threading.Thread(target=self._client, args=(number,),
+                                    daemon=True)
+                   for number in range(concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> dict:
+        """Return latency percentiles in milliseconds, throughput, and
+        error rate by shape, plus totals under 'all'.
+        """
+        result = {}
+        everything = []
+        for shape in self.shapes + ['all']:
+            if shape == 'all':
+                latencies = sorted(everything)
+                errors = sum(self.errors.values())
+            else:
+                latencies = sorted(self.latencies[shape])
+                everything.extend(latencies)
+                errors = self.errors[shape]
+            sent = len(latencies) + errors
+            result[shape] = {
+                'requests': sent, 'errors': errors,
+                'error_rate': errors / sent if sent else 0.0,
+                'throughput': sent / elapsed if elapsed else 0.0,
+                'p50': percentile(latencies, 0.50) * 1000,
+                'p95': percentile(latencies, 0.95) * 1000,
+                'p99': percentile(latencies, 0.99) * 1000}
+        return result
+
+
+def facet_combos(generator: LoadGenerator) -> list:
+    """Return filter values from the facet query, one field at a time,
+    for runs without a corpus.
+    """
+    data = generator._request('facet', [])
+    combos = []
+    if data is None:
+        return combos
+    fields = data.get('facet_counts', {}).get('facet_fields', {})
+    for position, name in enumerate(('product', 'release', 'booktitle')):
+        for value in fields.get(name, [])[::2]:
+            if not value:
+                continue
+            combo = ['', '', '']
+            combo[position] = value
+            combos.append(tuple(combo))
+    return combos
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-s', '--solr',
+                           default='http://localhost:8983/solr/corehw',
+                           help='Solr core URL, defaults to'
+                           ' http://localhost:8983/solr/corehw')
+    ARGPARSER.add_argument('--corpus',
+                           help='jsonify.py output or catalog to draw query'
+                           ' words and filter values from')
+    ARGPARSER.add_argument('--queries',
+                           help='file of recorded queries, one per line')
+    ARGPARSER.add_argument('-m', '--mix', default=DEFAULT_MIX,
+                           help='relative frequency of query shapes,'
+                           ' defaults to ' + DEFAULT_MIX)
+    ARGPARSER.add_argument('-c', '--concurrency', type=int, default=8,
+                           help='clients sending requests at once,'
+                           ' defaults to 8')
+    ARGPARSER.add_argument('-d', '--duration', type=float, default=30,
+                           help='seconds to run, defaults to 30')
+    ARGPARSER.add_argument('-n', '--requests', type=int,
+                           help='stop after this many sessions')
+    ARGPARSER.add_argument('-p', '--pages', type=int, default=3,
+                           help='pages per paginate session, defaults to 3')
+    ARGPARSER.add_argument('--timeout', type=float, default=10,
+                           help='seconds to wait for a response')
+    ARGPARSER.add_argument('--seed', type=int,
+                           help='seed for repeatable runs')
+    ARGPARSER.add_argument('--json',
+                           help='file where the report will be written as'
+                           ' JSON')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    if not (ARGS.corpus or ARGS.queries):
+        ARGPARSER.error('give --corpus, --queries, or both')
+    TERMS, COMBOS = [], []
+    if ARGS.corpus:
+        TERMS, COMBOS = read_corpus(ARGS.corpus, seed=ARGS.seed)
+    if ARGS.queries:
+        TERMS = read_queries(ARGS.queries)
+    GENERATOR = LoadGenerator(ARGS.solr, TERMS, COMBOS, parse_mix(ARGS.mix),
+                              ARGS.pages, bool(ARGS.queries), ARGS.timeout,
+                              ARGS.seed)
+    if not COMBOS:
+        GENERATOR.combos = facet_combos(GENERATOR)
+        GENERATOR.latencies.clear()
+        GENERATOR.errors.clear()
+
+    ELAPSED = GENERATOR.run(ARGS.concurrency, ARGS.duration, ARGS.requests)
+    REPORT = GENERATOR.report(ELAPSED)
+    print('{0:<10} {1:>8} {2:>7} {3:>8} {4:>9} {5:>9} {6:>9}'.format(
+        'shape', 'requests', 'error %', 'req/s', 'p50 ms', 'p95 ms',
+        'p99 ms'))
+    for SHAPE, ROW in REPORT.items():
+        print('{0:<10} {requests:>8} {error_rate:>7.1%} {throughput:>8.1f}'
+              ' {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}'.format(SHAPE, **ROW))
+    if ARGS.json:
+        with open(ARGS.json, mode='w', encoding='UTF-8') as REPORT_FH:
+            json.dump(REPORT, REPORT_FH, indent=1)
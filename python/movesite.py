@@ -1,27 +1,363 @@
 #!/usr/bin/env python3
-'''
-'''
+"""Write redirect pages and server redirect maps for moved documents.
 
+With no options, prints one meta-refresh page that redirects to the URL
+given on the command line.
+
+In bulk mode, reads a mapping of old URL paths to new URL paths and
+writes a redirect page at each old path under --out, in parallel. The
+mapping is a CSV file (old,new per row), a YAML file (old: new), or is
+derived from two jsonify.py output trees, or their catalogs, with
+--old-tree and --new-tree. Their URL paths are relative to the
+directory jsonify.py read, so give its web path with --old-prefix and
+in --base-url:
+    $ python3 movesite.py --old-tree old-json --new-tree new-json \
+        -p /HDPDocuments -b //docs.hortonworks.com/HDPDocuments \
+        -o webroot --nginx moved.conf
+With --nginx or --apache, also writes a map file so the web server can
+answer with a 301 without loading a page and a client-side refresh.
+
+For usage, run:
+    python3 movesite.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+
+To serve the nginx map, include it inside http { } and add to server { }:
+    if ($moved_uri) { return 301 $moved_uri; }
+
+To serve the Apache map (convert large maps with httxt2dbm first):
+    RewriteMap moved "txt:/path/to/moved.txt"
+    RewriteCond ${moved:%{REQUEST_URI}} !^$
+    RewriteRule ^ ${moved:%{REQUEST_URI}} [R=301,L]
+"""
+
+__version__ = '0.0.2'
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import html
+import json
+import logging
+import os
+import re
 import textwrap
+import urllib.parse
+
+import yaml
+
+import catalog
+import releases
+
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    from yaml import Loader
+
+REDIRECT_TEMPLATE = textwrap.dedent('''\
+    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
+      "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+    <html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">
+    <head>
+    <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+    <meta http-equiv="refresh" content="0;URL={url}" />
+    <title>File Moved</title>
+    </head>
+    <body>
+    <h1>File Moved</h1>
+    <p>Moved to <a href="{url}">{url}</a>.</p>
+    </html>''')
+
+
+def redirect_html(new_url: str='//docs.hortonworks.com') -> str:
+    """Return an HTML page that redirects to new_url.
+
+    Args:
+        new_url  The URL of the moved document.
 
-def redirect_html(new_url='//docs.hortonworks.com'):
-    """Set up JSON struct, delegate its creation, then write the JSON file to disk."""
-    assert isinstance(url, str), (
+    Returns:
+        The text of the HTML page.
+    """
+    assert isinstance(new_url, str), (
         'new_url is not a string: %r' % new_url)
+    return REDIRECT_TEMPLATE.format(url=html.escape(new_url, quote=True))
+
+
+def read_mapping(mapping_file: str) -> list:
+    """Read old and new URL paths from a CSV or YAML file.
+
+    CSV files have an old and a new URL on each row; a first row of
+    "old,new" is skipped. YAML files hold a mapping of old to new URLs.
+
+    Args:
+        mapping_file  Path to a .csv, .yaml, or .yml file.
+
+    Returns:
+        A list of (old, new) tuples.
+    """
+    assert isinstance(mapping_file, str), (
+        'mapping_file is not a string: %r' % mapping_file)
+    _, extension = os.path.splitext(mapping_file)
+    with open(mapping_file, encoding='UTF-8', newline='') as file_h:
+        if extension in ('.yaml', '.yml'):
+            mapping = yaml.load(file_h, Loader=Loader) or {}
+            return [(str(old), str(new)) for old, new in mapping.items()]
+        pairs = []
+        for row in csv.reader(file_h):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            if not pairs and row[:2] == ['old', 'new']:
+                continue
+            pairs.append((row[0].strip(), row[1].strip()))
+        return pairs
+
+
+def _load_tree(json_dir: str) -> list:
+    """Return url, title, product, booktitle, and release of each
+    document in a jsonify.py output tree or catalog.
+    """
+    if catalog.is_catalog(json_dir):
+        doc_catalog = catalog.Catalog(json_dir)
+        docs = [{field: row[field] or '' for field in
+                 ('url', 'title', 'product', 'booktitle', 'release')}
+                for row in doc_catalog.documents() if row['url']]
+        doc_catalog.close()
+        return docs
+    docs = []
+    for dirpath, _, filenames in os.walk(json_dir):
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(dirpath, filename),
+                      encoding='UTF-8') as file_h:
+                try:
+                    meta = json.load(file_h)
+                except json.JSONDecodeError:
+                    logging.error('Cannot read ' + filename)
+                    continue
+            if 'url' in meta:
+                docs.append({field: meta.get(field, '') for field in
+                             ('url', 'title', 'product', 'booktitle',
+                              'release')})
+    return docs
+
+
+def _url_basename(url: str) -> str:
+    """Return the last segment of a URL path."""
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def derive_mapping(old_dir: str, new_dir: str) -> list:
+    """Map documents that disappeared between two jsonify.py outputs to
+    the documents that replaced them.
+
+    A replacement has the same file name. Among several, the one with
+    the same title, then booktitle, then product, then the newest
+    release wins. Documents without a replacement are logged.
+
+    Args:
+        old_dir  Output of jsonify.py for the site before the move.
+        new_dir  Output of jsonify.py for the site after the move.
 
-    print(textwrap.dedent('''\
-        <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
-          "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
-        <html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">
-        <head>
-        <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
-        <meta http-equiv="refresh" content="0;URL={url}" />
-        <title>File Moved</title>
-        </head>
-        <body>
-        <h1>File Moved</h1>
-        <p>Moved to <a href="{url}">{url}</a>.</p>
-        </html>'''.format(**locals())))
+    Returns:
+        A list of (old, new) tuples of URL paths.
+    """
+    assert isinstance(old_dir, str), (
+        'old_dir is not a string: %r' % old_dir)
+    assert isinstance(new_dir, str), (
+        'new_dir is not a string: %r' % new_dir)
 
+    new_docs = _load_tree(new_dir)
+    new_urls = {doc['url'] for doc in new_docs}
+    by_name = collections.defaultdict(list)
+    for doc in new_docs:
+        by_name[_url_basename(doc['url'])].append(doc)
+
+    pairs = []
+    for old in _load_tree(old_dir):
+        if old['url'] in new_urls:
+            continue
+        candidates = by_name.get(_url_basename(old['url']))
+        if not candidates:
+            logging.warning('No replacement for ' + old['url'])
+            continue
+        best = max(candidates, key=lambda new: (
+            new['title'] == old['title'],
+            new['booktitle'] == old['booktitle'],
+            new['product'] == old['product'],
+            releases.parse_release(new['release'])))
+        pairs.append((old['url'], best['url']))
+    return pairs
+
+
+def prefix_old(pairs: list, old_prefix: str) -> list:
+    """Put old_prefix before the old URL paths of pairs.
+
+    The url fields of jsonify.py output are relative to its in_dir, so
+    mappings derived from two trees lack the web path of in_dir, such as
+    /HDPDocuments, on the old side. On the new side, it belongs in
+    base_url.
+    """
+    assert isinstance(old_prefix, str), (
+        'old_prefix is not a string: %r' % old_prefix)
+    return [(old_prefix.rstrip('/') + old if old.startswith('/') else old,
+             new) for old, new in pairs]
+
+
+def _write_stub(task: tuple) -> None:
+    """Write one redirect page."""
+    stub_path, new_url = task
+    os.makedirs(os.path.dirname(stub_path), exist_ok=True)
+    with open(stub_path, mode='w', encoding='UTF-8') as file_h:
+        file_h.write(redirect_html(new_url))
+
+
+def write_stubs(pairs: list, dest_dir: str, base_url: str='',
+                jobs: int=8) -> int:
+    """Write a redirect page at each old URL path under dest_dir.
+
+    Args:
+        pairs  A list of (old, new) tuples of URL paths.
+        dest_dir  Directory corresponding to the web root.
+        base_url  Text to put before each new URL path, such as
+                  //docs.hortonworks.com
+        jobs  Number of files written at once.
+
+    Returns:
+        The number of pages written.
+    """
+    assert isinstance(dest_dir, str), (
+        'dest_dir is not a string: %r' % dest_dir)
+    tasks = []
+    for old, new in pairs:
+        old_path = urllib.parse.unquote(urllib.parse.urlsplit(old).path)
+        if old_path.endswith('/'):
+            old_path += 'index.html'
+        stub_path = os.path.join(dest_dir, old_path.lstrip('/'))
+        tasks.append((stub_path, base_url + new if new.startswith('/')
+                      else new))
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        for _ in executor.map(_write_stub, tasks):
+            pass
+    logging.info('Wrote %d redirect pages to %s', len(tasks), dest_dir)
+    return len(tasks)
+
+
+def _map_entries(pairs: list, base_url: str) -> list:
+    """Return (old, new) pairs usable in server map files."""
+    entries = []
+    for old, new in sorted(pairs):
+        if new.startswith('/'):
+            new = base_url + new
+        if re.search(r'[\s;"]', old + new):
+            logging.warning('Not in server maps, needs escaping: ' + old)
+            continue
+        entries.append((old, new))
+    return entries
+
+
+def _nginx_string(text: str) -> str:
+    """Return text as an nginx configuration string, quoted if needed."""
+    if not re.search(r'[\s;"\'{}#\\]', text):
+        return text
+    return '"{0}"'.format(text.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def write_nginx_map(pairs: list, map_file: str, base_url: str='') -> None:
+    """Write an nginx map from $uri to $moved_uri.
+
+    nginx decodes $uri, so old URL paths are written decoded, without
+    any query string or fragment.
+    """
+    assert isinstance(map_file, str), (
+        'map_file is not a string: %r' % map_file)
+    with open(map_file, mode='w', encoding='UTF-8') as file_h:
+        file_h.write('# Written by movesite.py; see its docstring.\n')
+        file_h.write('map $uri $moved_uri {\n')
+        for old, new in sorted(pairs):
+            if new.startswith('/'):
+                new = base_url + new
+            old = urllib.parse.unquote(urllib.parse.urlsplit(old).path)
+            file_h.write('    {0} {1};\n'.format(_nginx_string(old),
+                                                 _nginx_string(new)))
+        file_h.write('}\n')
+
+
+def write_apache_map(pairs: list, map_file: str, base_url: str='') -> None:
+    """Write an Apache RewriteMap text file."""
+    assert isinstance(map_file, str), (
+        'map_file is not a string: %r' % map_file)
+    with open(map_file, mode='w', encoding='UTF-8') as file_h:
+        file_h.write('# Written by movesite.py; see its docstring.\n')
+        for old, new in _map_entries(pairs, base_url):
+            file_h.write('{0} {1}\n'.format(old, new))
+
+
+# Command-line interface
 if __name__ == '__main__':
-    redirect_html()
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-m', '--mapping',
+                           help='CSV or YAML file mapping old URL paths to'
+                           ' new URL paths')
+    ARGPARSER.add_argument('--old-tree',
+                           help='jsonify.py output before the move')
+    ARGPARSER.add_argument('--new-tree',
+                           help='jsonify.py output after the move')
+    ARGPARSER.add_argument('-o', '--out',
+                           help='directory, corresponding to the web root,'
+                           ' where redirect pages will be written')
+    ARGPARSER.add_argument('--nginx',
+                           help='file where an nginx map will be written')
+    ARGPARSER.add_argument('--apache',
+                           help='file where an Apache RewriteMap will be'
+                           ' written')
+    ARGPARSER.add_argument('-b', '--base-url', default='',
+                           help='text to put before new URL paths, such as'
+                           ' //docs.hortonworks.com/HDPDocuments')
+    ARGPARSER.add_argument('-p', '--old-prefix', default='',
+                           help='web path to put before old URL paths, such'
+                           ' as /HDPDocuments for jsonify.py output of'
+                           ' that directory')
+    ARGPARSER.add_argument('-j', '--jobs', type=int, default=8,
+                           help='number of pages written at once')
+    ARGPARSER.add_argument('new_url', nargs='?',
+                           default='//docs.hortonworks.com',
+                           help='without a mapping, the URL the printed'
+                           ' page redirects to')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    if ARGS.mapping:
+        PAIRS = read_mapping(ARGS.mapping)
+    elif ARGS.old_tree and ARGS.new_tree:
+        PAIRS = derive_mapping(ARGS.old_tree, ARGS.new_tree)
+    else:
+        print(redirect_html(ARGS.new_url))
+        raise SystemExit
+    if ARGS.old_prefix:
+        PAIRS = prefix_old(PAIRS, ARGS.old_prefix)
+
+    if ARGS.out:
+        write_stubs(PAIRS, ARGS.out, ARGS.base_url, ARGS.jobs)
+    if ARGS.nginx:
+        write_nginx_map(PAIRS, ARGS.nginx, ARGS.base_url)
+    if ARGS.apache:
+        write_apache_map(PAIRS, ARGS.apache, ARGS.base_url)
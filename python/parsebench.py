@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Benchmark HTML parsing and tree walking in jsonify.py.
+
+Reads every HTML file under a directory, then times the stages of
+html_to_json() that depend on the parser: parsing with lxml.html.parse()
+from a file object, as jsonify.py once did, and with parse_html(), which
+reuses a parser and prunes comments, processing instructions, and
+PRUNED_TAGS elements; walking the trees from both with get_text(); and
+the whole conversion with html_to_json(). Also counts the nodes of both
+trees.
+
+For usage, run:
+    python3 parsebench.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import io
+import logging
+import os
+import time
+
+import lxml.etree
+import lxml.html
+
+import jsonify
+
+
+def load_pages(html_dir: str) -> list:
+    """Return (path, bytes) for each HTML file under html_dir."""
+    assert isinstance(html_dir, str), (
+        'html_dir is not a string: %r' % html_dir)
+    pages = []
+    for dirpath, _, filenames in os.walk(html_dir):
+        for filename in sorted(filenames):
+            if filename.endswith(('.html', '.htm')):
+                path = os.path.join(dirpath, filename)
+                with open(path, mode='rb') as file_h:
+                    pages.append((path, file_h.read()))
+    pages.sort()
+    return pages
+
+
+def parse_file_object(data: bytes) -> 'lxml.etree._ElementTree':
+    """Parse HTML bytes the way jsonify.py did before parse_html()."""
+    return lxml.html.parse(io.BytesIO(data))
+
+
+def count_nodes(etree: 'lxml.etree._ElementTree') -> dict:
+    """Return counts of the elements, comments, and PRUNED_TAGS
+    elements in a tree.
+    """
+    counts = {'nodes': 0, 'comments': 0, 'pruned': 0}
+    root = etree.getroot()
+    if root is None:
+        return counts
+    for node in root.iter():
+        counts['nodes'] += 1
+        if node.tag is lxml.etree.Comment:
+            counts['comments'] += 1
+        elif node.tag in jsonify.PRUNED_TAGS:
+            counts['pruned'] += 1
+    return counts
+
+
+def _timed(function, items, repeat: int) -> float:
+    """Return the fastest of repeat runs of function over items."""
+    fastest = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest
+
+
+def benchmark(pages: list, path_prefix: str='', repeat: int=5) -> dict:
+    """Time parsing, walking, and converting pages.
+
+    Args:
+        pages  From load_pages().
+        path_prefix  Text to be removed from the beginning of URLs.
+        repeat  Number of timed runs; the fastest is reported.
+
+    Returns:
+        A dict of results: seconds for each stage, and node counts of
+        the trees from both parsers.
+    """
+    datas = [data for _, data in pages]
+    old_trees = [parse_file_object(data) for data in datas]
+    new_trees = [jsonify.parse_html(data) for data in datas]
+    old_roots = [tree.getroot() for tree in old_trees
+                 if tree.getroot() is not None]
+    new_roots = [tree.getroot() for tree in new_trees
+                 if tree.getroot() is not None]
+
+    result = {
+        'parse_file_object': _timed(parse_file_object, datas, repeat),
+        'parse_html': _timed(jsonify.parse_html, datas, repeat),
+        'get_text_old': _timed(jsonify.get_text, old_roots, repeat),
+        'get_text_new': _timed(jsonify.get_text, new_roots, repeat),
+        'html_to_json': _timed(
+            lambda page: jsonify.html_to_json(page[0], path_prefix,
+                                              data=page[1]),
+            pages, repeat)}
+    for name, trees in (('old', old_trees), ('new', new_trees)):
+        for field in ('nodes', 'comments', 'pruned'):
+            result['{0}_{1}'.format(name, field)] = sum(
+                count_nodes(tree)[field] for tree in trees)
+    return result
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-r', '--repeat', type=int, default=5,
+                           help='timed runs per stage, defaults to 5')
+    ARGPARSER.add_argument('in_dir',
+                           help='directory containing HTML files')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    PAGES = load_pages(ARGS.in_dir)
+    print('{0} pages, {1} bytes'.format(
+        len(PAGES), sum(len(data) for _, data in PAGES)))
+    RESULT = benchmark(PAGES, ARGS.in_dir, ARGS.repeat)
+    for NAME in ('parse_file_object', 'parse_html', 'get_text_old',
+                 'get_text_new', 'html_to_json'):
+        print('{0:<18} {1:>10.1f} ms'.format(NAME, RESULT[NAME] * 1000))
+    for NAME in ('old', 'new'):
+        print('{0} tree: {1} nodes, {2} comments, {3} script/style'.format(
+            NAME, RESULT[NAME + '_nodes'], RESULT[NAME + '_comments'],
+            RESULT[NAME + '_pruned']))
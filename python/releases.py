@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Sort release strings, shared by jsonify.py, which writes the
+release_key and release_tag fields, and facets.py, which orders
+releases by them.
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import re
+
+# Bits for each of the four numbers of a release_key; 60 bits fit a
+# signed 64-bit Solr long
+RELEASE_PART_BITS = 15
+
+
+def parse_release(release: str) -> tuple:
+    """Split a release into a sortable integer and a tag.
+
+    The first four numbers are packed RELEASE_PART_BITS bits each, most
+    significant first, so integer order is release order: 2.1.10.0
+    comes after 2.1.2.0. Anything after the numbers, such as yj in
+    2.3.0.0-yj, is the tag. A tag names a variant of the release, not
+    a pre-release, so the release sorts before its variants.
+
+    Args:
+        release  A string such as "2.3.0.0-yj".
+
+    Returns:
+        A tuple of the release_key int and the release_tag string,
+        which is '' if there is no tag.
+    """
+    assert isinstance(release, str), (
+        'release is not a string: %r' % release)
+    match = re.match(r'(\d+(?:\.\d+)*)[-_.]?(.*)\Z', release)
+    if not match:
+        return 0, release
+    numbers = [int(number) for number in match.group(1).split('.')][:4]
+    numbers += [0] * (4 - len(numbers))
+    key = 0
+    for number in numbers:
+        key = (key << RELEASE_PART_BITS) | min(
+            number, 2 ** RELEASE_PART_BITS - 1)
+    return key, match.group(2)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Recommend Solr field definitions from what jsonify.py actually writes.
+
+Scans a jsonify.py output directory, or the files its catalog lists,
+and collects for every field: fill rate, whether any document has
+several values, cardinality, and value lengths. Reads managed-schema
+for the current definitions and solrconfig.xml for the fields searched,
+faceted, highlighted, sorted, boosted, and returned.
+
+Prints a report and writes a schema fragment that:
+  - makes facet fields single-valued string fields with docValues,
+  - analyzes searched fields such as ptext like text,
+  - reads fields in boost functions, such as static_rank, from
+    docValues without indexing them,
+  - keeps display-only fields stored but not indexed, and
+  - neither indexes nor stores fields nothing queries or returns.
+
+Size estimates use a simple model: stored values compress to half, a
+posting costs about 1.5 bytes, an analyzed token is about 6 characters,
+and docValues take the value dictionary plus one ordinal per value. They
+are for comparing definitions, not for capacity planning.
+
+For usage, run:
+    python3 schemaadvisor.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree
+
+import catalog
+
+# Fields used outside solrconfig.xml defaults: filter queries from
+# solr-search.js, collapsing on dup_group, release ranges and sorting
+# on release_key, and block joins
+FILTERED_FIELDS = ('id', 'product', 'release', 'booktitle', 'canonical',
+                   'dup_group', 'release_key', 'release_tag', 'parent_id',
+                   '_root_')
+
+# Request parameters that name fields, and the role of those fields
+PARAMETER_ROLES = {'qf': 'search', 'pf': 'search', 'hl.fl': 'highlight',
+                   'facet.field': 'facet', 'fl': 'return', 'sort': 'sort',
+                   'bf': 'function', 'boost': 'function'}
+
+# Field names in a function query: identifiers not followed by "("
+FUNCTION_FIELD_REGEX = re.compile(r'\b([A-Za-z_][\w.]*)\b(?!\s*\()')
+
+# Fields Solr maintains itself
+INTERNAL_FIELDS = ('_root_', '_text_', '_version_')
+
+# Distinct values tracked per field before cardinality is reported as a
+# lower bound
+MAX_TRACKED_VALUES = 100000
+
+# Parameters of the size model, see the module docstring
+STORED_RATIO = 0.5
+POSTING_BYTES = 1.5
+CHARS_PER_TOKEN = 6
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+WEBAPPS_DIR = os.path.join(os.path.dirname(SCRIPT_DIR), 'webapps')
+
+
+class FieldStats(object):
+    """Observed values of one field."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.docs = 0
+        self.values = 0
+        self.multi = 0
+        self.chars = 0
+        self.max_chars = 0
+        self.kinds = set()
+        self.distinct = set()
+        self.saturated = False
+
+    def add(self, value) -> None:
+        """Record the value of this field in one document."""
+        values = value if isinstance(value, list) else [value]
+        self.docs += 1
+        self.values += len(values)
+        if len(values) > 1:
+            self.multi += 1
+        for item in values:
+            self.kinds.add(type(item).__name__)
+            text = item if isinstance(item, str) else json.dumps(item)
+            self.chars += len(text)
+            self.max_chars = max(self.max_chars, len(text))
+            if not self.saturated:
+                self.distinct.add(text)
+                if len(self.distinct) >= MAX_TRACKED_VALUES:
+                    self.saturated = True
+
+    @property
+    def cardinality(self) -> int:
+        return len(self.distinct)
+
+
+def _iter_paths(src: str):
+    """Yield the JSON files of an output directory or catalog."""
+    if catalog.is_catalog(src):
+        doc_catalog = catalog.Catalog(src)
+        root = doc_catalog.root
+        for row in doc_catalog.documents():
+            yield os.path.join(root, row['path'])
+        doc_catalog.close()
+        return
+    for dirpath, _, filenames in os.walk(src):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                yield os.path.join(dirpath, filename)
+
+
+def collect_stats(src: str) -> tuple:
+    """Profile the fields of every document, child documents included.
+
+    Args:
+        src  A jsonify.py output directory or its catalog.
+
+    Returns:
+        The number of documents and a dict of FieldStats by name.
+    """
+    assert isinstance(src, str), (
+        'src is not a string: %r' % src)
+    stats = {}
+    count = 0
+    for path in _iter_paths(src):
+        with open(path, encoding='UTF-8') as file_h:
+            docs = [json.load(file_h)]
+        docs.extend(docs[0].pop('_childDocuments_', []))
+        for doc in docs:
+            count += 1
+            for name, value in doc.items():
+                stats.setdefault(name, FieldStats(name)).add(value)
+    return count, stats
+
+
+def read_schema(schema_file: str) -> dict:
+    """Return the attributes of each field in a Solr schema, with the
+    defaults of its field type filled in.
+    """
+    assert isinstance(schema_file, str), (
+        'schema_file is not a string: %r' % schema_file)
+    root = xml.etree.ElementTree.parse(schema_file).getroot()
+    types = {element.get('name'): element.attrib
+             for element in root.iter('fieldType')}
+    fields = {}
+    for element in root.iter('field'):
+        field_type = types.get(element.get('type'), {})
+        attrs = {'indexed': 'true', 'stored': 'true', 'docValues': 'false',
+                 'multiValued': 'false'}
+        attrs.update({key: value for key, value in field_type.items()
+                      if key in attrs})
+        attrs.update(element.attrib)
+        attrs['class'] = field_type.get('class', '')
+        fields[element.get('name')] = attrs
+    return fields
+
+
+def read_roles(solrconfig_file: str) -> dict:
+    """Return the set of roles, such as search or facet, that request
+    handler defaults in solrconfig.xml give each field.
+    """
+    assert isinstance(solrconfig_file, str), (
+        'solrconfig_file is not a string: %r' % solrconfig_file)
+    root = xml.etree.ElementTree.parse(solrconfig_file).getroot()
+    roles = {}
+    for element in root.iter('str'):
+        role = PARAMETER_ROLES.get(element.get('name'))
+        if role is None or not element.text:
+            continue
+        if role == 'function':
+            tokens = FUNCTION_FIELD_REGEX.findall(element.text)
+        else:
+            tokens = re.split(r'[\s,]+', element.text)
+        for token in tokens:
+            name = re.sub(r'\^.*$', '', token)
+            if name and name not in ('score', 'asc', 'desc', '*', 'NOW'):
+                roles.setdefault(name, set()).add(role)
+    for name in FILTERED_FIELDS:
+        roles.setdefault(name, set()).add('filter')
+    return roles
+
+
+def recommend(name: str, stats: FieldStats, roles: set,
+              current: dict) -> dict:
+    """Return recommended field attributes and the reason for them."""
+    multi = stats is not None and stats.multi > 0
+    if name == 'id' or name in INTERNAL_FIELDS:
+        return dict(current, reason='required by Solr')
+    if roles & {'search', 'highlight'}:
+        return {'type': 'text_en_splitting', 'indexed': 'true',
+                'stored': 'true' if roles & {'highlight', 'return'}
+                          else 'false',
+                'docValues': 'false', 'multiValued': str(multi).lower(),
+                'reason': 'searched, so analyzed like text'}
+    if roles & {'facet', 'sort', 'filter'}:
+        if current.get('class') in ('solr.StrField', ''):
+            field_type = 'strings' if multi else 'string'
+        else:
+            field_type = current['type']
+        return {'type': field_type, 'indexed': 'true',
+                'stored': 'true' if 'return' in roles else 'false',
+                'docValues': 'true', 'multiValued': str(multi).lower(),
+                'reason': 'faceted, filtered, or sorted'
+                          + ('' if multi else '; single-valued')}
+    if 'function' in roles:
+        return {'type': current.get('type', 'float'), 'indexed': 'false',
+                'stored': 'true' if 'return' in roles else 'false',
+                'docValues': 'true', 'multiValued': 'false',
+                'reason': 'read by a boost function from docValues'}
+    if 'return' in roles:
+        return {'type': 'strings' if multi else 'string',
+                'indexed': 'false', 'stored': 'true', 'docValues': 'false',
+                'multiValued': str(multi).lower(),
+                'reason': 'only returned in results'}
+    return {'type': current.get('type', 'strings'), 'indexed': 'false',
+            'stored': 'false', 'docValues': 'false',
+            'multiValued': str(multi).lower(),
+            'reason': 'not queried or returned'}
+
+
+def estimate_bytes(stats: FieldStats, attrs: dict, analyzed: bool) -> int:
+    """Estimate the index size of a field with the given attributes."""
+    if stats is None:
+        return 0
+    size = 0
+    if attrs.get('stored') == 'true':
+        size += stats.chars * STORED_RATIO
+    if attrs.get('indexed') == 'true':
+        if analyzed:
+            size += stats.chars / CHARS_PER_TOKEN * POSTING_BYTES + stats.docs
+        else:
+            size += stats.chars / max(stats.values, 1) * stats.cardinality
+            size += stats.values * POSTING_BYTES
+    if attrs.get('docValues') == 'true' and not analyzed:
+        bits = max(1, math.ceil(math.log2(max(stats.cardinality, 2))))
+        size += stats.chars / max(stats.values, 1) * stats.cardinality
+        size += stats.values * bits / 8
+        if attrs.get('multiValued') == 'true':
+            size += stats.docs  # Per-document start addresses
+    return int(size)
+
+
+def _is_analyzed(attrs: dict) -> bool:
+    return (attrs.get('class') == 'solr.TextField' or
+            attrs.get('type', '').startswith('text'))
+
+
+def advise(src: str, schema_file: str, solrconfig_file: str) -> tuple:
+    """Compare observed fields with the schema.
+
+    Returns:
+        The number of documents and a list of dicts, one per field, with
+        name, stats, roles, current and recommended attributes, and
+        current and recommended size estimates in bytes.
+    """
+    count, stats = collect_stats(src)
+    schema = read_schema(schema_file)
+    roles = read_roles(solrconfig_file)
+    advice = []
+    for name in sorted(set(stats) | (set(schema) - set(INTERNAL_FIELDS))):
+        current = schema.get(name, {})
+        field_roles = roles.get(name, set())
+        recommended = recommend(name, stats.get(name), field_roles, current)
+        advice.append({
+            'name': name, 'stats': stats.get(name), 'roles': field_roles,
+            'current': current, 'recommended': recommended,
+            'current_bytes': estimate_bytes(stats.get(name), current,
+                                            _is_analyzed(current)),
+            'recommended_bytes': estimate_bytes(
+                stats.get(name), recommended, _is_analyzed(recommended))})
+    return count, advice
+
+
+def schema_fragment(advice: list) -> str:
+    """Return <field> elements for fields whose definition changes."""
+    lines = ['<!-- Written by schemaadvisor.py -->']
+    for item in advice:
+        recommended = item['recommended']
+        current = item['current']
+        keys = ('type', 'indexed', 'stored', 'docValues', 'multiValued')
+        if item['stats'] is None or all(
+                current.get(key) == recommended.get(key) for key in keys):
+            continue
+        attrs = ' '.join('{0}="{1}"'.format(key, recommended[key])
+                         for key in keys)
+        lines.append('<!-- {0} -->'.format(recommended['reason']))
+        lines.append('<field name="{0}" {1}/>'.format(item['name'], attrs))
+    return '\n'.join(lines) + '\n'
+
+
+def print_report(count: int, advice: list) -> None:
+    """Print field statistics and the size estimate."""
+    print('{0} documents'.format(count))
+    print('{0:<24} {1:>6} {2:>5} {3:>8} {4:>7} {5:<18} {6:>10} {7:>10}'
+          .format('field', 'fill', 'multi', 'distinct', 'avglen', 'roles',
+                  'now KB', 'then KB'))
+    for item in advice:
+        stats = item['stats']
+        if stats is None:
+            print('{0:<24} not in this output'.format(
+                item['name']))
+            continue
+        print('{0:<24} {1:>5.0%} {2:>5} {3:>7}{4} {5:>7.0f} {6:<18}'
+              ' {7:>10.1f} {8:>10.1f}'.format(
+                  item['name'], stats.docs / count, stats.multi,
+                  stats.cardinality, '+' if stats.saturated else ' ',
+                  stats.chars / max(stats.values, 1),
+                  ','.join(sorted(item['roles'])) or '-',
+                  item['current_bytes'] / 1024,
+                  item['recommended_bytes'] / 1024))
+    before = sum(item['current_bytes'] for item in advice)
+    after = sum(item['recommended_bytes'] for item in advice)
+    print('Estimated index size: {0:.1f} KB now, {1:.1f} KB recommended'
+          ' ({2:+.0%})'.format(before / 1024, after / 1024,
+                               (after - before) / max(before, 1)))
+    facets = [item for item in advice if 'facet' in item['roles'] and
+              item['stats'] is not None and not item['stats'].multi and
+              item['current'].get('multiValued') == 'true']
+    if facets:
+        print('Faceting on {0} reads one docValues ordinal per document'
+              ' instead of a per-document ordinal list.'.format(
+                  ', '.join(item['name'] for item in facets)))
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-s', '--schema',
+                           default=os.path.join(WEBAPPS_DIR, 'managed-schema'),
+                           help='the current Solr schema')
+    ARGPARSER.add_argument('-c', '--solrconfig',
+                           default=os.path.join(WEBAPPS_DIR, 'solrconfig.xml'),
+                           help='the Solr configuration with the request'
+                           ' handler defaults')
+    ARGPARSER.add_argument('-o', '--out',
+                           help='file where the schema fragment will be'
+                           ' written, defaults to standard output')
+    ARGPARSER.add_argument('in_dir',
+                           help='directory containing JSON files written by'
+                           ' jsonify.py, or its catalog')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    COUNT, ADVICE = advise(ARGS.in_dir, ARGS.schema, ARGS.solrconfig)
+    print_report(COUNT, ADVICE)
+    if ARGS.out:
+        with open(ARGS.out, mode='w', encoding='UTF-8') as FRAGMENT_FH:
+            FRAGMENT_FH.write(schema_fragment(ADVICE))
+    else:
+        print()
+        print(schema_fragment(ADVICE), end='')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Build client-side search index bundles from jsonify.py output.
+
+Documents are sharded by product, release, and booktitle. Each shard is
+written as a compact JSON inverted index that shard-search.js fetches
+lazily and queries in the browser, so searches scoped to one book or
+one release need no round trip to Solr. A shard larger than --max-bytes
+is split into parts by document.
+
+Terms are lowercase \\w+ words, the same tokens shard-search.js makes
+from a query. Each posting holds a weighted term frequency: matches in
+title and ptext count twice as much as matches in text, following the
+/query handler in solrconfig.xml.
+
+A shard file looks like:
+    {"version": 1,
+     "docs": [[url, title, summary], ...],
+     "terms": {"kerberos": [doc, tf, doc, tf, ...], ...}}
+
+File names are content hashes, so unchanged shards keep their names
+between runs and can be cached forever. shards.json, the manifest,
+lists the files of each product/release/booktitle and should be
+revalidated.
+
+For usage, run:
+    python3 searchbundles.py --help
+
+Typical use, writing the bundles next to index3.html:
+    $ python3 searchbundles.py docs.hortonworks.com-json webapps/shards
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import time
+
+import catalog
+
+# Bump when the layout of shard files or the manifest changes
+BUNDLE_VERSION = 1
+
+# Weight of a match in each field
+FIELD_WEIGHTS = (('title', 2), ('ptext', 2), ('text', 1))
+
+# Largest weighted term frequency stored in a posting
+MAX_TF = 255
+
+# Words of text indexed per document; bounds shard size for long pages
+MAX_TEXT_WORDS = 5000
+
+TOKEN_REGEX = re.compile(r'\w+')
+
+STOPWORDS = frozenset('''a an and are as at be by for from has have how in
+is it its of on or that the this to was were will with you your'''.split())
+
+SHARD_FIELDS = ('product', 'release', 'booktitle')
+
+
+def tokenize(text: str) -> list:
+    """Return the index terms of text, in order."""
+    assert isinstance(text, str), (
+        'text is not a string: %r' % text)
+    return [token for token in TOKEN_REGEX.findall(text.lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+def get_term_weights(meta: dict) -> collections.Counter:
+    """Return the weighted term frequencies of a document."""
+    weights = collections.Counter()
+    for field, weight in FIELD_WEIGHTS:
+        text = meta.get(field, '')
+        if field == 'text':
+            # With jsonify.py --passages, the text of a page is split
+            # over its passage documents
+            text = ' '.join([text] + [child.get('text', '') for child in
+                                      meta.get('_childDocuments_', [])])
+        tokens = tokenize(text)
+        if field == 'text':
+            tokens = tokens[:MAX_TEXT_WORDS]
+        for token in tokens:
+            weights[token] += weight
+    return weights
+
+
+def _key_task(task: tuple) -> tuple:
+    """Read one JSON file and return its shard key and path."""
+    json_path = task
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    return tuple(meta.get(field, '') for field in SHARD_FIELDS), json_path
+
+
+def group_documents(src: str, jobs: int=None) -> dict:
+    """Return the paths of the JSON files of each shard.
+
+    Args:
+        src  A jsonify.py output directory or its catalog.
+        jobs  Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        A dict of sorted path lists keyed by (product, release,
+        booktitle).
+    """
+    assert isinstance(src, str), (
+        'src is not a string: %r' % src)
+    groups = collections.defaultdict(list)
+    if catalog.is_catalog(src):
+        doc_catalog = catalog.Catalog(src)
+        root = doc_catalog.root
+        for row in doc_catalog.documents():
+            key = tuple(row[field] or '' for field in SHARD_FIELDS)
+            groups[key].append(os.path.join(root, row['path']))
+        doc_catalog.close()
+    else:
+        paths = []
+        for dirpath, _, filenames in os.walk(src):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    paths.append(os.path.join(dirpath, filename))
+        with multiprocessing.Pool(jobs) as pool:
+            for key, path in pool.imap_unordered(_key_task, paths,
+                                                 chunksize=64):
+                groups[key].append(path)
+    return {key: sorted(paths) for key, paths in groups.items()}
+
+
+def make_shard(docs: list) -> dict:
+    """Build one shard from (url, title, summary, term weights) tuples."""
+    postings = collections.defaultdict(list)
+    for position, (_, _, _, weights) in enumerate(docs):
+        for term, weight in weights.items():
+            postings[term].extend((position, min(weight, MAX_TF)))
+    return {'version': BUNDLE_VERSION,
+            'docs': [[url, title, summary]
+                     for url, title, summary, _ in docs],
+            'terms': {term: postings[term] for term in sorted(postings)}}
+
+
+def _dump(shard: dict) -> str:
+    """Serialize a shard compactly, with stable key order."""
+    return json.dumps(shard, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':'))
+
+
+def _shard_task(task: tuple) -> dict:
+    """Build and write the files of one shard; return its manifest
+    entry.
+    """
+    key, paths, dest_dir, max_bytes = task
+    docs = []
+    for path in paths:
+        with open(path, encoding='UTF-8') as file_h:
+            meta = json.load(file_h)
+        docs.append((meta.get('url', ''), meta.get('title', ''),
+                     meta.get('summary', ''), get_term_weights(meta)))
+
+    # Split into the fewest parts of about equal document count that
+    # fit in max_bytes, or into single documents
+    parts = 1
+    while True:
+        size = math.ceil(len(docs) / parts)
+        contents = [_dump(make_shard(docs[start:start + size]))
+                    for start in range(0, len(docs), size)]
+        biggest = max(len(content.encode('UTF-8')) for content in contents)
+        if biggest <= max_bytes or size == 1:
+            break
+        parts = max(parts + 1, math.ceil(parts * biggest / max_bytes))
+
+    entry = dict(zip(SHARD_FIELDS, key), docs=len(docs), files=[], bytes=0)
+    for content in contents:
+        data = content.encode('UTF-8')
+        filename = hashlib.sha1(data).hexdigest()[:16] + '.json'
+        with open(os.path.join(dest_dir, filename), mode='wb') as file_h:
+            file_h.write(data)
+        entry['files'].append(filename)
+        entry['bytes'] += len(data)
+    return entry
+
+
+def build(src: str, dest_dir: str, max_bytes: int=262144,
+          jobs: int=None) -> dict:
+    """Write shard files and the shards.json manifest to dest_dir.
+
+    Shard files no longer listed in the manifest are removed.
+
+    Args:
+        src  A jsonify.py output directory or its catalog.
+        dest_dir  Directory for shard files and the manifest; created
+                  if needed.
+        max_bytes  Largest size of a shard file before it is split.
+        jobs  Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        The manifest.
+    """
+    assert isinstance(dest_dir, str), (
+        'dest_dir is not a string: %r' % dest_dir)
+    os.makedirs(dest_dir, exist_ok=True)
+    groups = group_documents(src, jobs)
+    tasks = [(key, groups[key], dest_dir, max_bytes)
+             for key in sorted(groups)]
+    with multiprocessing.Pool(jobs) as pool:
+        shards = pool.map(_shard_task, tasks, chunksize=1)
+
+    manifest = {'version': BUNDLE_VERSION, 'shards': shards,
+                'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                           time.gmtime())}
+    with open(os.path.join(dest_dir, 'shards.json'), mode='w',
+              encoding='UTF-8') as file_h:
+        json.dump(manifest, file_h, ensure_ascii=False, sort_keys=True,
+                  separators=(',', ':'))
+
+    current = {filename for shard in shards for filename in shard['files']}
+    for filename in os.listdir(dest_dir):
+        if (filename.endswith('.json') and filename != 'shards.json' and
+                filename not in current):
+            os.remove(os.path.join(dest_dir, filename))
+
+    logging.info('Wrote %d shards in %d files, %d bytes, to %s',
+                 len(shards), len(current),
+                 sum(shard['bytes'] for shard in shards), dest_dir)
+    return manifest
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-m', '--max-bytes', type=int, default=262144,
+                           help='largest shard file before it is split,'
+                           ' defaults to 262144')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes')
+    ARGPARSER.add_argument('in_dir',
+                           help='directory containing JSON files written by'
+                           ' jsonify.py, or its catalog')
+    ARGPARSER.add_argument('out_dir',
+                           help='directory where shard files and'
+                           ' shards.json will be written')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    build(ARGS.in_dir, ARGS.out_dir, ARGS.max_bytes, ARGS.jobs)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Benchmark the jsonify.py serializers on existing output.
+
+Reads every JSON file in a jsonify.py output directory, then, for each
+serializer in serializers.SERIALIZERS, times serializing all documents and
+writing them with serializers.write_json(). Checks that each serializer's
+output parses back to the same values as the original file, and counts
+files that are byte-identical to the original.
+
+For usage, run:
+    python3 serbench.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import serializers
+
+
+def load_documents(json_dir: str) -> list:
+    """Return (path, original bytes, dict) for each JSON file."""
+    assert isinstance(json_dir, str), (
+        'json_dir is not a string: %r' % json_dir)
+    documents = []
+    for dirpath, _, filenames in os.walk(json_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                path = os.path.join(dirpath, filename)
+                with open(path, mode='rb') as file_h:
+                    data = file_h.read()
+                documents.append((path, data, json.loads(data.decode(
+                    'UTF-8'))))
+    return documents
+
+
+def benchmark(documents: list, name: str, repeat: int=5) -> dict:
+    """Time and check one serializer.
+
+    Args:
+        documents  From load_documents().
+        name  A key of serializers.SERIALIZERS.
+        repeat  Number of timed runs; the fastest is reported.
+
+    Returns:
+        A dict of results: serialize and write seconds, output bytes,
+        and counts of equivalent and byte-identical documents.
+    """
+    dumps = serializers.SERIALIZERS[name]
+    serialize = write = float('inf')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _, _, meta in documents:
+                dumps(meta)
+            serialize = min(serialize, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for position, (_, _, meta) in enumerate(documents):
+                serializers.write_json(meta, os.path.join(
+                    tmp_dir, '{0}.json'.format(position)), dumps)
+            write = min(write, time.perf_counter() - start)
+
+    result = {'serializer': name, 'serialize': serialize, 'write': write,
+              'bytes': 0, 'equivalent': 0, 'identical': 0}
+    for _, original, meta in documents:
+        data = dumps(meta)
+        result['bytes'] += len(data)
+        result['equivalent'] += json.loads(data.decode('UTF-8')) == meta
+        result['identical'] += data == original
+    return result
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-r', '--repeat', type=int, default=5,
+                           help='timed runs per serializer, defaults to 5')
+    ARGPARSER.add_argument('in_dir',
+                           help='directory containing JSON files written'
+                           ' by jsonify.py')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    DOCUMENTS = load_documents(ARGS.in_dir)
+    print('{0} documents, {1} bytes'.format(
+        len(DOCUMENTS), sum(len(data) for _, data, _ in DOCUMENTS)))
+    print('{0:<10} {1:>12} {2:>12} {3:>10} {4:>10} {5:>10}'.format(
+        'serializer', 'serialize ms', 'write ms', 'bytes', 'equivalent',
+        'identical'))
+    for NAME in sorted(serializers.SERIALIZERS):
+        RESULT = benchmark(DOCUMENTS, NAME, ARGS.repeat)
+        print('{serializer:<10} {0:>12.1f} {1:>12.1f} {bytes:>10}'
+              ' {equivalent:>10} {identical:>10}'.format(
+                  RESULT['serialize'] * 1000, RESULT['write'] * 1000,
+                  **RESULT))
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""Serve search webapp queries from a cache in front of Solr.
+
+solr-search.js sends every search, filter, and cursorMark page straight
+to Solr, so the same facet and first-page queries are computed again
+and again. This proxy normalizes the query parameters, answers repeated
+queries from an LRU cache with a time-to-live, collapses concurrent
+identical queries into a single Solr request, and keeps a pool of
+persistent connections to Solr.
+
+The cache is cleared when the index generation changes. The indexer
+signals a new generation by writing any new value to the generation
+file, for example:
+    $ date +%s > corehw.generation
+or by sending POST /_invalidate to the proxy. Hit and miss counts are
+served as JSON from /_metrics.
+
+To use, point baseurl and initURL in solr-search.js at the proxy, for
+example http://localhost:8984/solr/corehw/query
+
+For usage, run:
+    python3 solrproxy.py --help
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import collections
+import http.client
+import http.server
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import urllib.parse
+
+# Solr parameters whose true and false values are case-insensitive
+BOOLEAN_PARAMS = ('debugQuery', 'echoHandler', 'facet', 'facet.missing',
+                  'group', 'hl', 'indent', 'omitHeader', 'spellcheck',
+                  'stats', 'terms')
+
+
+def normalize_query(query_string: str) -> str:
+    """Return a canonical form of a Solr query string, used as its
+    cache key.
+
+    Whitespace in values is collapsed, field:value filters are trimmed
+    around the colon, BOOLEAN_PARAMS flags are lowercased, and
+    parameters are sorted, so equivalent queries share one cache entry.
+    Other values keep their case: ptext matches are case-sensitive.
+
+    Args:
+        query_string  The query part of a URL, without the "?".
+
+    Returns:
+        The normalized, URL-encoded query string.
+    """
+    assert isinstance(query_string, str), (
+        'query_string is not a string: %r' % query_string)
+    params = []
+    for name, value in urllib.parse.parse_qsl(query_string,
+                                              keep_blank_values=True):
+        value = ' '.join(value.split())
+        if name == 'fq' and ':' in value:
+            field, _, term = value.partition(':')
+            value = field.strip() + ':' + term.strip()
+        if name in BOOLEAN_PARAMS and value.lower() in ('true', 'false'):
+            value = value.lower()
+        params.append((name, value))
+    params.sort()
+    return urllib.parse.urlencode(params)
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value) -> None:
+        """Cache value under key, evicting least recently used entries."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._data.clear()
+
+
+class ConnectionPool(object):
+    """A bounded pool of persistent HTTP connections to one host."""
+
+    def __init__(self, host: str, port: int, size: int,
+                 timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connection(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port,
+                                              timeout=self.timeout)
+
+    def get(self, path: str) -> tuple:
+        """Send a GET request and return (status, content type, body).
+
+        A request that fails on a reused connection is retried once on
+        a new connection, because Solr may have closed an idle one.
+        """
+        assert isinstance(path, str), (
+            'path is not a string: %r' % path)
+        with self._slots:
+            for attempt in (1, 2):
+                conn = self._connection() if attempt == 1 else (
+                    http.client.HTTPConnection(self.host, self.port,
+                                               timeout=self.timeout))
+                try:
+                    conn.request('GET', path)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    if attempt == 2:
+                        raise
+                    continue
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+                content_type = response.getheader('Content-Type',
+                                                  'application/json')
+                return response.status, content_type, body
+
+
+class _Call(object):
+    """An upstream request that concurrent identical queries wait on."""
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QueryService(object):
+    """Answer Solr queries from cache, coalescing concurrent misses."""
+
+    def __init__(self, pool: ConnectionPool, cache: TTLCache,
+                 solr_path: str, generation_file: str=None) -> None:
+        self.pool = pool
+        self.cache = cache
+        self.solr_path = solr_path
+        self.generation_file = generation_file
+        self.generation = 0
+        self.metrics = collections.Counter()
+        self._generation_mark = None
+        self._generation_checked = 0.0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._check_generation()
+
+    def _count(self, name: str, amount: int=1) -> None:
+        with self._metrics_lock:
+            self.metrics[name] += amount
+
+    def _check_generation(self) -> None:
+        """Invalidate the cache if the generation file changed.
+
+        The file is read at most once a second.
+        """
+        if not self.generation_file:
+            return
+        now = time.monotonic()
+        if now - self._generation_checked < 1.0:
+            return
+        self._generation_checked = now
+        try:
+            with open(self.generation_file, encoding='UTF-8') as file_h:
+                mark = file_h.read().strip()
+        except OSError:
+            mark = None
+        if mark != self._generation_mark:
+            if self._generation_mark is not None:
+                logging.info('Index generation changed to %s', mark)
+                self.invalidate()
+            self._generation_mark = mark
+
+    def invalidate(self) -> None:
+        """Start a new generation and drop all cached responses."""
+        with self._lock:
+            self.generation += 1
+            self.cache.clear()
+        self._count('invalidations')
+
+    def query(self, query_string: str) -> tuple:
+        """Return (status, content type, body, cache state) for a query.
+
+        Only successful responses are cached. A response fetched while
+        the generation changed is returned but not cached. Solr gets
+        the client's query string as sent; the normalized form is only
+        the cache key.
+        """
+        self._check_generation()
+        key = normalize_query(query_string)
+        self._count('requests')
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count('hits')
+            return cached + ('HIT',)
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+            generation = self.generation
+
+        if not leader:
+            self._count('coalesced')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result + ('COALESCED',)
+
+        self._count('misses')
+        start = time.perf_counter()
+        try:
+            call.result = self.pool.get(self.solr_path + '?' + query_string)
+        except Exception as err:  # Followers get the same error
+            self._count('errors')
+            call.error = err
+            raise
+        finally:
+            call.event.set()  # Release followers whatever happened
+            self._count('upstream_ms',
+                        int((time.perf_counter() - start) * 1000))
+            with self._lock:
+                del self._inflight[key]
+                if (call.result is not None and call.result[0] == 200 and
+                        generation == self.generation):
+                    self.cache.put(key, call.result)
+        return call.result + ('MISS',)
+
+    def report(self) -> dict:
+        """Return cache metrics as a dict."""
+        with self._metrics_lock:
+            report = dict(self.metrics)
+        for name in ('requests', 'hits', 'misses', 'coalesced', 'errors',
+                     'invalidations', 'upstream_ms'):
+            report.setdefault(name, 0)
+        lookups = report['hits'] + report['misses'] + report['coalesced']
+        report['hit_ratio'] = (round(report['hits'] / lookups, 4)
+                               if lookups else 0.0)
+        report['size'] = len(self.cache)
+        report['evictions'] = self.cache.evictions
+        report['generation'] = self.generation
+        return report
+
+
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """Route /_metrics, /_invalidate, and Solr query requests."""
+
+    server_version = 'solrproxy/' + __version__
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status: int, content_type: str, body: bytes,
+              cache_state: str=None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if cache_state:
+            self.send_header('X-Cache', cache_state)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data, sort_keys=True).encode('UTF-8')
+        self._send(status, 'application/json', body)
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        path, _, query_string = self.path.partition('?')
+        if path == '/_metrics':
+            self._send_json(200, service.report())
+        elif path == service.solr_path:
+            try:
+                status, content_type, body, state = service.query(
+                    query_string)
+            except (http.client.HTTPException, OSError) as err:
+                logging.error('Solr request failed: %s', err)
+                self._send_json(502, {'error': str(err)})
+                return
+            self._send(status, content_type, body, state)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self) -> None:
+        if self.path.partition('?')[0] == '/_invalidate':
+            self.server.service.invalidate()
+            self._send_json(200, {'generation':
+                                  self.server.service.generation})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug('%s %s', self.address_string(), format % args)
+
+
+class ProxyServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server holding the shared QueryService."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, service: QueryService) -> None:
+        http.server.HTTPServer.__init__(self, address, ProxyHandler)
+        self.service = service
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-s', '--solr',
+                           default='http://localhost:8983/solr/corehw/query',
+                           help='Solr query URL to forward requests to')
+    ARGPARSER.add_argument('-b', '--bind', default='localhost',
+                           help='address to listen on')
+    ARGPARSER.add_argument('-p', '--port', type=int, default=8984,
+                           help='port to listen on, defaults to 8984')
+    ARGPARSER.add_argument('--cache-size', type=int, default=2000,
+                           help='maximum number of cached responses')
+    ARGPARSER.add_argument('--ttl', type=float, default=300.0,
+                           help='seconds a cached response stays valid')
+    ARGPARSER.add_argument('--connections', type=int, default=8,
+                           help='maximum concurrent connections to Solr')
+    ARGPARSER.add_argument('--timeout', type=float, default=30.0,
+                           help='seconds to wait for Solr')
+    ARGPARSER.add_argument('-g', '--generation-file',
+                           help='file whose content changes when a new'
+                           ' index generation is available')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    SOLR = urllib.parse.urlsplit(ARGS.solr)
+    POOL = ConnectionPool(SOLR.hostname, SOLR.port or 80, ARGS.connections,
+                          ARGS.timeout)
+    SERVICE = QueryService(POOL, TTLCache(ARGS.cache_size, ARGS.ttl),
+                           SOLR.path, ARGS.generation_file)
+    SERVER = ProxyServer((ARGS.bind, ARGS.port), SERVICE)
+    logging.info('Proxying %s on port %d', ARGS.solr, ARGS.port)
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        SERVER.server_close()
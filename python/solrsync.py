@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Compute and apply the Solr changes between two jsonify.py outputs.
+
+Compares an old and a new jsonify.py output, or manifests saved from
+them, by document id and content hash. The result is the minimal change
+set: documents to add, documents to update, and ids to delete. The
+change set can be written as JSON, posted to Solr in batches, or
+applied to a local mirror directory that stands in for the index.
+Reindexing then costs time in proportion to what changed, and pages
+removed from the site disappear from search.
+
+Either side can also be a catalog written by jsonify.py --catalog, which
+skips reading the JSON files to hash them.
+
+The content hash ignores the date and x_parsed_by fields, so copying
+the site or upgrading jsonify.py alone does not cause updates.
+
+For usage, run:
+    python3 solrsync.py --help
+
+Typical use, keeping a manifest between runs instead of the old output:
+    $ python3 solrsync.py --solr http://localhost:8983/solr/corehw \\
+        --save-manifest corehw.manifest.jsonl \\
+        corehw.manifest.jsonl docs.hortonworks.com-json
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import urllib.request
+
+import catalog
+
+
+def _manifest_entry(task: tuple) -> dict:
+    """Read one JSON file and return its manifest entry."""
+    json_dir, json_path = task
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    return {'id': meta.get('id', meta.get('url')),
+            'hash': catalog.content_hash(meta),
+            'path': os.path.relpath(json_path, json_dir),
+            'children': len(meta.get('_childDocuments_', []))}
+
+
+def build_manifest(json_dir: str, jobs: int=None) -> dict:
+    """Hash every document in a jsonify.py output tree.
+
+    Args:
+        json_dir  Directory of JSON files.
+        jobs  Number of worker processes, defaults to the CPU count.
+
+    Returns:
+        A dict of manifest entries keyed by document id. Entries hold
+        the hash, the path relative to json_dir, and the number of
+        child documents.
+    """
+    assert isinstance(json_dir, str), (
+        'json_dir is not a string: %r' % json_dir)
+    tasks = []
+    for dirpath, _, filenames in os.walk(json_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                tasks.append((json_dir, os.path.join(dirpath, filename)))
+    manifest = {}
+    with multiprocessing.Pool(jobs) as pool:
+        for entry in pool.imap_unordered(_manifest_entry, tasks,
+                                         chunksize=64):
+            if entry['id'] is None:
+                logging.warning('No id or url in ' + entry['path'])
+                continue
+            manifest[entry['id']] = entry
+    return manifest
+
+
+def read_manifest(manifest_file: str) -> dict:
+    """Read a manifest written by write_manifest()."""
+    assert isinstance(manifest_file, str), (
+        'manifest_file is not a string: %r' % manifest_file)
+    manifest = {}
+    with open(manifest_file, encoding='UTF-8') as file_h:
+        for line in file_h:
+            if line.strip():
+                entry = json.loads(line)
+                manifest[entry['id']] = entry
+    return manifest
+
+
+def write_manifest(manifest: dict, manifest_file: str) -> None:
+    """Write a manifest as JSON lines, sorted by id."""
+    assert isinstance(manifest_file, str), (
+        'manifest_file is not a string: %r' % manifest_file)
+    with open(manifest_file, mode='w', encoding='UTF-8') as file_h:
+        for doc_id in sorted(manifest):
+            file_h.write(json.dumps(manifest[doc_id], ensure_ascii=False,
+                                    sort_keys=True) + '\n')
+
+
+def load_manifest(source: str, jobs: int=None) -> dict:
+    """Return the manifest of a jsonify.py output directory or catalog,
+    or read it from a manifest file.
+    """
+    if os.path.isdir(source):
+        return build_manifest(source, jobs)
+    if catalog.is_catalog(source):
+        doc_catalog = catalog.Catalog(source)
+        manifest = doc_catalog.manifest()
+        doc_catalog.close()
+        return manifest
+    return read_manifest(source)
+
+
+def make_plan(old: dict, new: dict) -> dict:
+    """Compare two manifests.
+
+    Args:
+        old  Manifest of the documents in the index.
+        new  Manifest of the documents that should be in the index.
+
+    Returns:
+        A dict with sorted lists of ids: add (only in new), update (in
+        both, with different hashes), and delete (only in old), plus
+        purge, the deleted or updated ids that had child documents,
+        which Solr only removes by _root_ query.
+    """
+    assert isinstance(old, dict), (
+        'old is not a dict: %r' % old)
+    assert isinstance(new, dict), (
+        'new is not a dict: %r' % new)
+    add = sorted(set(new) - set(old))
+    delete = sorted(set(old) - set(new))
+    update = sorted(doc_id for doc_id in set(old) & set(new)
+                    if old[doc_id]['hash'] != new[doc_id]['hash'])
+    purge = [doc_id for doc_id in sorted(delete + update)
+             if old[doc_id].get('children')]
+    return {'add': add, 'update': update, 'delete': delete, 'purge': purge}
+
+
+def _batches(items: list, size: int):
+    """Yield successive lists of at most size items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _post(update_url: str, body) -> None:
+    """POST a JSON body to a Solr update handler."""
+    request = urllib.request.Request(
+        update_url, data=json.dumps(body, ensure_ascii=False).encode('UTF-8'),
+        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def apply_to_solr(plan: dict, new: dict, json_dir: str, solr_url: str,
+                  batch_size: int=500) -> None:
+    """Send a plan to Solr: purge stale blocks, delete by id, add and
+    update documents in batches, then commit.
+
+    Args:
+        plan  A plan from make_plan().
+        new  Manifest of json_dir.
+        json_dir  The new jsonify.py output directory.
+        solr_url  Core URL, such as http://localhost:8983/solr/corehw
+        batch_size  Number of documents or ids per request.
+    """
+    assert isinstance(solr_url, str), (
+        'solr_url is not a string: %r' % solr_url)
+    update_url = solr_url.rstrip('/') + '/update'
+
+    for batch in _batches(plan['purge'], batch_size):
+        query = '_root_:(' + ' OR '.join(json.dumps(doc_id)
+                                         for doc_id in batch) + ')'
+        _post(update_url, {'delete': {'query': query}})
+    for batch in _batches(plan['delete'], batch_size):
+        _post(update_url, {'delete': batch})
+    for batch in _batches(plan['add'] + plan['update'], batch_size):
+        docs = []
+        for doc_id in batch:
+            json_path = os.path.join(json_dir, new[doc_id]['path'])
+            with open(json_path, encoding='UTF-8') as file_h:
+                docs.append(json.load(file_h))
+        _post(update_url, docs)
+        logging.info('Posted %d documents', len(docs))
+    _post(update_url + '?commit=true', {'commit': {}})
+
+
+def apply_to_mirror(plan: dict, old: dict, new: dict, json_dir: str,
+                    mirror_dir: str) -> None:
+    """Apply a plan to a local copy of the indexed JSON files.
+
+    Args:
+        plan  A plan from make_plan().
+        old  Manifest of mirror_dir.
+        new  Manifest of json_dir.
+        json_dir  The new jsonify.py output directory.
+        mirror_dir  Directory standing in for the index.
+    """
+    assert isinstance(mirror_dir, str), (
+        'mirror_dir is not a string: %r' % mirror_dir)
+    moved = [doc_id for doc_id in plan['update']
+             if old[doc_id]['path'] != new[doc_id]['path']]
+    for doc_id in plan['delete'] + moved:
+        try:
+            os.remove(os.path.join(mirror_dir, old[doc_id]['path']))
+        except FileNotFoundError:
+            logging.warning('Not in mirror: ' + doc_id)
+    for doc_id in plan['add'] + plan['update']:
+        dest_path = os.path.join(mirror_dir, new[doc_id]['path'])
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(os.path.join(json_dir, new[doc_id]['path']),
+                        dest_path)
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-p', '--plan',
+                           help='file where the change set will be written'
+                           ' as JSON')
+    ARGPARSER.add_argument('-s', '--solr',
+                           help='apply the change set to this Solr core,'
+                           ' e.g., http://localhost:8983/solr/corehw')
+    ARGPARSER.add_argument('-m', '--mirror',
+                           help='apply the change set to this directory of'
+                           ' JSON files, which matches old')
+    ARGPARSER.add_argument('-b', '--batch', type=int, default=500,
+                           help='documents or ids per Solr request')
+    ARGPARSER.add_argument('--save-manifest',
+                           help='file where the manifest of new will be'
+                           ' written for the next run')
+    ARGPARSER.add_argument('-g', '--generation-file',
+                           help='after applying, write a new generation to'
+                           ' this file to invalidate solrproxy.py caches')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes for hashing')
+    ARGPARSER.add_argument('old',
+                           help='jsonify.py output, catalog, or manifest of'
+                           ' what is indexed now')
+    ARGPARSER.add_argument('new',
+                           help='jsonify.py output, catalog, or manifest of'
+                           ' what should be indexed')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    OLD = load_manifest(ARGS.old, ARGS.jobs)
+    NEW = load_manifest(ARGS.new, ARGS.jobs)
+    PLAN = make_plan(OLD, NEW)
+    logging.info('%d to add, %d to update, %d to delete',
+                 len(PLAN['add']), len(PLAN['update']), len(PLAN['delete']))
+
+    if ARGS.plan:
+        with open(ARGS.plan, mode='w', encoding='UTF-8') as PLAN_FH:
+            json.dump(PLAN, PLAN_FH, ensure_ascii=False, indent=1)
+
+    # The JSON files to send are in new or in the directory its catalog
+    # describes
+    NEW_DIR = ARGS.new
+    if catalog.is_catalog(ARGS.new):
+        NEW_CATALOG = catalog.Catalog(ARGS.new)
+        NEW_DIR = NEW_CATALOG.root
+        NEW_CATALOG.close()
+    if (ARGS.solr or ARGS.mirror) and not (NEW_DIR and
+                                           os.path.isdir(NEW_DIR)):
+        ARGPARSER.error('applying changes needs new to be a directory or'
+                        ' catalog')
+    if ARGS.solr:
+        apply_to_solr(PLAN, NEW, NEW_DIR, ARGS.solr, ARGS.batch)
+    if ARGS.mirror:
+        apply_to_mirror(PLAN, OLD, NEW, NEW_DIR, ARGS.mirror)
+    if ARGS.generation_file and (ARGS.solr or ARGS.mirror):
+        # A new value on every sync, even one with the same ids as the last
+        with open(ARGS.generation_file, mode='w', encoding='UTF-8') as GEN_FH:
+            GEN_FH.write('{0}\n'.format(time.time_ns()))
+
+    if ARGS.save_manifest:
+        write_manifest(NEW, ARGS.save_manifest)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Search jsonify.py output offline with SQLite FTS5 instead of Solr.
+
+Loads the JSON files written by jsonify.py into one SQLite database:
+a docs table with indexed product, release, and booktitle columns for
+faceting, and an FTS5 index over title, ptext, and text. Ranking is
+bm25 with column weights that follow the /query handler in
+solrconfig.xml, where ptext is boosted twice as much as text. Child
+passage documents are not loaded separately; their text is searched as
+part of their page.
+
+Queries return a dict shaped like a Solr response: numFound, docs, and
+facet counts for product, release, and booktitle. With --serve, the
+database answers the /query requests of solr-search.js over HTTP in
+Solr's response format, as a local stand-in for load tests and
+development; cursorMark is emulated with an offset.
+
+For usage, run:
+    python3 sqlitesearch.py --help
+
+Typical use:
+    $ python3 sqlitesearch.py --load docs.hortonworks.com-json corehw.db
+    $ python3 sqlitesearch.py -q 'kerberos ambari' \
+        -f 'product:Data Platform' corehw.db
+    $ python3 sqlitesearch.py --serve 8985 corehw.db
+
+Needs a Python whose sqlite3 module was built with FTS5, which is true
+of the python.org and most Linux builds.
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socketserver
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# bm25 weights, in the column order of the docs_fts table
+WEIGHTS = {'title': 2.0, 'ptext': 2.0, 'text': 1.0}
+
+FACET_FIELDS = ('product', 'release', 'booktitle')
+
+# Fields stored in the docs table and returned with results
+STORED_FIELDS = ('id', 'url', 'title', 'product', 'release', 'booktitle',
+                 'summary')
+
+SCHEMA = '''
+CREATE TABLE docs (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE,
+    url TEXT,
+    title TEXT,
+    product TEXT,
+    release TEXT,
+    booktitle TEXT,
+    summary TEXT
+);
+CREATE VIRTUAL TABLE docs_fts USING fts5(
+    title, ptext, text, content='', tokenize='porter unicode61'
+);
+'''
+
+INDEXES = '''
+CREATE INDEX docs_product ON docs (product);
+CREATE INDEX docs_release ON docs (release);
+CREATE INDEX docs_booktitle ON docs (booktitle);
+'''
+
+
+def _load_task(json_path: str) -> tuple:
+    """Read one JSON file and return its docs row and docs_fts row."""
+    with open(json_path, encoding='UTF-8') as file_h:
+        meta = json.load(file_h)
+    if not meta.get('id'):
+        meta['id'] = meta.get('url', json_path)
+    # With jsonify.py --passages, the text of a page is split over its
+    # passage documents
+    meta['text'] = ' '.join(
+        [meta.get('text', '')] + [child.get('text', '') for child in
+                                  meta.get('_childDocuments_', [])])
+    doc = tuple(meta.get(field, '') for field in STORED_FIELDS)
+    fts = tuple(meta.get(field, '') for field in WEIGHTS)
+    return doc, fts
+
+
+def load(json_dir: str, db_file: str, jobs: int=None) -> int:
+    """Build a search database from a jsonify.py output tree.
+
+    The database is written next to db_file and renamed over it when
+    complete, so readers never see a partial index.
+
+    Args:
+        json_dir  Directory of JSON files written by jsonify.py.
+        db_file  Path of the SQLite database to write.
+        jobs  Number of worker processes reading JSON, defaults to the
+              CPU count.
+
+    Returns:
+        The number of documents loaded.
+    """
+    assert isinstance(json_dir, str), (
+        'json_dir is not a string: %r' % json_dir)
+    assert isinstance(db_file, str), (
+        'db_file is not a string: %r' % db_file)
+
+    paths = []
+    for dirpath, _, filenames in os.walk(json_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                paths.append(os.path.join(dirpath, filename))
+
+    tmp_file = db_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(SCHEMA)
+
+    count = 0
+    with conn, multiprocessing.Pool(jobs) as pool:
+        for doc, fts in pool.imap(_load_task, paths, chunksize=64):
+            try:
+                cursor = conn.execute(
+                    'INSERT INTO docs (id, url, title, product, release,'
+                    ' booktitle, summary) VALUES (?, ?, ?, ?, ?, ?, ?)', doc)
+            except sqlite3.IntegrityError:
+                logging.warning('Duplicate id: ' + doc[0])
+                continue
+            conn.execute('INSERT INTO docs_fts (rowid, title, ptext, text)'
+                         ' VALUES (?, ?, ?, ?)', (cursor.lastrowid,) + fts)
+            count += 1
+        conn.executescript(INDEXES)
+        conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('optimize')")
+    conn.execute('ANALYZE')
+    conn.close()
+    os.replace(tmp_file, db_file)
+    logging.info('Loaded %d documents into %s', count, db_file)
+    return count
+
+
+def to_match(query: str) -> str:
+    """Return an FTS5 MATCH expression requiring every word in query.
+
+    Words are quoted, so punctuation in user input is not taken as FTS5
+    syntax.
+    """
+    assert isinstance(query, str), (
+        'query is not a string: %r' % query)
+    words = re.findall(r'\w+', query)
+    return ' '.join('"{0}"'.format(word) for word in words)
+
+
+def search(conn: sqlite3.Connection, query: str='', filters: dict=None,
+           rows: int=10, start: int=0) -> dict:
+    """Search the database and count facet values of the matches.
+
+    Args:
+        conn  A connection to a database written by load().
+        query  Words that must all appear; empty matches every document.
+        filters  A dict of facet field to value that matches must have,
+                 like fq in Solr.
+        rows  Maximum number of documents returned.
+        start  Offset of the first document returned.
+
+    Returns:
+        A dict with numFound, docs (each with a score, higher is
+        better), and facets, a dict of field to [value, count] lists in
+        descending order of count.
+    """
+    assert isinstance(query, str), (
+        'query is not a string: %r' % query)
+    filters = filters or {}
+    for field in filters:
+        if field not in FACET_FIELDS:
+            raise ValueError('Cannot filter on ' + field)
+
+    match = to_match(query)
+    where = ['docs.{0} = ?'.format(field) for field in sorted(filters)]
+    params = [filters[field] for field in sorted(filters)]
+    if match:
+        hits = ('SELECT rowid, bm25(docs_fts, {0}) AS rank FROM docs_fts'
+                ' WHERE docs_fts MATCH ?'.format(
+                    ', '.join(str(weight) for weight in WEIGHTS.values())))
+        params.insert(0, match)
+    else:
+        hits = 'SELECT rowid, 0.0 AS rank FROM docs'
+    sql_from = ('FROM ({0}) AS hits JOIN docs ON docs.rowid = hits.rowid'
+                .format(hits))
+    if where:
+        sql_from += ' WHERE ' + ' AND '.join(where)
+
+    result = {'numFound': conn.execute('SELECT count(*) ' + sql_from,
+                                       params).fetchone()[0]}
+    cursor = conn.execute(
+        'SELECT {0}, -hits.rank {1} ORDER BY hits.rank, docs.id'
+        ' LIMIT ? OFFSET ?'.format(
+            ', '.join('docs.' + field for field in STORED_FIELDS), sql_from),
+        params + [rows, start])
+    result['docs'] = [dict(zip(STORED_FIELDS + ('score',), row))
+                      for row in cursor]
+    result['facets'] = {}
+    for field in FACET_FIELDS:
+        cursor = conn.execute(
+            'SELECT docs.{0}, count(*) AS n {1} GROUP BY docs.{0}'
+            ' ORDER BY n DESC, docs.{0}'.format(field, sql_from), params)
+        result['facets'][field] = [list(row) for row in cursor if row[0]]
+    return result
+
+
+def solr_response(conn: sqlite3.Connection, query_string: str) -> dict:
+    """Answer a query string sent by solr-search.js like Solr would.
+
+    Understands q (*:* or empty matches everything), fq=field:value,
+    rows, facet, and cursorMark, which is the offset of the next page
+    as a string.
+    """
+    assert isinstance(query_string, str), (
+        'query_string is not a string: %r' % query_string)
+    start_time = time.perf_counter()
+    params = urllib.parse.parse_qs(query_string, keep_blank_values=True)
+    query = params.get('q', [''])[0]
+    if query.strip() == '*:*':
+        query = ''
+    filters = {}
+    for fq in params.get('fq', []):
+        field, _, value = fq.partition(':')
+        filters[field.strip()] = value.strip().strip('"')
+    rows = int(params.get('rows', ['10'])[0])
+    cursor = params.get('cursorMark', ['*'])[0]
+    start = 0 if cursor in ('', '*') else int(cursor)
+
+    result = search(conn, query, filters, rows, start)
+    response = {
+        'response': {'numFound': result['numFound'], 'start': start,
+                     'docs': result['docs']},
+        'highlighting': {doc['id']: {} for doc in result['docs']},
+        'nextCursorMark': str(start + len(result['docs']) if
+                              result['docs'] else start)}
+    if params.get('facet', ['true'])[0] != 'false':
+        response['facet_counts'] = {'facet_fields': {
+            field: [item for pair in counts for item in pair]
+            for field, counts in result['facets'].items()}}
+    response['responseHeader'] = {
+        'status': 0,
+        'QTime': round((time.perf_counter() - start_time) * 1000)}
+    return response
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """Answer GET .../query with solr_response()."""
+
+    server_version = 'sqlitesearch/' + __version__
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are separate writes; without this, delayed ACKs
+    # add about 40 ms to every response on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        path, _, query_string = self.path.partition('?')
+        if not path.endswith('/query'):
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            self._send_json(200, solr_response(self.server.connection(),
+                                               query_string))
+        except (ValueError, sqlite3.Error) as err:
+            self._send_json(400, {'error': {'msg': str(err)}})
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug('%s %s', self.address_string(), format % args)
+
+
+class QueryServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server with one database connection per thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, db_file: str) -> None:
+        http.server.HTTPServer.__init__(self, address, QueryHandler)
+        self.db_file = db_file
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(
+                'file:{0}?mode=ro'.format(urllib.parse.quote(self.db_file)),
+                uri=True)
+        return self._local.conn
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('--load',
+                           help='directory of JSON files written by'
+                           ' jsonify.py; replaces the database')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes for loading')
+    ARGPARSER.add_argument('-q', '--query',
+                           help='words to search for; prints the results'
+                           ' as JSON')
+    ARGPARSER.add_argument('-f', '--filter', action='append', default=[],
+                           help='field:value that results must have, where'
+                           ' field is one of ' + ', '.join(FACET_FIELDS) +
+                           '; may be repeated')
+    ARGPARSER.add_argument('-r', '--rows', type=int, default=10,
+                           help='number of results, defaults to 10')
+    ARGPARSER.add_argument('-s', '--start', type=int, default=0,
+                           help='offset of the first result')
+    ARGPARSER.add_argument('--serve', type=int, metavar='PORT',
+                           help='answer solr-search.js queries on'
+                           ' http://localhost:PORT/solr/corehw/query')
+    ARGPARSER.add_argument('db_file',
+                           help='the SQLite database')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    if ARGS.load:
+        load(ARGS.load, ARGS.db_file, ARGS.jobs)
+
+    if ARGS.query is not None or ARGS.filter:
+        FILTERS = {}
+        for FILTER in ARGS.filter:
+            FIELD, _, VALUE = FILTER.partition(':')
+            FILTERS[FIELD] = VALUE
+        CONN = sqlite3.connect(ARGS.db_file)
+        START_TIME = time.perf_counter()
+        RESULT = search(CONN, ARGS.query or '', FILTERS, ARGS.rows,
+                        ARGS.start)
+        RESULT['QTime'] = round((time.perf_counter() - START_TIME) * 1000)
+        print(json.dumps(RESULT, ensure_ascii=False, indent=1))
+
+    if ARGS.serve:
+        SERVER = QueryServer(('localhost', ARGS.serve), ARGS.db_file)
+        logging.info('Serving %s on port %d', ARGS.db_file, ARGS.serve)
+        try:
+            SERVER.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            SERVER.server_close()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Add a static_rank field to jsonify.py output from its link graph.
+
+Pages that many other pages link to, directly or through other
+well-linked pages, are the hubs of the documentation. This stage
+computes PageRank over the links between pages and writes it to each
+JSON file as static_rank, scaled so the average page has 1.0. Solr
+boosts by it with a docValues function, adding no per-query analysis:
+    bf=log(sum(1,static_rank))
+
+The links come from jsonify.py --static-rank, which records, for each
+converted page, a JSON lines entry of
+    [url, JSON file path, [url of each linked page, ...]]
+while it walks the page, so HTML is not parsed twice. --retry appends
+to the same file; the last entry for a url wins. Links to pages that
+are not in the output are ignored.
+
+The graph is held as arrays of page numbers, eight bytes per link, and
+the JSON files are rewritten in parallel. Uses numpy when it is
+installed, otherwise pure Python, which is several times slower.
+
+For usage, run:
+    python3 staticrank.py --help
+
+Run it again with different settings on an existing links file:
+    $ python3 staticrank.py -d 0.7 jsonify-links.jsonl
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+__version__ = '0.0.1'
+
+import argparse
+import array
+import json
+import logging
+import multiprocessing
+import os
+
+import serializers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Probability of following a link rather than jumping to a random page
+DAMPING = 0.85
+
+# Iterations stop when the mean change of a rank falls below TOLERANCE
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-6
+
+
+def read_graph(links_file: str) -> tuple:
+    """Read a links file into page urls, JSON paths, and link arrays.
+
+    Returns:
+        A tuple of a list of urls, a list of JSON paths in the same
+        order, and two arrays of the same length holding the source and
+        target page number of each link.
+    """
+    assert isinstance(links_file, str), (
+        'links_file is not a string: %r' % links_file)
+
+    # Number the pages, keeping the line of the last entry of each
+    numbers = {}
+    paths = []
+    last_line = []
+    with open(links_file, encoding='UTF-8') as file_h:
+        for line_number, line in enumerate(file_h):
+            url, json_path, _ = json.loads(line)
+            if url not in numbers:
+                numbers[url] = len(paths)
+                paths.append(json_path)
+                last_line.append(line_number)
+            else:
+                paths[numbers[url]] = json_path
+                last_line[numbers[url]] = line_number
+
+    sources = array.array('I')
+    targets = array.array('I')
+    with open(links_file, encoding='UTF-8') as file_h:
+        for line_number, line in enumerate(file_h):
+            url, _, linked = json.loads(line)
+            source = numbers[url]
+            if last_line[source] != line_number:
+                continue
+            for target_url in linked:
+                target = numbers.get(target_url)
+                if target is not None and target != source:
+                    sources.append(source)
+                    targets.append(target)
+    urls = sorted(numbers, key=numbers.get)
+    logging.info('Read %d pages and %d links from %s', len(urls),
+                 len(sources), links_file)
+    return urls, paths, sources, targets
+
+
+def pagerank(count: int, sources: array.array, targets: array.array,
+             damping: float=DAMPING) -> list:
+    """Compute PageRank by power iteration.
+
+    The rank of pages without links is spread over all pages.
+
+    Args:
+        count  Number of pages.
+        sources  Source page number of each link.
+        targets  Target page number of each link.
+        damping  Probability of following a link.
+
+    Returns:
+        A list of ranks by page number, averaging 1.0.
+    """
+    if count == 0:
+        return []
+    if numpy is not None:
+        sources = numpy.frombuffer(sources, dtype=numpy.uint32)
+        targets = numpy.frombuffer(targets, dtype=numpy.uint32)
+        out_degree = numpy.bincount(sources, minlength=count)
+        dangling = out_degree == 0
+        out_degree[dangling] = 1
+        rank = numpy.ones(count)
+        for iteration in range(MAX_ITERATIONS):
+            base = 1 - damping + damping * rank[dangling].sum() / count
+            new = base + damping * numpy.bincount(
+                targets, weights=(rank / out_degree)[sources],
+                minlength=count)
+            change = numpy.abs(new - rank).sum() / count
+            rank = new
+            if change < TOLERANCE:
+                break
+        logging.info('PageRank converged after %d iterations', iteration + 1)
+        return rank.tolist()
+
+    out_degree = array.array('I', bytes(4 * count))
+    for source in sources:
+        out_degree[source] += 1
+    rank = [1.0] * count
+    for iteration in range(MAX_ITERATIONS):
+        base = 1 - damping + damping * sum(
+            rank[page] for page in range(count)
+            if not out_degree[page]) / count
+        share = [damping * rank[page] / out_degree[page]
+                 if out_degree[page] else 0.0 for page in range(count)]
+        new = [base] * count
+        for source, target in zip(sources, targets):
+            new[target] += share[source]
+        change = sum(abs(x - y) for x, y in zip(new, rank)) / count
+        rank = new
+        if change < TOLERANCE:
+            break
+    logging.info('PageRank converged after %d iterations', iteration + 1)
+    return rank
+
+
+def _rewrite_task(task: tuple) -> bool:
+    """Set the static_rank field of one JSON file; False if it is gone,
+    as after dedupe.py --drop.
+    """
+    json_path, rank, serializer = task
+    try:
+        with open(json_path, encoding='UTF-8') as file_h:
+            meta = json.load(file_h)
+    except FileNotFoundError:
+        return False
+    meta['static_rank'] = round(rank, 4)
+    serializers.write_json(meta, json_path,
+                           serializers.get_serializer(serializer))
+    return True
+
+
+def static_rank(links_file: str, jobs: int=None,
+                damping: float=DAMPING, serializer: str='json') -> dict:
+    """Compute static ranks from a links file and write them to the
+    JSON files it lists.
+
+    Args:
+        links_file  JSON lines file written by jsonify.py --static-rank.
+        jobs  Number of worker processes, defaults to the CPU count.
+        damping  Probability of following a link.
+        serializer  Name of the function the JSON files are rewritten
+                    with; see serializers.get_serializer().
+
+    Returns:
+        A dict of the ranks by url.
+    """
+    urls, paths, sources, targets = read_graph(links_file)
+    ranks = pagerank(len(urls), sources, targets, damping)
+    with multiprocessing.Pool(jobs) as pool:
+        written = sum(pool.imap_unordered(
+            _rewrite_task, [(path, rank, serializer) for path, rank in
+                            zip(paths, ranks)], chunksize=64))
+    logging.info('Wrote static_rank to %d files', written)
+    return dict(zip(urls, ranks))
+
+
+# Command-line interface
+if __name__ == '__main__':
+
+    # Get command-line arguments
+    ARGPARSER = argparse.ArgumentParser()
+    BASENAME, _ = os.path.splitext(os.path.basename(__file__))
+    ARGPARSER.add_argument('-l', '--logfile', default=BASENAME + '.log',
+                           help='the log file, defaults to ./' + BASENAME +
+                           '.log')
+    ARGPARSER.add_argument('-v', '--verbosity', type=int, default=2,
+                           help='message level for log',
+                           choices=[1, 2, 3, 4, 5])
+    ARGPARSER.add_argument('-d', '--damping', type=float, default=DAMPING,
+                           help='probability of following a link, defaults'
+                           ' to %s' % DAMPING)
+    ARGPARSER.add_argument('-t', '--top', type=int, default=0,
+                           help='print the urls of this many top pages')
+    ARGPARSER.add_argument('-j', '--jobs', type=int,
+                           help='number of worker processes')
+    ARGPARSER.add_argument('--serializer', default='json',
+                           choices=sorted(serializers.SERIALIZERS) +
+                           ['auto'],
+                           help='JSON encoder, defaults to json, the standard'
+                           ' library; auto picks the fastest installed')
+    ARGPARSER.add_argument('links_file',
+                           help='JSON lines file written by jsonify.py'
+                           ' --static-rank; the JSON files it lists are'
+                           ' modified in place')
+    ARGS = ARGPARSER.parse_args()
+
+    # https://docs.python.org/3/library/logging.html#levels
+    ARGS.verbosity *= 10  # debug, info, warning, error, critical
+
+    # Set up logging
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(message)s', filemode='w',
+        filename=ARGS.logfile)
+    logging.getLogger().setLevel(ARGS.verbosity)
+
+    RANKS = static_rank(ARGS.links_file, ARGS.jobs, ARGS.damping,
+                        ARGS.serializer)
+    for URL in sorted(RANKS, key=RANKS.get, reverse=True)[:ARGS.top]:
+        print('{0:10.4f} {1}'.format(RANKS[URL], URL))
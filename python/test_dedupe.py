@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Tests for dedupe.py.
+
+For usage, run:
+    python3 -m unittest test_dedupe
+
+Questions: Robert Crews <rcrews@hortonworks.com>
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import dedupe
+
+# Site navigation repeated on every page, as on the landing pages of
+# each product
+CHROME = ' '.join('nav{0} link{0} menu{0}'.format(number)
+                  for number in range(60))
+
+
+def write_docs(src_dir: str, docs: list) -> None:
+    """Write (name, product, booktitle, release, text) tuples as
+    jsonify.py output.
+    """
+    for name, product, booktitle, release, text in docs:
+        meta = {'id': '/' + name, 'url': '/' + name, 'product': product,
+                'booktitle': booktitle, 'release': release, 'text': text}
+        with open(os.path.join(src_dir, name + '.json'), mode='w',
+                  encoding='UTF-8') as file_h:
+            json.dump(meta, file_h)
+
+
+def read_docs(src_dir: str) -> dict:
+    """Return the documents of src_dir by id."""
+    docs = {}
+    for path in dedupe.iter_jsons(src_dir):
+        with open(path, encoding='UTF-8') as file_h:
+            meta = json.load(file_h)
+        docs[meta['id']] = meta
+    return docs
+
+
+class SharedChromeTest(unittest.TestCase):
+    """Pages of different products that share navigation."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_docs(self.tmp.name, [
+            ('ambari-2.1', 'Ambari', '', '2.1.0.0',
+             CHROME + ' ambari install guide'),
+            ('ambari-2.2', 'Ambari', '', '2.2.0.0',
+             CHROME + ' ambari install guide'),
+            ('hdp-2.4', 'Data Platform', '', '2.4.0.0',
+             CHROME + ' hadoop release notes'),
+            ('short', 'Ambari', '', '2.2.0.0', 'too short')])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_groups_stay_within_a_product(self):
+        stats = dedupe.dedupe(self.tmp.name, jobs=1)
+        docs = read_docs(self.tmp.name)
+        self.assertEqual(stats, {'documents': 4, 'groups': 3,
+                                 'duplicates': 1})
+        self.assertEqual(docs['/ambari-2.1']['dup_group'], '/ambari-2.2')
+        self.assertTrue(docs['/ambari-2.2']['canonical'])
+        self.assertEqual(docs['/hdp-2.4']['dup_group'], '/hdp-2.4')
+        self.assertTrue(docs['/hdp-2.4']['canonical'])
+        self.assertEqual(docs['/short']['dup_group'], '/short')
+
+    def test_drop_keeps_every_product(self):
+        dedupe.dedupe(self.tmp.name, drop=True, jobs=1)
+        self.assertEqual(sorted(read_docs(self.tmp.name)),
+                         ['/ambari-2.2', '/hdp-2.4', '/short'])
+
+
+if __name__ == '__main__':
+    unittest.main()
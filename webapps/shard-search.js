@@ -0,0 +1,160 @@
+/*
+ * Search one book or one release in the browser, without Solr.
+ * Reads the shard bundles written by searchbundles.py: shards.json lists the
+ * files of each product/release/booktitle, which are fetched only when a
+ * search needs them and kept for the rest of the page view.
+ */
+
+var shardbase = "shards/"; // Written by searchbundles.py.
+var shardManifest = null;
+var shardFiles = {}; // File name -> parsed shard, or the callbacks waiting for it.
+var shardMaxFiles = 8; // Broader scopes go to Solr.
+var shardRows = 50;
+var shardStopwords = {};
+("a an and are as at be by for from has have how in is it its of on or " +
+ "that the this to was were will with you your").split(" ").forEach(function(word){
+    shardStopwords[word] = true;
+});
+
+/*
+ * Fetch the manifest once per page view. The HTTP cache revalidates it.
+ */
+function loadShardManifest(){
+    "use strict";
+    var mreq = createRequest();
+    mreq.open("GET", shardbase + "shards.json", true);
+    mreq.onreadystatechange = function(){
+        if(mreq.readyState === 4 && mreq.status === 200){
+            var manifest = JSON.parse(mreq.responseText);
+            if(manifest.version === 1){
+                shardManifest = manifest;
+            }
+        }
+    };
+    mreq.send();
+}
+
+/*
+ * Split text into terms the same way searchbundles.py does.
+ */
+function shardTokenize(text){
+    "use strict";
+    var words = text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [];
+    return words.filter(function(word){
+        return word.length > 1 && shardStopwords[word] !== true;
+    });
+}
+
+/*
+ * Return the manifest entries matching every filter that is not null.
+ * Shards are keyed by the indexed values, as in the facet bundle, not by fuller names.
+ */
+function findShards(product, release, booktitle){
+    "use strict";
+    return shardManifest.shards.filter(function(shard){
+        return (product === null || shard.product === product) &&
+            (release === null || shard.release === release) &&
+            (booktitle === null || shard.booktitle === booktitle);
+    });
+}
+
+/*
+ * Call callback with the parsed shard file, fetching it only the first time.
+ * Files are named by content hash, so a cached copy is never stale.
+ */
+function fetchShardFile(name, callback){
+    "use strict";
+    var cached = shardFiles[name];
+    if(cached !== undefined && !Array.isArray(cached)){
+        callback(cached);
+        return;
+    }
+    if(Array.isArray(cached)){
+        cached.push(callback); // Already on its way.
+        return;
+    }
+    shardFiles[name] = [callback];
+    var sreq = createRequest();
+    sreq.open("GET", shardbase + name, true);
+    sreq.onreadystatechange = function(){
+        if(sreq.readyState !== 4){
+            return;
+        }
+        var waiting = shardFiles[name];
+        var shard = {docs: [], terms: {}};
+        if(sreq.status === 200){
+            shard = JSON.parse(sreq.responseText);
+            shardFiles[name] = shard;
+        }else{
+            delete shardFiles[name]; // Try again next time.
+        }
+        waiting.forEach(function(waiter){ waiter(shard); });
+    };
+    sreq.send();
+}
+
+/*
+ * Score the documents of one shard file that contain every term.
+ * Each term adds (1 + log tf) * idf, with tf weighted by field at build time.
+ */
+function scoreShard(shard, terms, entry, results){
+    "use strict";
+    var scores = {};
+    var matched = {};
+    var total = shard.docs.length;
+    terms.forEach(function(term){
+        var postings = shard.terms[term] || [];
+        var idf = Math.log(1 + total / Math.max(1, postings.length / 2));
+        for(var i = 0; i < postings.length; i += 2){
+            var doc = postings[i];
+            scores[doc] = (scores[doc] || 0) + (1 + Math.log(postings[i + 1])) * idf;
+            matched[doc] = (matched[doc] || 0) + 1;
+        }
+    });
+    Object.keys(scores).forEach(function(doc){
+        if(matched[doc] === terms.length){
+            var fields = shard.docs[doc];
+            results.push({id: fields[0], url: fields[0], title: fields[1],
+                          summary: fields[2] || undefined, product: entry.product,
+                          release: entry.release, booktitle: entry.booktitle,
+                          score: scores[doc]});
+        }
+    });
+}
+
+/*
+ * Search the shards in scope and pass callback a response shaped like Solr's.
+ * Returns false, without calling callback, when the manifest is not loaded,
+ * there is no query or filter, or the scope needs more than shardMaxFiles files.
+ */
+function shardSearch(query, product, release, booktitle, callback){
+    "use strict";
+    if(shardManifest === null || (product === null && release === null && booktitle === null)){
+        return false;
+    }
+    var terms = shardTokenize(query);
+    var shards = findShards(product, release, booktitle);
+    var files = [];
+    shards.forEach(function(shard){
+        shard.files.forEach(function(name){ files.push([name, shard]); });
+    });
+    if(terms.length === 0 || files.length === 0 || files.length > shardMaxFiles){
+        return false;
+    }
+    var results = [];
+    var remaining = files.length;
+    files.forEach(function(file){
+        fetchShardFile(file[0], function(shard){
+            scoreShard(shard, terms, file[1], results);
+            remaining -= 1;
+            if(remaining === 0){
+                results.sort(function(a, b){ return b.score - a.score || (a.id < b.id ? -1 : 1); });
+                var highlighting = {};
+                results.forEach(function(doc){ highlighting[doc.id] = {}; });
+                callback({response: {numFound: results.length, docs: results.slice(0, shardRows)},
+                          highlighting: highlighting});
+            }
+        });
+    });
+    return true;
+}
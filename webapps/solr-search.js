@@ -17,23 +17,129 @@ var display = false; // For the initURL call to grab facets but not display *:*
 var productComplete = null;
 var releaseComplete = null;
 var bkComplete = null;
+var bundleurl = "facets-bundle.json"; // Written by facets.py --bundle.
+var bundlekey = "solr-search-facets-bundle"; // localStorage key for the cached bundle.
+var facetBundle = null;
+var activeRequest = null; // The request whose response will be displayed.
+var prefetch = null; // {key, request, onload, onerror} of the next page being fetched.
+var requestSeq = 0; // Bumped by every action; responses to older ones are dropped.
+var pageCacheSize = 50; // Responses kept, least recently used evicted first.
+var pageCache = {}; // cacheKey -> response text.
+var pageCacheKeys = []; // Least recently used first.
+var searchDelay = 300; // Milliseconds of typing pause before searching.
+var searchMinChars = 3;
+var searchTimer = null;
 
 /*
  * Initialize variables for the autocomplete feature once the page loads.
- * Call the initial URL to grab the facet details for product/release/booktitle.
+ * Fill the autocompletes from the cached facet bundle, then revalidate it.
+ * Only call the initial URL for the facet details when no bundle is available.
  */
 window.onload = function(){
     initURL = "http://localhost:8983/solr/corehw/query";    //?q=*:*&facet=true&facet.field=product&facet.field=release&facet.field=booktitle";
     var iproduct = document.getElementById("productGrab");
     var irelease = document.getElementById("releaseGrab");
     var ibooktitle = document.getElementById("bktitleGrab");
+    document.getElementById("q").addEventListener("input", function(){ debounceSearch(this.value); });
+    // Registered before Awesomplete so the list is narrowed before it is evaluated.
+    iproduct.addEventListener("input", function(){ narrowList(productComplete, "product", this.value); });
+    irelease.addEventListener("input", function(){ narrowList(releaseComplete, "release", this.value); });
+    ibooktitle.addEventListener("input", function(){ narrowList(bkComplete, "booktitle", this.value); });
     productComplete = new Awesomplete(iproduct);
     productComplete.minChars = 1;
     releaseComplete = new Awesomplete(irelease);
     releaseComplete.minChars = 1;
     bkComplete = new Awesomplete(ibooktitle);
     bkComplete.minChars = 1;
-    GetResponse(initURL);
+    loadCachedBundle();
+    fetchBundle();
+    loadShardManifest(); // In shard-search.js.
+}
+
+/*
+ * Fill the autocompletes from the bundle stored by a previous page view, if any.
+ */
+function loadCachedBundle(){
+    try {
+        var cached = window.localStorage.getItem(bundlekey);
+        if(cached !== null){
+            applyBundle(JSON.parse(cached));
+        }
+    } catch (e) {
+        // Storage disabled or stale content; the fetch below replaces it.
+    }
+}
+
+/*
+ * Fetch the static facet bundle. The HTTP cache revalidates it by ETag.
+ * Fall back to the *:* facet query if there is no usable bundle at all.
+ */
+function fetchBundle(){
+    var breq = createRequest();
+    breq.open("GET", bundleurl, true);
+    breq.onreadystatechange = function(){
+        if(breq.readyState !== 4){
+            return;
+        }
+        if(breq.status === 200){
+            var bundle = JSON.parse(breq.responseText);
+            if(bundle.version === 1){
+                if(facetBundle === null || facetBundle.etag !== bundle.etag){
+                    applyBundle(bundle);
+                    try {
+                        window.localStorage.setItem(bundlekey, breq.responseText);
+                    } catch (e) {
+                        // Quota exceeded or storage disabled.
+                    }
+                }
+                return;
+            }
+        }
+        if(facetBundle === null){
+            GetResponse(initURL);
+        }
+    };
+    breq.send();
+}
+
+/*
+ * Assign autocomplete lists from the facet bundle.
+ * Values in the bundle are [value, document count] pairs.
+ */
+function applyBundle(bundle){
+    facetBundle = bundle;
+    productComplete.list = bundleValues("product", null);
+    releaseComplete.list = bundleValues("release", null);
+    bkComplete.list = bundleValues("booktitle", null);
+    display = true; // Facets are loaded; responses are search results from now on.
+}
+
+/*
+ * Values of a bundle field, limited to the given positions if not null.
+ */
+function bundleValues(field, positions){
+    var values = facetBundle.fields[field].values;
+    if(positions === null){
+        return values.map(function(pair){ return pair[0]; });
+    }
+    return positions.map(function(position){ return values[position][0]; });
+}
+
+/*
+ * Use the bundle prefix index to narrow an autocomplete list to values
+ * with a word starting like the first word typed.
+ */
+function narrowList(complete, field, text){
+    if(facetBundle === null || complete === null){
+        return;
+    }
+    var word = text.trim().toLowerCase().split(/\s+/)[0];
+    if(word === ""){
+        complete.list = bundleValues(field, null);
+        return;
+    }
+    var positions = facetBundle.fields[field].prefixes[word.substring(0, 3)];
+    complete.list = bundleValues(field, positions === undefined ? [] : positions);
 }
 
 /*
@@ -49,50 +155,218 @@ function createRequest() {
     return result;
 }
 
-var req = createRequest();
-
 /*
- * Send http request to the solr URL generated.
+ * Send http request to the solr URL generated, superseding any request still
+ * on its way. Responses are cached by cacheKey, and a prefetch of the same
+ * page is reused rather than sent again.
  */
 function GetResponse(url) {
     "use strict";
-    req.open("GET", url, true);
-    req.send();
-    //console.log("REQUEST SENT");
+    var key = cacheKey(url);
+    var seq = cancelRequests(key);
+    var cached = cacheGet(key);
+    if(cached !== undefined){
+        onGettingResponse(cached);
+        return;
+    }
+    var show = function(text){
+        if(seq === requestSeq){
+            activeRequest = null;
+            onGettingResponse(text);
+        }
+    };
+    if(prefetch !== null && prefetch.key === key){
+        prefetch.onload = show; // Already on its way.
+        prefetch.onerror = function(){ // Ask again with a request of its own.
+            if(seq === requestSeq){
+                activeRequest = fetchUrl(url, show);
+            }
+        };
+        return;
+    }
+    activeRequest = fetchUrl(url, show);
+}
+
+/*
+ * Abort the displayed request, and any prefetch for a search other than that of
+ * key (null aborts every prefetch). Returns the new sequence number; callbacks
+ * of older actions compare theirs to requestSeq and drop their response.
+ */
+function cancelRequests(key){
+    "use strict";
+    if(activeRequest !== null){
+        activeRequest.abort();
+        activeRequest = null;
+    }
+    if(prefetch !== null && (key === null || searchKey(prefetch.key) !== searchKey(key))){
+        prefetch.request.abort();
+        prefetch = null;
+    }
+    requestSeq += 1;
+    return requestSeq;
+}
+
+/*
+ * GET url with a request of its own and pass callback the response text.
+ * Successful responses are cached. Failed ones call onerror, if given;
+ * aborted ones call nothing.
+ */
+function fetchUrl(url, callback, onerror){
+    "use strict";
+    var xreq = createRequest();
+    var fail = function(){
+        if(onerror !== undefined){
+            onerror();
+        }
+    };
+    xreq.open("GET", url, true);
+    xreq.onload = function(){
+        if(xreq.status === 200){
+            cachePut(cacheKey(url), xreq.responseText);
+            callback(xreq.responseText);
+        }else{
+            fail();
+        }
+    };
+    xreq.onerror = fail;
+    xreq.send();
+    return xreq;
+}
+
+/*
+ * Fetch a page into the cache in the background, unless it is already there.
+ */
+function prefetchPage(url){
+    "use strict";
+    var key = cacheKey(url);
+    if(pageCache.hasOwnProperty(key) || (prefetch !== null && prefetch.key === key)){
+        return;
+    }
+    if(prefetch !== null){
+        prefetch.request.abort();
+    }
+    var entry = {key: key, onload: null, onerror: null};
+    entry.request = fetchUrl(url, function(text){
+        if(prefetch === entry){
+            prefetch = null;
+        }
+        if(entry.onload !== null){
+            entry.onload(text);
+        }
+    }, function(){
+        if(prefetch === entry){
+            prefetch = null;
+        }
+        if(entry.onerror !== null){
+            entry.onerror();
+        }
+    });
+    prefetch = entry;
+}
+
+/*
+ * Cache key of a Solr URL: parameters decoded and sorted, and whitespace collapsed.
+ * Case is kept: ptext is a string field, so its matches depend on case.
+ */
+function cacheKey(url){
+    "use strict";
+    var parts = url.split("?");
+    var params = (parts[1] || "").split("&").filter(function(param){
+        return param !== "";
+    }).map(function(param){
+        var pair = param.split("=");
+        var name = decodeURIComponent(pair[0]);
+        var value = decodeURIComponent(pair.slice(1).join("="));
+        return name + "=" + normalizeQuery(value);
+    });
+    return parts[0] + "?" + params.sort().join("&");
+}
+
+/*
+ * Cache key without the cursor mark: the same for every page of a search.
+ */
+function searchKey(key){
+    "use strict";
+    return key.replace(/([?&])cursorMark=[^&]*&?/, "$1");
+}
+
+function normalizeQuery(text){
+    "use strict";
+    return text.trim().replace(/\s+/g, " ");
+}
+
+/*
+ * Return the cached response text for key, or undefined, and mark it recently used.
+ */
+function cacheGet(key){
+    "use strict";
+    if(!pageCache.hasOwnProperty(key)){
+        return undefined;
+    }
+    pageCacheKeys.splice(pageCacheKeys.indexOf(key), 1);
+    pageCacheKeys.push(key);
+    return pageCache[key];
+}
+
+/*
+ * Cache a response text, evicting the least recently used beyond pageCacheSize.
+ */
+function cachePut(key, text){
+    "use strict";
+    if(pageCache.hasOwnProperty(key)){
+        pageCacheKeys.splice(pageCacheKeys.indexOf(key), 1);
+    }
+    pageCache[key] = text;
+    pageCacheKeys.push(key);
+    while(pageCacheKeys.length > pageCacheSize){
+        delete pageCache[pageCacheKeys.shift()];
+    }
+}
+
+/*
+ * Search as the user types, once typing pauses for searchDelay milliseconds.
+ */
+function debounceSearch(text){
+    "use strict";
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(function(){
+        searchTimer = null;
+        if(text.trim().length >= searchMinChars && normalizeQuery(text) !== normalizeQuery(q)){
+            UponSubmit();
+        }
+    }, searchDelay);
 }
 
 /*
  * If display flag is false (page just loaded) ; Read facet information for autocomplete features and update display flag.
- * Make JSON object from the response received and call parsing functions.
+ * Make JSON object from the response text and call parsing functions.
  * ->GetIncoming for reading the search results.
  * -> GetFacets for reading the facet tags.
  * Read cursormarker and check if the pagearray needs to be updated.
+ * Prefetch the next page of search results.
  */
-function onGettingResponse() {
+function onGettingResponse(text) {
     "use strict";
-    //console.log("Ready state is:" + req.readyState);
-    //console.log("Ready status:" + req.status);
-    if (req.readyState === 4) {
-        var Data = JSON.parse(req.responseText);
-        //console.log(Data.response);
-        //console.log(Data.responseHeader);
-        //console.log(Data.nextCursorMark);
-        var out = GetIncoming(Data);
-        if(facet!=false) var facets = GetFacets(Data);
-        nextCursorMarker = Data.nextCursorMark;
-        addnewCursorMarker(nextCursorMarker);
-        if(display == true){
+    var Data = JSON.parse(text);
+    //console.log(Data.response);
+    //console.log(Data.responseHeader);
+    //console.log(Data.nextCursorMark);
+    var out = GetIncoming(Data);
+    if(facet!=false) var facets = GetFacets(Data);
+    nextCursorMarker = Data.nextCursorMark;
+    addnewCursorMarker(nextCursorMarker);
+    if(display == true){
         document.getElementById("incoming").innerHTML = out;
         //document.getElementById("Facets").innerHTML = facets;
-        }else{
-            loadAutoCompletes(Data);
-            display = true;
+        if(nextCursorMarker !== undefined && nextCursorMarker !== cursorMark){
+            prefetchPage(MakeUrl(baseurl,q,nextCursorMarker,facet,fq1,fq2,fq3));
         }
+    }else{
+        loadAutoCompletes(Data);
+        display = true;
     }
 }
 
-req.onreadystatechange = onGettingResponse;
-
 /*
  * Parse Json object and read facets tag from response.
  */
@@ -112,6 +386,16 @@ function GetFacets(Data){
     return facets;
 }
 
+/*
+ * Escape page text for insertion as HTML. Highlighted snippets are escaped by
+ * Solr (hl.encoder=html), so only their <em> tags are markup.
+ */
+function escapeHtml(text){
+    "use strict";
+    return String(text).replace(/&/g, "&amp;").replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
 /*
  * Parse json object and read data tag from response.
  * read highlighting tag for text snippet.
@@ -121,20 +405,30 @@ function GetIncoming(Data){
     trailingdots = "\u2026";
     Data.response.docs.forEach(function AddIncomingToHtml(value){
         var urlstring = "http://docs.hortonworks.com/HDPDocuments"+value.url;
-        textmaterial = value.text;
+        var title = escapeHtml(value.title);
+        if(value.section_title !== undefined){
+            title += " \u203a " + escapeHtml(value.section_title); // Passage document.
+        }
         var i_id = value.id;
         var highlightedText = Data.highlighting[i_id].text;
-        if(textmaterial === undefined){
-            out += "<a href=" + urlstring + ">" + value.title +
+        var snippet = value.summary; // Precomputed by jsonify; no need to fetch text.
+        if(snippet !== undefined){
+            snippet = escapeHtml(snippet);
+        }
+        if(highlightedText !== undefined){
+            snippet = trailingdots+" "+highlightedText +" "+ trailingdots;
+        }
+        if(snippet === undefined){
+            out += "<a href=" + urlstring + ">" + title +
                     "</a><br />" + urlstring + "<br />"  +
-                    "<font size=1 color=blue>["+value.product+"/"+value.release+"/"+value.booktitle+"]</font>" +
+                    "<font size=1 color=blue>["+escapeHtml(value.product+"/"+value.release+"/"+value.booktitle)+"]</font>" +
                     "<br / >"; 
         }else{
-            out += "<a href=" + urlstring + ">" + value.title +
+            out += "<a href=" + urlstring + ">" + title +
                     "</a><br />" + urlstring + "<br />" +
-                    "<font size=1 color=blue>["+value.product+"/"+value.release+"/"+value.booktitle+"]</font>" +
+                    "<font size=1 color=blue>["+escapeHtml(value.product+"/"+value.release+"/"+value.booktitle)+"]</font>" +
                     "<br />"+ 
-                     trailingdots+" "+highlightedText +" "+ trailingdots +
+                     snippet +
                     "<br / ><br />"; 
         }
     });
@@ -150,6 +444,7 @@ function GetIncoming(Data){
  */
 function UponSubmit() {
     "use strict";
+    clearTimeout(searchTimer);
     pageArray=[];
     current=0;
     document.getElementById("productGrab").placeholder="product...";
@@ -208,6 +503,7 @@ function UponPrev() {
 /*
  * Check what filters are active from the user.
  * set those appropriate filter queries to those values grabbed
+ * The autocompletes offer indexed values, which filter queries and shard keys match.
  * Make another URL.
  * Send Request.
  */
@@ -234,6 +530,19 @@ function UponFilter(){
     }else{
         fq3 = null;
     }
+    // A new filter starts again from the first page; shard results have no next page.
+    pageArray = ["*"];
+    current = 0;
+    cursorMark = pageArray[current];
+    // A single book or release is searched in the browser when its shards are small.
+    var seq = cancelRequests(null);
+    if(shardSearch(q, fq1, fq2, fq3, function(Data){
+        if(seq === requestSeq){
+            document.getElementById("incoming").innerHTML = GetIncoming(Data);
+        }
+    })){
+        return;
+    }
     var urlToUse = MakeUrl(baseurl,q,cursorMark,facet,fq1,fq2,fq3);
     GetResponse(urlToUse);
 }
@@ -261,18 +570,19 @@ function addnewCursorMarker(newCursorMarker) {
 
 /*
  * Append the parameters to generate new Solr URL.
+ * Values are encoded: cursor marks contain "+" and "/", and queries may contain "&".
  */
 function MakeUrl(baseurl,q,cursorMark,facet,fq1,fq2,fq3){
     console.log("Debugging cmarker:"+cursorMark);
-    var url = baseurl+"q="+q+"&cursorMark="+cursorMark+"&facet="+facet;
+    var url = baseurl+"q="+encodeURIComponent(q)+"&cursorMark="+encodeURIComponent(cursorMark)+"&facet="+facet;
     if(fq1 != null){
-        url = url + "&fq=product:"+fq1;
+        url = url + "&fq="+encodeURIComponent("product:"+fq1);
     }
     if(fq2 != null){
-        url = url + "&fq=release:"+fq2;
+        url = url + "&fq="+encodeURIComponent("release:"+fq2);
     }
     if(fq3 != null){
-        url = url + "&fq=booktitle:"+fq3;
+        url = url + "&fq="+encodeURIComponent("booktitle:"+fq3);
     }
     return url;
    